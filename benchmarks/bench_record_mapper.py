@@ -0,0 +1,121 @@
+"""Micro-benchmark: per-record dict building vs the compiled RecordMapper
+
+The legacy path converts no values, so it is compared with the mapper
+with its field_types disabled; the converting mapper is timed separately.
+Run from the repository root:
+
+    python -m benchmarks.bench_record_mapper --records 100000
+"""
+import argparse
+import random
+import time
+from typing import Any, Dict, List
+
+from src.config import TABLE_SCHEMAS
+from src.db.record_mapper import RecordMapper
+
+
+def synthetic_measurements(count: int, seed: int = 7) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    parameters = [('pm25', 'µg/m³'), ('pm10', 'µg/m³'), ('o3', 'ppm'), ('no2', 'ppm')]
+    records = []
+    for index in range(count):
+        parameter, unit = parameters[index % len(parameters)]
+        hour = index % 24
+        records.append({
+            'locationId': rng.randint(1, 5000),
+            'location': f"Station {index % 5000}",
+            'parameter': parameter,
+            'value': round(rng.uniform(0, 150), 2),
+            'date': {
+                'utc': f"2024-03-{1 + index % 28:02d}T{hour:02d}:00:00+00:00",
+                'local': f"2024-03-{1 + index % 28:02d}T{hour:02d}:00:00+02:00"
+            },
+            'unit': unit,
+            'coordinates': {'latitude': rng.uniform(-90, 90), 'longitude': rng.uniform(-180, 180)},
+            'country': rng.choice(['IL', 'US', 'DE', 'IN']),
+            'city': None
+        })
+    return records
+
+
+def legacy_process_measurement(data: Dict) -> Dict:
+    """Per-record conversion as done by Database._process_data before RecordMapper"""
+    try:
+        return {
+            'location_id': data['locationId'],
+            'parameter': data['parameter'],
+            'value': data['value'],
+            'unit': data['unit'],
+            'timestamp_utc': data['date']['utc'],
+            'timestamp_local': data['date']['local'],
+            'latitude': data['coordinates']['latitude'],
+            'longitude': data['coordinates']['longitude'],
+            'country': data['country'],
+            'city': data.get('city')
+        }
+    except KeyError as e:
+        raise Exception(f"Missing required field in data: {e}")
+
+
+def legacy_build_upsert_query(schema: Dict[str, Any], data: Dict[str, Any]) -> tuple:
+    """Per-row SQL generation as done by Database._build_upsert_query before RecordMapper"""
+    columns = schema['columns']
+    columns_data = {}
+    for k, v in data.items():
+        if k in columns:
+            columns_data[k] = v
+
+    used_columns = list(columns_data.keys())
+    values = [columns_data[col] for col in used_columns]
+    placeholders = ', '.join(['%s'] * len(used_columns))
+    query = f"""
+        INSERT INTO {schema['table_name']} ({', '.join(used_columns)})
+        VALUES ({placeholders})
+        ON CONFLICT ({schema['key_field']}) DO NOTHING
+    """
+    return query, values
+
+
+def run_legacy(records: List[Dict]) -> int:
+    schema = TABLE_SCHEMAS['measurements']
+    rows = 0
+    for record in records:
+        legacy_build_upsert_query(schema, legacy_process_measurement(record))
+        rows += 1
+    return rows
+
+
+def run_mapper(records: List[Dict], page_size: int, convert: bool = True) -> int:
+    schema = TABLE_SCHEMAS['measurements']
+    mapper = RecordMapper(schema if convert else {**schema, 'field_types': {}})
+    rows = 0
+    for start in range(0, len(records), page_size):
+        page = mapper.map_page(records[start:start + page_size])
+        mapper.merge_sql(mapper.columns)
+        rows += len(page.rows)
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=100000)
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    records = synthetic_measurements(args.records)
+
+    for name, run in (('legacy per-record', lambda: run_legacy(records)),
+                      ('compiled mapper', lambda: run_mapper(records, args.page_size, convert=False)),
+                      ('mapper + types', lambda: run_mapper(records, args.page_size))):
+        best = float('inf')
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            rows = run()
+            best = min(best, time.perf_counter() - started)
+        print(f"{name:>18}: {rows} rows in {best:.3f}s ({rows / best:,.0f} rows/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""Local stand-in for the OpenAQ v2 API used by the benchmarks
+
+Records are derived from their index, so millions of measurements can be
+served without holding them in memory.
+"""
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+PARAMETERS = [
+    (1, 'pm10', 'PM10', 'µg/m³'),
+    (2, 'pm25', 'PM2.5', 'µg/m³'),
+    (3, 'o3', 'O₃ mass', 'ppm'),
+    (4, 'co', 'CO mass', 'ppm'),
+    (5, 'no2', 'NO₂ mass', 'ppm'),
+    (6, 'so2', 'SO₂ mass', 'ppm')
+]
+COUNTRIES = ['IL', 'US', 'DE', 'IN', 'FR', 'GB']
+BASE_TIME = datetime(2024, 1, 1)
+
+
+def parameter_record(index: int) -> Dict:
+    parameter_id, name, display_name, unit = PARAMETERS[index]
+    return {
+        'id': parameter_id,
+        'name': name,
+        'displayName': display_name,
+        'description': f"{display_name} concentration",
+        'preferredUnit': unit
+    }
+
+
+def location_record(index: int) -> Dict:
+    rng = random.Random(index)
+    return {
+        'id': index + 1,
+        'name': f"Station {index + 1}",
+        'city': None,
+        'country': COUNTRIES[index % len(COUNTRIES)],
+        'coordinates': {'latitude': rng.uniform(-90, 90), 'longitude': rng.uniform(-180, 180)},
+        'isMobile': False,
+        'entity': 'government',
+        'isAnalysis': False,
+        'sensorType': 'reference grade',
+        'firstUpdated': '2020-01-01T00:00:00+00:00',
+        'lastUpdated': '2024-01-01T00:00:00+00:00'
+    }
+
+
+def measurement_record(index: int, locations: int) -> Dict:
+    """The index maps to a unique (location, parameter, hour), like the real natural key"""
+    location = index % locations
+    parameter_id, name, _, unit = PARAMETERS[(index // locations) % len(PARAMETERS)]
+    timestamp = BASE_TIME + timedelta(hours=index // (locations * len(PARAMETERS)))
+    coordinates = location_record(location)['coordinates']
+    return {
+        'locationId': location + 1,
+        'location': f"Station {location + 1}",
+        'parameter': name,
+        'value': round(random.Random(index).uniform(0, 150), 2),
+        'date': {
+            'utc': timestamp.strftime('%Y-%m-%dT%H:%M:%S+00:00'),
+            'local': timestamp.strftime('%Y-%m-%dT%H:%M:%S+00:00')
+        },
+        'unit': unit,
+        'coordinates': coordinates,
+        'country': COUNTRIES[location % len(COUNTRIES)],
+        'city': None
+    }
+
+
+class FakeOpenAQServer:
+    """Threaded HTTP server answering /parameters, /locations and /measurements
+
+    `latency` seconds are added to every response and a `rate_limit_ratio`
+    share of requests is answered with 429 and a Retry-After header.
+    """
+
+    def __init__(self, measurements: int, locations: int = 1000, latency: float = 0.0,
+                 rate_limit_ratio: float = 0.0, retry_after: int = 1, port: int = 0, seed: int = 7):
+        self.counts = {
+            'parameters': len(PARAMETERS),
+            'locations': locations,
+            'measurements': measurements
+        }
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.requests = 0
+        self.rate_limited = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v2"
+
+    def page(self, endpoint: str, page: int, limit: int) -> List[Dict]:
+        start = (page - 1) * limit
+        end = min(start + limit, self.counts[endpoint])
+        if endpoint == 'parameters':
+            return [parameter_record(index) for index in range(start, end)]
+        if endpoint == 'locations':
+            return [location_record(index) for index in range(start, end)]
+        return [measurement_record(index, self.counts['locations']) for index in range(start, end)]
+
+    def _should_rate_limit(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            limited = self._rng.random() < self.rate_limit_ratio
+            if limited:
+                self.rate_limited += 1
+            return limited
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                endpoint = url.path.rstrip('/').rsplit('/', 1)[-1]
+                query = parse_qs(url.query)
+
+                if server.latency:
+                    time.sleep(server.latency)
+
+                if endpoint not in server.counts:
+                    self._send(404, {'detail': 'Not Found'})
+                    return
+
+                if server._should_rate_limit():
+                    self._send(429, {'detail': 'Too Many Requests'}, {'Retry-After': str(server.retry_after)})
+                    return
+
+                page = int(query.get('page', ['1'])[0])
+                limit = int(query.get('limit', ['100'])[0])
+                results = server.page(endpoint, page, limit)
+                self._send(200, {
+                    'meta': {'page': page, 'limit': limit, 'found': server.counts[endpoint]},
+                    'results': results
+                })
+
+            def _send(self, status: int, body: Dict, headers: Dict[str, str] = None):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> 'FakeOpenAQServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-openaq", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'FakeOpenAQServer':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
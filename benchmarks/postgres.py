@@ -0,0 +1,68 @@
+"""Throwaway Postgres databases for the benchmarks"""
+import os
+import shutil
+import subprocess
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+import psycopg2
+from psycopg2 import sql
+
+
+def admin_params_from_env() -> Dict[str, str]:
+    """Server to create benchmark databases on, from BENCH_DB_* (falling back to DB_*)"""
+    return {
+        "dbname": os.getenv("BENCH_DB_NAME", os.getenv("DB_NAME", "postgres")),
+        "user": os.getenv("BENCH_DB_USER", os.getenv("DB_USER", "postgres")),
+        "password": os.getenv("BENCH_DB_PASSWORD", os.getenv("DB_PASSWORD")),
+        "host": os.getenv("BENCH_DB_HOST", os.getenv("DB_HOST", "localhost")),
+        "port": os.getenv("BENCH_DB_PORT", os.getenv("DB_PORT", "5432"))
+    }
+
+
+@contextmanager
+def docker_postgres(image: str = "postgres:16", password: str = "bench", port: int = 55432,
+                    startup_timeout: int = 60) -> Iterator[Dict[str, str]]:
+    """Run a disposable Postgres container and yield its admin connection params"""
+    if not shutil.which("docker"):
+        raise Exception("docker is required to start a throwaway Postgres")
+
+    name = f"openaq-bench-{uuid.uuid4().hex[:8]}"
+    subprocess.run(
+        ["docker", "run", "--rm", "-d", "--name", name, "-e", f"POSTGRES_PASSWORD={password}",
+         "-p", f"{port}:5432", image],
+        check=True, stdout=subprocess.DEVNULL
+    )
+    params = {"dbname": "postgres", "user": "postgres", "password": password,
+              "host": "localhost", "port": str(port)}
+    try:
+        deadline = time.monotonic() + startup_timeout
+        while True:
+            try:
+                psycopg2.connect(**params).close()
+                break
+            except psycopg2.OperationalError:
+                if time.monotonic() > deadline:
+                    raise Exception(f"Postgres container {name} did not become ready")
+                time.sleep(1)
+        yield params
+    finally:
+        subprocess.run(["docker", "stop", name], check=False, stdout=subprocess.DEVNULL)
+
+
+@contextmanager
+def throwaway_database(admin_params: Dict[str, str]) -> Iterator[Dict[str, str]]:
+    """Create a uniquely named database, yield its params, and drop it afterwards"""
+    name = f"bench_{uuid.uuid4().hex[:12]}"
+    admin = psycopg2.connect(**admin_params)
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cursor:
+            cursor.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(name)))
+        yield {**admin_params, "dbname": name}
+    finally:
+        with admin.cursor() as cursor:
+            cursor.execute(sql.SQL("DROP DATABASE IF EXISTS {} WITH (FORCE)").format(sql.Identifier(name)))
+        admin.close()
@@ -0,0 +1,158 @@
+"""End-to-end scaling benchmark for the extract, load and transform stages
+
+Starts a local fake OpenAQ server, creates a throwaway Postgres database
+per scale, and writes rows/sec, stage latency and peak RSS as JSON.
+
+    python -m benchmarks.run_benchmarks --scales 10k 1m --docker
+    python -m benchmarks.run_benchmarks --scales 10k --latency 0.05 --rate-limit-ratio 0.02
+
+Without --docker, databases are created on the server given by BENCH_DB_*
+(falling back to DB_*).
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import time
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from typing import Any, Dict
+
+from benchmarks.fake_openaq import FakeOpenAQServer
+from benchmarks.postgres import admin_params_from_env, docker_postgres, throwaway_database
+
+SCALES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+
+
+def _stage(rows: int, started: float) -> Dict[str, float]:
+    seconds = time.perf_counter() - started
+    return {'rows': rows, 'seconds': round(seconds, 3), 'rows_per_sec': round(rows / seconds, 1) if seconds else None}
+
+
+def run_scale(scale: str, options: Dict[str, Any], admin_params: Dict[str, str]) -> Dict[str, Any]:
+    """Benchmark one scale; meant to run in its own process so peak RSS is per run"""
+    from src.api import OpenAQClient, TokenBucket
+    from src.db import Database, DataWarehouseTransformer
+
+    measurements = SCALES[scale]
+    stages = {}
+
+    with FakeOpenAQServer(measurements, locations=options['locations'], latency=options['latency'],
+                          rate_limit_ratio=options['rate_limit_ratio']) as server:
+        client = OpenAQClient(
+            base_url=server.base_url,
+            api_key='benchmark',
+            limit=options['page_size'],
+            delay=0,
+            initial_retry_delay=1,
+            concurrency=options['concurrency'],
+            rate_limiter=TokenBucket(rate=options['request_rate'], capacity=options['concurrency'])
+        )
+
+        started = time.perf_counter()
+        fetched = sum(len(page) for page in client.iter_pages('measurements'))
+        stages['extract'] = _stage(fetched, started)
+        stages['extract']['requests'] = server.requests
+        stages['extract']['rate_limited'] = server.rate_limited
+
+        with throwaway_database(admin_params) as db_params:
+            raw_db = Database(db_params, batch_size=options['batch_size'])
+            raw_db.connect()
+            try:
+                raw_db.initialize_tables()
+                raw_db.generic_insert('parameters', server.page('parameters', 1, 100))
+                for page in range(1, options['locations'] // options['page_size'] + 2):
+                    raw_db.generic_insert('locations', server.page('locations', page, options['page_size']))
+
+                started = time.perf_counter()
+                loaded = 0
+                for page in range(1, measurements // options['page_size'] + 2):
+                    loaded += raw_db.generic_insert('measurements',
+                                                    server.page('measurements', page, options['page_size']))
+                stages['load'] = _stage(loaded, started)
+            finally:
+                raw_db.close()
+
+            transformer = DataWarehouseTransformer(db_params)
+            started = time.perf_counter()
+            transformer.run_transformation()
+            transformer.connect()
+            try:
+                with transformer.transaction() as cursor:
+                    cursor.execute("SELECT COUNT(*) FROM fact_air_quality")
+                    facts = cursor.fetchone()[0]
+            finally:
+                transformer.close()
+            stages['transform'] = _stage(facts, started)
+
+    return {
+        'scale': scale,
+        'measurements': measurements,
+        'stages': stages,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+
+def _run_in_child(scale: str, options: Dict[str, Any], admin_params: Dict[str, str]) -> Dict[str, Any]:
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        return pool.apply(run_scale, (scale, options, admin_params))
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="OpenAQ ETL scaling benchmark")
+    parser.add_argument('--scales', nargs='+', choices=list(SCALES), default=['10k'])
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--locations', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--request-rate', type=float, default=1000, help="client token bucket rate, req/s")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to each fake API response")
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument('--docker', action='store_true', help="start a disposable Postgres container")
+    parser.add_argument('--output', help="JSON file to write (default: benchmarks/results/<commit>.json)")
+    args = parser.parse_args()
+
+    options = {
+        'page_size': args.page_size,
+        'locations': args.locations,
+        'batch_size': args.batch_size,
+        'concurrency': args.concurrency,
+        'request_rate': args.request_rate,
+        'latency': args.latency,
+        'rate_limit_ratio': args.rate_limit_ratio
+    }
+    commit = _git_commit()
+
+    with (docker_postgres() if args.docker else nullcontext(admin_params_from_env())) as admin_params:
+        runs = []
+        for scale in args.scales:
+            result = _run_in_child(scale, options, admin_params)
+            print(json.dumps(result))
+            runs.append(result)
+
+    report = {
+        'commit': commit,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'options': options,
+        'runs': runs
+    }
+    output = args.output or os.path.join(os.path.dirname(__file__), 'results', f"{commit[:12]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
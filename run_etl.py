@@ -1,35 +1,107 @@
-from datetime import datetime
+import argparse
+import json
+import signal
+import threading
+from datetime import date, datetime
 from apscheduler.schedulers.background import BackgroundScheduler
 
 from src import AirQualityETL
+from src.config import get_metrics_config, get_schedule_config
+from src.etl_process import METADATA_ENDPOINTS
+from src.metrics import metrics
 
 
-def etl_job():
+def etl_job(etl: AirQualityETL, job_name: str, endpoints, transform: bool = True):
     try:
-        etl = AirQualityETL()
-        etl.run()
+        etl.run_exclusive(job_name, endpoints, transform)
     except Exception as e:
-        print(f"Error in ETL job: {str(e)}")
+        print(f"Error in ETL job {job_name}: {str(e)}")
 
 
 def main():
-    scheduler = BackgroundScheduler()
+    parser = argparse.ArgumentParser(description="OpenAQ ETL service")
+    parser.add_argument(
+        '--full-rebuild',
+        action='store_true',
+        help="run once, rebuilding fact_air_quality from all raw measurements, then exit"
+    )
+    parser.add_argument(
+        '--replay',
+        metavar='ARCHIVE_DIR',
+        help="run once from archived API pages instead of the API, then exit"
+    )
+    parser.add_argument('--date-from', type=date.fromisoformat, help="first archive date to replay (YYYY-MM-DD)")
+    parser.add_argument('--date-to', type=date.fromisoformat, help="last archive date to replay (YYYY-MM-DD)")
+    parser.add_argument(
+        '--index-report',
+        action='store_true',
+        help="print unused and missing indexes from pg_stat_user_indexes, then exit"
+    )
+    args = parser.parse_args()
+
+    etl = AirQualityETL()
+
+    if args.index_report:
+        try:
+            print(json.dumps(etl.index_report(), indent=2, default=str))
+        finally:
+            etl.close()
+        return
+
+    if args.replay:
+        try:
+            etl.replay(args.replay, full_rebuild=args.full_rebuild, date_from=args.date_from, date_to=args.date_to)
+        finally:
+            etl.close()
+        return
+
+    if args.full_rebuild:
+        try:
+            etl.run(full_rebuild=True)
+        finally:
+            etl.close()
+        return
+
+    metrics_port = get_metrics_config()['PORT']
+    if metrics_port:
+        metrics.serve(metrics_port)
 
+    schedule = get_schedule_config()
+    scheduler = BackgroundScheduler(job_defaults={'max_instances': 1, 'coalesce': True})
+
+    # parameters and locations change rarely; measurements are pulled often. Only the
+    # measurements job, which never overlaps itself across replicas, transforms the warehouse
+    scheduler.add_job(
+        etl_job,
+        'interval',
+        args=[etl, f"{schedule['LOCK_PREFIX']}:metadata", METADATA_ENDPOINTS, False],
+        hours=schedule['METADATA_INTERVAL_HOURS'],
+        next_run_time=datetime.now(),
+        id='metadata'
+    )
     scheduler.add_job(
         etl_job,
         'interval',
-        hours=1,
-        next_run_time=datetime.now()
+        args=[etl, f"{schedule['LOCK_PREFIX']}:measurements", ('measurements',)],
+        minutes=schedule['MEASUREMENTS_INTERVAL_MINUTES'],
+        next_run_time=datetime.now(),
+        id='measurements'
     )
 
-    try:
-        scheduler.start()
-        while True:
-            pass
-    except (KeyboardInterrupt, SystemExit):
-        scheduler.shutdown()
-        print("\nScheduler stopped.")
+    shutdown = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: shutdown.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: shutdown.set())
+
+    scheduler.start()
+    shutdown.wait()
+
+    print("\nShutting down, finishing the batch in flight...")
+    etl.request_stop()
+    scheduler.shutdown(wait=True)
+    etl.close()
+    metrics.stop()
+    print("Scheduler stopped.")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
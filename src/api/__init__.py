@@ -1 +1,4 @@
 from .client import OpenAQClient
+from .rate_limiter import TokenBucket
+from .response_cache import ResponseCache
+from .archive import ResponseArchive
@@ -0,0 +1,53 @@
+import glob
+import gzip
+import json
+import os
+import uuid
+from datetime import date, datetime, timezone
+from typing import Dict, List, Optional
+
+
+class ResponseArchive:
+    """Gzipped JSON-lines copy of every fetched page, partitioned by endpoint and fetch date
+
+    Layout: <directory>/<endpoint>/<YYYY-MM-DD>/<HHMMSS>-p<page>-<id>.jsonl.gz,
+    one API record per line. Each page gets its own file so concurrent
+    fetches never share a writer.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def write(self, endpoint: str, page: int, results: List[Dict]) -> Optional[str]:
+        if not results:
+            return None
+
+        fetched_at = datetime.now(timezone.utc)
+        partition = os.path.join(self.directory, endpoint, fetched_at.strftime('%Y-%m-%d'))
+        os.makedirs(partition, exist_ok=True)
+
+        path = os.path.join(partition, f"{fetched_at:%H%M%S}-p{page:06d}-{uuid.uuid4().hex[:8]}.jsonl.gz")
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            for record in results:
+                f.write(json.dumps(record, default=str))
+                f.write('\n')
+        os.replace(tmp_path, path)
+        return path
+
+    def files(self, endpoint: str, date_from: date = None, date_to: date = None) -> List[str]:
+        """Archived pages of an endpoint fetched between the given dates (inclusive), oldest first"""
+        paths = []
+        for partition in sorted(glob.glob(os.path.join(self.directory, endpoint, '*'))):
+            partition_date = datetime.strptime(os.path.basename(partition), '%Y-%m-%d').date()
+            if date_from and partition_date < date_from:
+                continue
+            if date_to and partition_date > date_to:
+                continue
+            paths.extend(sorted(glob.glob(os.path.join(partition, '*.jsonl.gz'))))
+        return paths
+
+    @staticmethod
+    def read(path: str) -> List[Dict]:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
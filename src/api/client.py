@@ -1,13 +1,24 @@
 import requests
 import time
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import List, Dict, Iterator, Optional, Tuple
 import logging
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
+from .rate_limiter import TokenBucket
+from .response_cache import ResponseCache
+from .archive import ResponseArchive
+from src.metrics import metrics
 
 
 class OpenAQClient:
     def __init__(self, base_url: str, api_key: str, limit: int = 100, delay: int = 1,
-                 max_retries: int = 7, initial_retry_delay: int = 5):
+                 max_retries: int = 7, initial_retry_delay: int = 5, concurrency: int = 1,
+                 max_pages: Optional[int] = None, timeout: int = 30, rate_limiter: TokenBucket = None,
+                 cache: ResponseCache = None, cached_endpoints: Tuple[str, ...] = (),
+                 archive: ResponseArchive = None, pool_size: Optional[int] = None):
         self.base_url = base_url
         self.headers = {
             'X-API-Key': api_key,
@@ -17,29 +28,89 @@ class OpenAQClient:
         self.delay = delay
         self.max_retries = max_retries
         self.initial_retry_delay = initial_retry_delay
+        self.concurrency = max(1, concurrency)
+        self.max_pages = max_pages
+        self.timeout = timeout
+        self.cache = cache
+        self.cached_endpoints = set(cached_endpoints) if cache else set()
+        self.archive = archive
+
+        # One bucket for all endpoints; `delay` keeps its meaning as seconds per request
+        self.rate_limiter = rate_limiter or TokenBucket(
+            rate=1 / delay if delay else 100,
+            capacity=self.concurrency
+        )
+
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        # Sharded extraction runs several streams at once, each with `concurrency` requests in flight
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size or 0, self.concurrency))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
 
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
 
-    def _make_request(self, url: str, params: Dict = None) -> Dict:
+    def _retry_delay(self, response: requests.Response, current_retry: int) -> float:
+        """Delay requested via Retry-After, falling back to exponential backoff"""
+        retry_after = response.headers.get('Retry-After')
+        if retry_after:
+            try:
+                return max(0.0, float(retry_after))
+            except ValueError:
+                try:
+                    retry_at = parsedate_to_datetime(retry_after)
+                    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+                except (TypeError, ValueError):
+                    pass
+
+        return self.initial_retry_delay * (2 ** current_retry)
+
+    def _cached_request(self, url: str, params: Dict = None) -> Tuple[Dict, bool]:
+        """Serve a response from the cache, revalidating it once its TTL has passed
+
+        Returns the body and whether it came from the cache rather than a new download.
+        """
+        key = self.cache.key(url, params)
+        entry = self.cache.get(key)
+
+        if entry and self.cache.is_fresh(entry):
+            metrics.increment('api_cache', result='hit')
+            return entry['body'], True
+
+        response = self._make_request(url, params, self.cache.validators(entry) if entry else None)
+        if response.status_code == 304:
+            metrics.increment('api_cache', result='revalidated')
+            self.cache.touch(key, entry)
+            return entry['body'], True
+
+        metrics.increment('api_cache', result='miss')
+        body = response.json()
+        self.cache.store(key, body, response.headers)
+        return body, False
+
+    def _make_request(self, url: str, params: Dict = None, headers: Dict = None) -> requests.Response:
         """Make HTTP request with retry logic for rate limits"""
         current_retry = 0
         while current_retry <= self.max_retries:
             try:
-                response = requests.get(url, params=params, headers=self.headers)
+                self.rate_limiter.acquire()
+                response = self.session.get(url, params=params, headers=headers, timeout=self.timeout)
 
-                if response.status_code == 200:
-                    return response.json()
+                if response.status_code == 200 or (headers and response.status_code == 304):
+                    return response
 
                 elif response.status_code == 429:  # Rate limit exceeded
                     if current_retry == self.max_retries:
                         raise Exception(f"Rate limit exceeded after {self.max_retries} retries")
 
-                    retry_delay = self.initial_retry_delay * (2 ** current_retry)
+                    retry_delay = self._retry_delay(response, current_retry)
+                    metrics.increment('api_rate_limited')
+                    metrics.increment('api_backoff_seconds', retry_delay)
                     self.logger.warning(
                         f"Rate limit hit. Waiting {retry_delay} seconds before retry {current_retry + 1}/{self.max_retries}"
                     )
-                    time.sleep(retry_delay)
+                    self.rate_limiter.pause(retry_delay)
                     current_retry += 1
                     continue
 
@@ -51,6 +122,8 @@ class OpenAQClient:
                     raise Exception(f"Request failed after {self.max_retries} retries: {str(e)}")
 
                 retry_delay = self.initial_retry_delay * (2 ** current_retry)
+                metrics.increment('api_retries')
+                metrics.increment('api_backoff_seconds', retry_delay)
                 self.logger.warning(
                     f"Request failed. Retrying in {retry_delay} seconds. Retry {current_retry + 1}/{self.max_retries}"
                 )
@@ -60,31 +133,83 @@ class OpenAQClient:
 
         raise Exception("Maximum retries exceeded")
 
-    def generic_get(self, endpoint: str, params: Dict = None) -> List[Dict]:
-        """Generic method for handling all API requests with pagination"""
-        all_results = []
-        page = 1
-
-        while True:
-            request_params = {
-                'page': page,
-                'limit': self.limit,
-                **(params or {})
-            }
-
-            try:
-                data = self._make_request(f"{self.base_url}/{endpoint}", request_params)
-                results = data['results']
-
-                all_results.extend(results)
+    def _fetch_page(self, endpoint: str, page: int, params: Dict = None) -> List[Dict]:
+        """Fetch a single page of an endpoint"""
+        request_params = {
+            'page': page,
+            'limit': self.limit,
+            **(params or {})
+        }
 
-                if len(results) < self.limit or page > 50:
+        url = f"{self.base_url}/{endpoint}"
+        from_cache = False
+        with metrics.timer('api_page', endpoint=endpoint):
+            if endpoint in self.cached_endpoints:
+                data, from_cache = self._cached_request(url, request_params)
+            else:
+                data = self._make_request(url, request_params).json()
+
+        metrics.increment('rows_fetched', len(data['results']), endpoint=endpoint)
+        # Pages served from the cache were archived when they were downloaded
+        if self.archive and not from_cache:
+            self.archive.write(endpoint, page, data['results'])
+        return data['results']
+
+    def get_location(self, location_id: int) -> List[Dict]:
+        """Fetch a single location by id"""
+        with metrics.timer('api_page', endpoint='locations/{id}'):
+            data = self._make_request(f"{self.base_url}/locations/{location_id}").json()
+
+        if self.archive:
+            self.archive.write('locations', 0, data['results'])
+        return data['results']
+
+    def _within_page_cap(self, page: int) -> bool:
+        return self.max_pages is None or page <= self.max_pages
+
+    def iter_pages(self, endpoint: str, params: Dict = None, start_page: int = 1) -> Iterator[List[Dict]]:
+        """Yield the pages of an endpoint one at a time, in page order
+
+        The first page is fetched alone; only once it comes back full are
+        up to `concurrency` pages kept in flight, so short endpoints cost one
+        request per page. New requests are only submitted as the caller
+        consumes pages, which bounds memory use. Pages are numbered from
+        `start_page`, so an interrupted stream can be resumed after its last
+        loaded page.
+        """
+        pending = {}
+        next_page = start_page
+        page = start_page
+        window = 1
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+        try:
+            while True:
+                while len(pending) < window and self._within_page_cap(next_page):
+                    pending[next_page] = executor.submit(self._fetch_page, endpoint, next_page, params)
+                    next_page += 1
+
+                try:
+                    results = pending.pop(page).result()
+                except Exception as e:
+                    raise Exception(f"Failed to fetch {endpoint}: {str(e)}")
+
+                if results:
+                    yield results
+
+                if len(results) < self.limit or not self._within_page_cap(page + 1):
                     break
 
+                window = self.concurrency
                 page += 1
-                time.sleep(self.delay)
 
-            except Exception as e:
-                raise Exception(f"Failed to fetch {endpoint}: {str(e)}")
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def generic_get(self, endpoint: str, params: Dict = None) -> List[Dict]:
+        """Generic method for handling all API requests with pagination"""
+        all_results = []
+        for results in self.iter_pages(endpoint, params):
+            all_results.extend(results)
 
         return all_results
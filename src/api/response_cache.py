@@ -0,0 +1,63 @@
+import hashlib
+import json
+import os
+import time
+from typing import Dict, Optional
+
+
+class ResponseCache:
+    """On-disk cache of API responses keyed by URL and query params
+
+    Entries younger than `ttl` are served without a request; older ones are
+    revalidated with their ETag / Last-Modified validators.
+    """
+
+    def __init__(self, directory: str, ttl: float = 21600):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(url: str, params: Dict = None) -> str:
+        encoded = json.dumps([url, sorted((params or {}).items())], default=str)
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict]:
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_fresh(self, entry: Dict) -> bool:
+        return time.time() - entry['stored_at'] < self.ttl
+
+    @staticmethod
+    def validators(entry: Dict) -> Dict[str, str]:
+        """Conditional request headers for a stale entry"""
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, key: str, body: Dict, headers: Dict) -> None:
+        entry = {
+            'stored_at': time.time(),
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'body': body
+        }
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+
+    def touch(self, key: str, entry: Dict) -> None:
+        """Restart the TTL of an entry the server confirmed unchanged"""
+        self.store(key, entry['body'], {'ETag': entry.get('etag'), 'Last-Modified': entry.get('last_modified')})
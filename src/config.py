@@ -16,12 +16,81 @@ def get_db_params() -> Dict[str, str]:
     }
 
 
+def get_pool_config() -> Dict[str, int]:
+    return {
+        "MIN_SIZE": int(os.getenv("DB_POOL_MIN", "1")),
+        "MAX_SIZE": int(os.getenv("DB_POOL_MAX", "5"))
+    }
+
+
 def get_api_config() -> Dict[str, any]:
     return {
         "BASE_URL": os.getenv("API_BASE_URL"),
         "API_KEY": os.getenv("API_KEY"),
         "DEFAULT_LIMIT": int(os.getenv("API_LIMIT", "100")),
-        "REQUEST_DELAY": int(os.getenv("API_DELAY", "1"))
+        "REQUEST_DELAY": int(os.getenv("API_DELAY", "1")),
+        "CONCURRENCY": int(os.getenv("API_CONCURRENCY", "4")),
+        "MAX_PAGES": int(os.getenv("API_MAX_PAGES")) if os.getenv("API_MAX_PAGES") else None,
+        "CACHE_DIR": os.getenv("API_CACHE_DIR", ".cache/openaq"),
+        "CACHE_TTL_SECONDS": int(os.getenv("API_CACHE_TTL_SECONDS", "21600")),
+        "ARCHIVE_DIR": os.getenv("API_ARCHIVE_DIR") or None,
+        "CACHED_ENDPOINTS": tuple(
+            endpoint.strip() for endpoint in os.getenv("API_CACHED_ENDPOINTS", "parameters,locations").split(',')
+            if endpoint.strip()
+        )
+    }
+
+
+def get_load_config() -> Dict[str, any]:
+    return {
+        "BATCH_SIZE": int(os.getenv("LOAD_BATCH_SIZE", "1000")),
+        "QUEUE_SIZE": int(os.getenv("LOAD_QUEUE_SIZE", "4")),
+        "WATERMARK_LOOKBACK_HOURS": int(os.getenv("WATERMARK_LOOKBACK_HOURS", "2")),
+        "WATERMARK_MAX_LOOKBACK_HOURS": int(os.getenv("WATERMARK_MAX_LOOKBACK_HOURS", "168")),
+        "INITIAL_LOOKBACK_HOURS": int(os.getenv("INITIAL_LOOKBACK_HOURS", "24")),
+        "SHARD_BY": os.getenv("EXTRACT_SHARD_BY", "country").lower(),
+        "EXTRACT_WORKERS": int(os.getenv("EXTRACT_WORKERS", "4")),
+        "SHARD_ATTEMPTS": int(os.getenv("EXTRACT_SHARD_ATTEMPTS", "3")),
+        "UNKNOWN_LOCATIONS": os.getenv("UNKNOWN_LOCATIONS", "infer").lower(),
+        "LOCATION_LOOKUP_LIMIT": int(os.getenv("LOCATION_LOOKUP_LIMIT", "100")),
+        "PARSE_IN_PROCESSES": os.getenv("PARSE_IN_PROCESSES", "false").lower() == "true",
+        "PARSE_WORKERS": int(os.getenv("PARSE_WORKERS") or os.cpu_count() or 1),
+        "QUALITY_CHECKS": os.getenv("QUALITY_CHECKS", "true").lower() == "true"
+    }
+
+
+def get_warehouse_config() -> Dict[str, any]:
+    return {
+        "CALENDAR_START": os.getenv("DW_CALENDAR_START", "2015-01-01"),
+        "CALENDAR_DAYS_AHEAD": int(os.getenv("DW_CALENDAR_DAYS_AHEAD", "365")),
+        "INLINE_FACTS": os.getenv("DW_INLINE_FACTS", "true").lower() == "true",
+        "KEY_CACHE_SIZE": int(os.getenv("DW_KEY_CACHE_SIZE", "100000")),
+        "TRANSFORM_WORKERS": int(os.getenv("DW_TRANSFORM_WORKERS", "3")),
+        "EXPORT_DIR": os.getenv("DW_EXPORT_DIR") or None,
+        "EXPORT_CHUNK_SIZE": int(os.getenv("DW_EXPORT_CHUNK_SIZE", "50000"))
+    }
+
+
+def get_metrics_config() -> Dict[str, any]:
+    return {
+        "PORT": int(os.getenv("METRICS_PORT", "0")),
+        "EXPLAIN": os.getenv("METRICS_EXPLAIN", "false").lower() == "true"
+    }
+
+
+def get_schedule_config() -> Dict[str, any]:
+    return {
+        "MEASUREMENTS_INTERVAL_MINUTES": int(os.getenv("SCHEDULE_MEASUREMENTS_MINUTES", "60")),
+        "METADATA_INTERVAL_HOURS": int(os.getenv("SCHEDULE_METADATA_HOURS", "24")),
+        "LOCK_PREFIX": os.getenv("SCHEDULE_LOCK_PREFIX", "openaq_etl")
+    }
+
+
+def get_partition_config() -> Dict[str, any]:
+    return {
+        "MONTHS_AHEAD": int(os.getenv("PARTITION_MONTHS_AHEAD", "2")),
+        "RETENTION_MONTHS": int(os.getenv("PARTITION_RETENTION_MONTHS", "0")),
+        "DROP_EXPIRED": os.getenv("PARTITION_RETENTION_MODE", "detach").lower() == "drop"
     }
 
 
@@ -36,7 +105,19 @@ TABLE_SCHEMAS = {
             'preferred_unit'
         ],
         'key_field': 'parameter_id',
-        'update_fields': ['name', 'display_name', 'description', 'preferred_unit']
+        'update_fields': ['name', 'display_name', 'description', 'preferred_unit'],
+        # column -> dotted path of the value in an API record
+        'source_fields': {
+            'parameter_id': 'id',
+            'name': 'name',
+            'display_name': 'displayName',
+            'description': 'description',
+            'preferred_unit': 'preferredUnit'
+        },
+        'required_fields': ['parameter_id', 'name', 'display_name', 'description', 'preferred_unit'],
+        'field_defaults': {},
+        # column -> coercion applied before loading (see record_mapper.COERCERS)
+        'field_types': {'preferred_unit': 'unit'}
     },
 
     'locations': {
@@ -56,7 +137,30 @@ TABLE_SCHEMAS = {
             'last_updated'
         ],
         'key_field': 'location_id',
-        'update_fields': ['name', 'city', 'is_mobile', 'entity', 'sensor_type', 'last_updated']
+        'update_fields': ['name', 'city', 'country', 'latitude', 'longitude', 'is_mobile', 'entity',
+                          'is_analysis', 'sensor_type', 'first_updated', 'last_updated', 'is_inferred'],
+        'source_fields': {
+            'location_id': 'id',
+            'name': 'name',
+            'city': 'city',
+            'country': 'country',
+            'latitude': 'coordinates.latitude',
+            'longitude': 'coordinates.longitude',
+            'is_mobile': 'isMobile',
+            'entity': 'entity',
+            'is_analysis': 'isAnalysis',
+            'sensor_type': 'sensorType',
+            'first_updated': 'firstUpdated',
+            'last_updated': 'lastUpdated'
+        },
+        'required_fields': ['location_id', 'name', 'country'],
+        'field_defaults': {'is_mobile': False},
+        'field_types': {
+            'latitude': 'number',
+            'longitude': 'number',
+            'first_updated': 'utc_timestamp',
+            'last_updated': 'utc_timestamp'
+        }
     },
 
     'measurements': {
@@ -74,11 +178,59 @@ TABLE_SCHEMAS = {
             'country',
             'city'
         ],
-        'key_field': None,
-        'update_fields': []
+        'key_field': 'location_id, parameter, timestamp_utc',
+        'update_fields': [],
+        'source_fields': {
+            'location_id': 'locationId',
+            'parameter': 'parameter',
+            'value': 'value',
+            'unit': 'unit',
+            'timestamp_utc': 'date.utc',
+            'timestamp_local': 'date.local',
+            'latitude': 'coordinates.latitude',
+            'longitude': 'coordinates.longitude',
+            'country': 'country',
+            'city': 'city'
+        },
+        'required_fields': [
+            'location_id',
+            'parameter',
+            'value',
+            'unit',
+            'timestamp_utc',
+            'timestamp_local',
+            'latitude',
+            'longitude',
+            'country'
+        ],
+        'field_defaults': {},
+        'field_types': {
+            'value': 'number',
+            'unit': 'unit',
+            'timestamp_utc': 'utc_timestamp',
+            'timestamp_local': 'local_timestamp',
+            'latitude': 'number',
+            'longitude': 'number'
+        }
     }
 }
 
+# Data-quality rules applied to mapped pages before they are loaded; a failing
+# row is quarantined under the rule name. Checks are defined in src/db/quality.py
+QUALITY_RULES = {
+    'measurements': [
+        # Concentrations cannot be negative, temperatures can
+        {'name': 'negative_value', 'check': 'min', 'column': 'value', 'min': 0,
+         'parameter_column': 'parameter', 'exclude_parameters': ['temperature', 'ambient_temp']},
+        {'name': 'latitude_out_of_range', 'check': 'range', 'column': 'latitude', 'min': -90, 'max': 90},
+        {'name': 'longitude_out_of_range', 'check': 'range', 'column': 'longitude', 'min': -180, 'max': 180},
+        {'name': 'future_timestamp', 'check': 'not_future', 'column': 'timestamp_utc', 'tolerance_minutes': 15},
+        # Also converts value and unit to the parameter's preferred unit
+        {'name': 'unit_mismatch', 'check': 'preferred_unit', 'column': 'unit',
+         'value_column': 'value', 'parameter_column': 'parameter'}
+    ]
+}
+
 # Data Warehouse schema definitions
 DW_SCHEMAS = {
     'dim_location': {
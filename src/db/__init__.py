@@ -1,3 +1,7 @@
 from .connectionDB import ConnectionDB
-from .database import Database
+from .pool import ConnectionPool
+from .database import Checkpoint, Database
+from .dimension_cache import DimensionKeyCache
 from .transformation import DataWarehouseTransformer
+from .page_parser import PageParser
+from .parquet_export import ParquetExporter, ParquetReader
@@ -1,26 +1,49 @@
+import csv
+import io
+import re
+import zlib
 import psycopg2
-from typing import Dict, Optional
-from psycopg2.extensions import connection
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Iterator, Sequence
+from psycopg2.extensions import connection, cursor as Cursor
+from .pool import ConnectionPool
 
 
 class ConnectionDB:
-    def __init__(self, db_params: Dict[str, str]):
+    def __init__(self, db_params: Dict[str, str], pool: ConnectionPool = None):
         self.db_params = db_params
+        self.pool = pool
         self.conn: Optional[connection] = None
 
     def connect(self) -> None:
-        """Establish db connection"""
+        """Establish db connection, borrowing it from the pool when there is one"""
         try:
-            self.conn = psycopg2.connect(**self.db_params)
-            print("Database connection established successfully")
+            if self.pool:
+                self.conn = self.pool.getconn()
+            else:
+                self.conn = psycopg2.connect(**self.db_params)
+                print("Database connection established successfully")
         except Exception as e:
             raise Exception(f"Failed to connect to db: {str(e)}")
 
     def close(self) -> None:
-        """Close db connection"""
+        """Close db connection, or hand it back to the pool"""
         if self.conn:
-            self.conn.close()
-            print("Database connection closed")
+            if self.pool:
+                self.pool.putconn(self.conn)
+            else:
+                self.conn.close()
+                print("Database connection closed")
+            self.conn = None
+
+    @contextmanager
+    def connection(self) -> Iterator[connection]:
+        """Hold a connection for the duration of a block"""
+        self.connect()
+        try:
+            yield self.conn
+        finally:
+            self.close()
 
     def execute_query(self, query: str, params: tuple = None) -> None:
         """Execute a query with parameters"""
@@ -34,3 +57,51 @@ class ConnectionDB:
         except Exception as e:
             self.conn.rollback()
             raise Exception(f"Query execution failed: {str(e)}")
+
+    @contextmanager
+    def transaction(self) -> Iterator[Cursor]:
+        """Run several statements on one cursor and commit them together"""
+        if not self.conn:
+            raise Exception("Database connection not established")
+
+        try:
+            with self.conn.cursor() as cursor:
+                yield cursor
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    @staticmethod
+    def copy_rows(cursor: Cursor, table_name: str, columns: List[str], rows: List[tuple]) -> None:
+        """Stream rows into a table with COPY FROM STDIN"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([r'\N' if value is None else value for value in row])
+        buffer.seek(0)
+
+        cursor.copy_expert(
+            f"COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer
+        )
+
+    def execute_prepared(self, cursor: Cursor, query: str, params: Sequence) -> None:
+        """Execute a %s-style statement through a server-side prepared statement
+
+        Statements are prepared once per pooled connection and reused for
+        every later call; unpooled connections fall back to a plain execute.
+        """
+        prepared = getattr(self.conn, 'prepared_statements', None)
+        if prepared is None:
+            cursor.execute(query, params)
+            return
+
+        name = f"stmt_{zlib.crc32(query.encode()):08x}"
+        if name not in prepared:
+            counter = iter(range(1, len(params) + 1))
+            cursor.execute(f"PREPARE {name} AS {re.sub(r'%s', lambda _: f'${next(counter)}', query)}")
+            prepared.add(name)
+
+        placeholders = ', '.join(['%s'] * len(params))
+        cursor.execute(f"EXECUTE {name} ({placeholders})", params)
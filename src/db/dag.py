@@ -0,0 +1,65 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, ContextManager, Dict, List, NamedTuple, Optional, Sequence
+
+
+class Step(NamedTuple):
+    name: str
+    run: Callable[[Any], int]  # called with a cursor, returns the rows it wrote
+    depends_on: Sequence[str] = ()
+
+
+class StepResult(NamedTuple):
+    status: str  # 'success', 'failed' or 'skipped'
+    seconds: float
+    rows: int
+    error: Optional[str]
+
+
+def _run_step(step: Step, open_cursor: Callable[[], ContextManager]) -> StepResult:
+    started = time.perf_counter()
+    try:
+        with open_cursor() as cursor:
+            rows = step.run(cursor)
+        return StepResult('success', time.perf_counter() - started, rows or 0, None)
+    except Exception as e:
+        return StepResult('failed', time.perf_counter() - started, 0, str(e))
+
+
+def run_dag(steps: List[Step], open_cursor: Callable[[], ContextManager],
+            max_workers: int = 4) -> Dict[str, StepResult]:
+    """Run steps as soon as their dependencies have succeeded, up to `max_workers` at a time
+
+    `open_cursor` gives each step its own connection and transaction. A
+    failed step marks everything depending on it, directly or not, as
+    skipped; unrelated steps still run.
+    """
+    results: Dict[str, StepResult] = {}
+    pending = {step.name: step for step in steps}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="transform") as executor:
+        while pending or running:
+            progressed = False
+            for name, step in list(pending.items()):
+                failed = [dep for dep in step.depends_on if dep in results and results[dep].status != 'success']
+                if failed:
+                    results[name] = StepResult('skipped', 0.0, 0, f"dependency did not succeed: {', '.join(failed)}")
+                elif all(dep in results for dep in step.depends_on):
+                    running[executor.submit(_run_step, step, open_cursor)] = name
+                else:
+                    continue
+                del pending[name]
+                progressed = True
+
+            if running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+            elif not progressed:
+                # Unknown dependency names or a cycle
+                for name in pending:
+                    results[name] = StepResult('skipped', 0.0, 0, "unresolved dependencies")
+                break
+
+    return results
@@ -1,16 +1,58 @@
-from typing import List, Dict, Any
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, NamedTuple, Tuple, Optional, Callable, Sequence
+from psycopg2.extras import execute_values
 from .connectionDB import ConnectionDB
+from .pool import ConnectionPool
+from .record_mapper import MappedPage, RecordMapper
+from .partitions import PartitionManager
+from .indexes import IndexManager
+from .location_index import LocationIndex
+from .quality import QualityValidator
 from src.config import TABLE_SCHEMAS
+from src.metrics import metrics
+
+# Columns of newly inserted measurements handed to the inline fact loader
+FACT_RETURNING = "RETURNING measurement_id, location_id, parameter, timestamp_utc, value, unit"
+
+
+class Checkpoint(NamedTuple):
+    """Progress of one paginated stream: the last page loaded and the params it was fetched with"""
+    stream: str
+    endpoint: str
+    params: Dict[str, Any]
+    page: int
+    done: bool = False
 
 
 class Database(ConnectionDB):
 
-    def __init__(self, db_params):
-        super().__init__(db_params)
-        self._valid_location_ids = set()
+    def __init__(self, db_params, batch_size: int = 1000, pool: ConnectionPool = None,
+                 unknown_locations: str = 'infer', quality_checks: bool = True):
+        super().__init__(db_params, pool)
+        self.batch_size = batch_size
+        self._mappers = {schema_key: RecordMapper(schema) for schema_key, schema in TABLE_SCHEMAS.items()}
+        self.location_index = LocationIndex()
+        # 'infer' stores placeholder locations for unknown ids, 'lookup' parks their measurements
+        # until the location is found; both queue the ids for an on-demand locations/{id} lookup
+        self.unknown_locations = unknown_locations
+        self.unknown_location_ids = set()
+        self._watermarks: Dict[Tuple[int, str], datetime] = {}
+        # schema key -> {record key: digest of the row last loaded for it}
+        self._row_hashes: Dict[str, Dict[Any, bytes]] = {}
+        self.partitions = PartitionManager('measurements')
+        self.indexes = IndexManager(('measurements', 'locations'))
+        self.validator = QualityValidator() if quality_checks else None
+        self._tables_ready = False
+        # Called with (cursor, new measurement rows) inside each measurements batch
+        self.fact_loader: Optional[Callable[[Any, List[tuple]], int]] = None
 
     def initialize_tables(self) -> None:
-        """Initialize raw data tables"""
+        """Initialize raw data tables; the DDL runs once per process"""
+        if self._tables_ready:
+            return
+
         queries = [
             """
             CREATE TABLE IF NOT EXISTS parameters (
@@ -34,22 +76,64 @@ class Database(ConnectionDB):
                 is_analysis BOOLEAN,
                 sensor_type VARCHAR(50),
                 first_updated TIMESTAMP,
-                last_updated TIMESTAMP
+                last_updated TIMESTAMP,
+                is_inferred BOOLEAN DEFAULT FALSE
+            );
+            """,
+            """
+            -- Placeholder locations stored for measurements that arrived before their location
+            ALTER TABLE locations ADD COLUMN IF NOT EXISTS is_inferred BOOLEAN DEFAULT FALSE;
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS rejected_records (
+                rejected_id SERIAL PRIMARY KEY,
+                table_name VARCHAR(50),
+                payload JSONB,
+                error TEXT,
+                reason_code VARCHAR(50),
+                rejected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            """,
+            """
+            ALTER TABLE rejected_records ADD COLUMN IF NOT EXISTS reason_code VARCHAR(50);
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS etl_run_summary (
+                run_id SERIAL PRIMARY KEY,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP,
+                status VARCHAR(20),
+                error TEXT,
+                metrics JSONB,
+                query_plans JSONB
             );
             """,
             """
-            CREATE TABLE IF NOT EXISTS measurements (
-                measurement_id SERIAL PRIMARY KEY,
-                location_id INTEGER REFERENCES locations(location_id),
+            CREATE TABLE IF NOT EXISTS etl_watermarks (
+                location_id INTEGER,
                 parameter VARCHAR(50),
-                value DECIMAL(10,2),
-                unit VARCHAR(20),
-                timestamp_utc TIMESTAMP,
-                timestamp_local TIMESTAMP,
-                latitude DECIMAL(9,6),
-                longitude DECIMAL(9,6),
-                country VARCHAR(2),
-                city VARCHAR(255)
+                last_timestamp_utc TIMESTAMP NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (location_id, parameter)
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS etl_pending_measurements (
+                location_id INTEGER NOT NULL,
+                parameter VARCHAR(50) NOT NULL,
+                timestamp_utc TIMESTAMP NOT NULL,
+                payload JSONB NOT NULL,
+                parked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (location_id, parameter, timestamp_utc)
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS etl_checkpoints (
+                stream VARCHAR(200) PRIMARY KEY,
+                endpoint VARCHAR(50) NOT NULL,
+                params JSONB,
+                last_page INTEGER NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             );
             """
         ]
@@ -57,110 +141,565 @@ class Database(ConnectionDB):
         for query in queries:
             self.execute_query(query)
 
-    def _process_data(self, schema_key: str, data: Dict) -> Dict:
-        """Process API data into db format"""
-        try:
-            if schema_key == 'locations':
-                return {
-                    'location_id': data['id'],
-                    'name': data['name'],
-                    'city': data.get('city'),
-                    'country': data['country'],
-                    'latitude': data['coordinates']['latitude'] if data.get('coordinates') else None,
-                    'longitude': data['coordinates']['longitude'] if data.get('coordinates') else None,
-                    'is_mobile': data.get('isMobile', False),
-                    'entity': data.get('entity'),
-                    'is_analysis': data.get('isAnalysis'),
-                    'sensor_type': data.get('sensorType'),
-                    'first_updated': data.get('firstUpdated'),
-                    'last_updated': data.get('lastUpdated')
-                }
-            elif schema_key == 'parameters':
-                return {
-                    'parameter_id': data['id'],
-                    'name': data['name'],
-                    'display_name': data['displayName'],
-                    'description': data['description'],
-                    'preferred_unit': data['preferredUnit']
-                }
-            elif schema_key == 'measurements':
-                return {
-                    'location_id': data['locationId'],
-                    'parameter': data['parameter'],
-                    'value': data['value'],
-                    'unit': data['unit'],
-                    'timestamp_utc': data['date']['utc'],
-                    'timestamp_local': data['date']['local'],
-                    'latitude': data['coordinates']['latitude'],
-                    'longitude': data['coordinates']['longitude'],
-                    'country': data['country'],
-                    'city': data.get('city')
-                }
-        except KeyError as e:
-            raise Exception(f"Missing required field in data: {e}")
-
-        return data
-
-    def generic_insert(self, schema_key: str, data_list: List[Dict], additional_data: Dict = None) -> None:
-        """Generic insert method that handles all table insertions"""
-        schema = TABLE_SCHEMAS[schema_key]
-
-        for data in data_list:
-
-            if schema_key == 'locations':
-                self._valid_location_ids.add(data['id'])
-
-            if schema_key == 'measurements':
-
-                if data['locationId'] not in self._valid_location_ids:
-                    continue
+        self._create_measurements_table()
 
-            try:
-                processed_data = self._process_data(schema_key, data)
-                if additional_data:
-                    processed_data.update(additional_data)
-                query, values = self._build_upsert_query(schema, processed_data)
-                self.execute_query(query, values)
+        with self.transaction() as cursor:
+            self.indexes.ensure(cursor)
 
-            except Exception as e:
-                print(f"Error inserting {schema_key} data: {str(e)}")
-                print(f"Problematic data: {data}")
-                continue
+        self._tables_ready = True
 
-    def _build_upsert_query(self, schema: Dict[str, Any], data: Dict[str, Any]) -> tuple:
-        """Builds an upsert query based on the schema and data"""
-        table_name = schema['table_name']
-        columns = schema['columns']
-        key_field = schema['key_field']
-        update_fields = schema['update_fields']
+    def index_report(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Unused and missing indexes across raw and warehouse tables"""
+        with self.transaction() as cursor:
+            return IndexManager.report(cursor)
 
-        columns_data = {}
-        for k, v in data.items():
-            if k in columns:
-                columns_data[k] = v
+    def _create_measurements_table(self) -> None:
+        """Create measurements partitioned by month, migrating an unpartitioned table once
 
-        used_columns = list(columns_data.keys())
+        Legacy rows are copied over deduplicated on the natural key, keeping
+        their measurement_id so the fact watermark stays valid.
+        """
+        with self.transaction() as cursor:
+            cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('measurements')")
+            row = cursor.fetchone()
+            legacy = row is not None and row[0] == 'r'
 
-        values = []
-        for col in used_columns:
-            values.append(columns_data[col])
+            if legacy:
+                cursor.execute("ALTER TABLE measurements RENAME TO measurements_unpartitioned")
+                cursor.execute("ALTER INDEX IF EXISTS measurements_pkey RENAME TO measurements_unpartitioned_pkey")
+                cursor.execute(
+                    "ALTER INDEX IF EXISTS measurements_natural_key RENAME TO measurements_unpartitioned_natural_key"
+                )
 
-        placeholders = ', '.join(['%s'] * len(used_columns))
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS measurements (
+                    measurement_id SERIAL,
+                    location_id INTEGER REFERENCES locations(location_id),
+                    parameter VARCHAR(50),
+                    value NUMERIC(14,6),
+                    unit VARCHAR(20),
+                    timestamp_utc TIMESTAMP,
+                    timestamp_local TIMESTAMP,
+                    latitude DECIMAL(9,6),
+                    longitude DECIMAL(9,6),
+                    country VARCHAR(2),
+                    city VARCHAR(255),
+                    PRIMARY KEY (measurement_id, timestamp_utc),
+                    CONSTRAINT measurements_natural_key UNIQUE (location_id, parameter, timestamp_utc)
+                ) PARTITION BY RANGE (timestamp_utc);
+            """)
+            # Values converted to a preferred unit can be far below 0.01
+            cursor.execute("""
+                DO $$
+                BEGIN
+                    IF (SELECT numeric_scale FROM information_schema.columns
+                        WHERE table_schema = current_schema() AND table_name = 'measurements'
+                            AND column_name = 'value') < 6 THEN
+                        ALTER TABLE measurements ALTER COLUMN value TYPE NUMERIC(14,6);
+                    END IF;
+                END $$;
+            """)
 
-        columns_str = ', '.join(used_columns)
+            if legacy:
+                cursor.execute("""
+                    SELECT DISTINCT DATE_TRUNC('month', timestamp_utc)
+                    FROM measurements_unpartitioned
+                    WHERE timestamp_utc IS NOT NULL
+                """)
+                self.partitions.ensure(cursor, [row[0] for row in cursor.fetchall()])
+                cursor.execute("""
+                    INSERT INTO measurements
+                    SELECT * FROM measurements_unpartitioned
+                    WHERE timestamp_utc IS NOT NULL
+                    ORDER BY measurement_id
+                    ON CONFLICT DO NOTHING
+                """)
+                cursor.execute("DROP TABLE measurements_unpartitioned")
+                cursor.execute("""
+                    SELECT setval(
+                        pg_get_serial_sequence('measurements', 'measurement_id'),
+                        COALESCE((SELECT MAX(measurement_id) FROM measurements), 1)
+                    )
+                """)
 
-        if key_field:
-            update_str = ', '.join(f"{field} = EXCLUDED.{field}" for field in update_fields)
+    def maintain_partitions(self, months_ahead: int, retention_months: int, drop_expired: bool = False) -> None:
+        """Create upcoming measurements partitions and retire expired ones"""
+        with self.transaction() as cursor:
+            self.partitions.create_upcoming(cursor, months_ahead)
+            expired = self.partitions.apply_retention(cursor, retention_months, drop_expired)
 
-            query = f"""
-                INSERT INTO {table_name} ({columns_str})
-                VALUES ({placeholders})
-                ON CONFLICT ({key_field}) DO UPDATE SET
-                {update_str}
-            """
+        if expired:
+            print(f"{'Dropped' if drop_expired else 'Detached'} measurements partitions: {', '.join(expired)}")
+
+    def generic_insert(self, schema_key: str, data_list: List[Dict], additional_data: Dict = None) -> int:
+        """Generic insert method that loads all table data in batches"""
+        page = self._mappers[schema_key].map_page(data_list)
+        return self.insert_mapped(schema_key, page, additional_data)
+
+    def insert_mapped(self, schema_key: str, page: MappedPage, additional_data: Dict = None,
+                      checkpoint: Checkpoint = None) -> int:
+        """Load a page already mapped and validated, e.g. by a PageParser
+
+        Measurements already stored, from a lookback window or a replay,
+        are dropped by the natural key. A `checkpoint` is committed together
+        with the page's last batch.
+        """
+        mapper = self._mappers[schema_key]
+        columns, rows, sources = mapper.columns, page.rows, page.sources
+
+        if page.rejected:
+            self._quarantine(schema_key, page.rejected, 'invalid_record')
+
+        if self.validator:
+            page, failures = self.validator.validate(schema_key, columns, page)
+            for reason_code, rejected in failures.items():
+                self._quarantine(schema_key, rejected, reason_code)
+            rows, sources = page.rows, page.sources
+
+        if schema_key == 'measurements':
+            self._register_unknown_locations(columns, rows)
+            rows, sources = self._select_new_measurements(columns, rows, sources)
+
+        changed_hashes = None
+        if mapper.schema['update_fields']:
+            rows, sources, changed_hashes = self._select_changed_rows(schema_key, columns, rows, sources)
+
+        if additional_data:
+            extra_columns = tuple(col for col in mapper.schema['columns']
+                                  if col in additional_data and col not in columns)
+            extra_values = tuple(additional_data[col] for col in extra_columns)
+            columns = columns + extra_columns
+            rows = [row + extra_values for row in rows]
+
+        loaded = 0
+        for start in range(0, len(rows), self.batch_size):
+            end = start + self.batch_size
+            last_batch = end >= len(rows)
+            loaded += self._load_batch(mapper, columns, rows[start:end], sources[start:end],
+                                       checkpoint if last_batch else None)
+
+        if checkpoint and not rows:
+            with self.transaction() as cursor:
+                self._save_checkpoint(cursor, checkpoint)
+
+        if changed_hashes and loaded == len(rows):
+            self._row_hashes[schema_key].update(changed_hashes)
+
+        if schema_key == 'locations':
+            self._sync_location_index(columns, rows, complete=loaded == len(rows))
+
+        if schema_key == 'parameters' and self.validator:
+            name_index, unit_index = columns.index('name'), columns.index('preferred_unit')
+            self.validator.preferred_units.update(
+                (row[name_index], row[unit_index]) for row in rows if row[unit_index] is not None
+            )
+
+        return loaded
+
+    def load_location_index(self) -> None:
+        """Load the location index from the locations table, once per process"""
+        if self.location_index.loaded:
+            return
+        with self.transaction() as cursor:
+            self.location_index.load(cursor)
+        print(f"Loaded {len(self.location_index)} known location ids")
+
+    def load_preferred_units(self) -> None:
+        """Load the parameters' preferred units that measurement units are normalized to"""
+        if not self.validator:
+            return
+        with self.transaction() as cursor:
+            self.validator.load_preferred_units(cursor)
+
+    def _sync_location_index(self, columns: Sequence[str], rows: List[tuple], complete: bool) -> None:
+        """Add upserted locations to the index; after a partial load, reread it from the table"""
+        self.unknown_location_ids.difference_update(row[columns.index('location_id')] for row in rows)
+        if complete:
+            self.location_index.add(row[columns.index('location_id')] for row in rows)
         else:
-            query = f"""
-                INSERT INTO {table_name} ({columns_str})
-                VALUES ({placeholders})
-            """
-        return query, values
+            self.location_index.loaded = False
+            self.load_location_index()
+
+    def _register_unknown_locations(self, columns: Sequence[str], rows: List[tuple]) -> None:
+        """Queue location ids missing from the index, storing inferred members for them in 'infer' mode"""
+        location_index = columns.index('location_id')
+        unknown = {}
+        for row in rows:
+            location_id = row[location_index]
+            if location_id not in self.location_index and location_id not in unknown:
+                unknown[location_id] = row
+
+        if not unknown:
+            return
+
+        self.unknown_location_ids.update(unknown)
+        metrics.increment('locations_unknown', len(unknown))
+        if self.unknown_locations != 'infer':
+            return
+
+        indexes = [columns.index(col) for col in ('location_id', 'country', 'city', 'latitude', 'longitude')]
+        with self.transaction() as cursor:
+            execute_values(cursor, """
+                INSERT INTO locations (location_id, country, city, latitude, longitude, is_inferred)
+                VALUES %s
+                ON CONFLICT (location_id) DO NOTHING
+            """, [tuple(row[index] for index in indexes) + (True,) for row in unknown.values()])
+        self.location_index.add(unknown)
+
+    def take_unknown_location_ids(self, limit: int) -> List[Any]:
+        """Remove and return up to `limit` unknown location ids, queued or with parked measurements"""
+        with self.transaction() as cursor:
+            cursor.execute("SELECT DISTINCT location_id FROM etl_pending_measurements")
+            self.unknown_location_ids.update(row[0] for row in cursor.fetchall() if row[0] not in self.location_index)
+
+        location_ids = list(self.unknown_location_ids)[:limit]
+        self.unknown_location_ids.difference_update(location_ids)
+        return location_ids
+
+    def _park_measurements(self, columns: Sequence[str], rows: List[tuple], sources: List[Dict]) -> None:
+        """Keep measurements of unknown locations until their location is loaded"""
+        indexes = [columns.index(col) for col in ('location_id', 'parameter', 'timestamp_utc')]
+        with self.transaction() as cursor:
+            execute_values(cursor, """
+                INSERT INTO etl_pending_measurements (location_id, parameter, timestamp_utc, payload)
+                VALUES %s
+                ON CONFLICT DO NOTHING
+            """, [tuple(row[index] for index in indexes) + (json.dumps(source, default=str),)
+                  for row, source in zip(rows, sources)])
+        metrics.increment('measurements_parked', len(rows))
+
+    def load_pending_measurements(self) -> int:
+        """Load the parked measurements whose location is now known; returns the rows loaded
+
+        Parked rows are only forgotten once the load has run, so a failed
+        load leaves them for the next run.
+        """
+        with self.transaction() as cursor:
+            cursor.execute("SELECT DISTINCT location_id FROM etl_pending_measurements")
+            location_ids = [row[0] for row in cursor.fetchall() if row[0] in self.location_index]
+            if not location_ids:
+                return 0
+            cursor.execute("""
+                SELECT location_id, parameter, timestamp_utc, payload
+                FROM etl_pending_measurements
+                WHERE location_id = ANY(%s)
+                ORDER BY timestamp_utc
+            """, (location_ids,))
+            pending = cursor.fetchall()
+
+        loaded = self.insert_mapped('measurements', self._mappers['measurements'].map_page(
+            [payload for *_, payload in pending]))
+
+        with self.transaction() as cursor:
+            execute_values(cursor, """
+                DELETE FROM etl_pending_measurements p
+                USING (VALUES %s) AS released (location_id, parameter, timestamp_utc)
+                WHERE p.location_id = released.location_id
+                    AND p.parameter = released.parameter
+                    AND p.timestamp_utc = released.timestamp_utc
+            """, [tuple(row[:3]) for row in pending])
+        return loaded
+
+    @staticmethod
+    def _row_digest(row: tuple) -> bytes:
+        return hashlib.blake2b(repr(row).encode(), digest_size=16).digest()
+
+    def _select_changed_rows(self, schema_key: str, columns: Sequence[str], rows: List[tuple],
+                             sources: List[Dict]) -> Tuple[List[tuple], List[Dict], Dict[Any, bytes]]:
+        """Drop rows identical to the ones last loaded for their key; returns the new digests"""
+        key_index = columns.index(self._mappers[schema_key].schema['key_field'])
+        known = self._row_hashes.setdefault(schema_key, {})
+
+        selected_rows = []
+        selected_sources = []
+        changed = {}
+        for row, source in zip(rows, sources):
+            digest = self._row_digest(row)
+            if known.get(row[key_index]) == digest:
+                continue
+            selected_rows.append(row)
+            selected_sources.append(source)
+            changed[row[key_index]] = digest
+
+        metrics.increment('rows_unchanged', len(rows) - len(selected_rows), table=schema_key)
+        return selected_rows, selected_sources, changed
+
+    def _select_new_measurements(self, columns: Sequence[str], rows: List[tuple],
+                                 sources: List[Dict]) -> Tuple[List[tuple], List[Dict]]:
+        """Set aside measurements of unknown locations, parking them for a later load"""
+        location_index = columns.index('location_id')
+
+        selected_rows = []
+        selected_sources = []
+        parked_rows = []
+        parked_sources = []
+        for row, source in zip(rows, sources):
+            if row[location_index] not in self.location_index:
+                parked_rows.append(row)
+                parked_sources.append(source)
+                continue
+            selected_rows.append(row)
+            selected_sources.append(source)
+
+        if parked_rows:
+            self._park_measurements(columns, parked_rows, parked_sources)
+        return selected_rows, selected_sources
+
+    def _load_batch(self, mapper: RecordMapper, columns: Sequence[str], rows: List[tuple],
+                    sources: List[Dict], checkpoint: Checkpoint = None) -> int:
+        """Load one batch in a single transaction, falling back to row by row on failure
+
+        Returns the rows accepted without error; `rows_inserted` only counts
+        those the upsert actually wrote, not conflicts it skipped.
+        """
+        with metrics.timer('insert_batch', table=mapper.table_name):
+            try:
+                with self.transaction() as cursor:
+                    inserted = self._write_rows(cursor, mapper, columns, rows)
+                    if checkpoint:
+                        self._save_checkpoint(cursor, checkpoint)
+                loaded = len(rows)
+            except Exception as e:
+                print(f"Batch load into {mapper.table_name} failed, retrying row by row: {str(e)}")
+                metrics.increment('insert_batch_fallbacks', table=mapper.table_name)
+                loaded, inserted = self._load_rows_individually(mapper, columns, rows, sources, checkpoint)
+
+        metrics.increment('rows_inserted', inserted, table=mapper.table_name)
+        return loaded
+
+    def _write_rows(self, cursor, mapper: RecordMapper, columns: Sequence[str], rows: List[tuple]) -> int:
+        """COPY rows straight into append-only tables, or through a staging table for upserts
+
+        Returns the number of rows inserted or updated.
+        """
+        table_name = mapper.table_name
+
+        if not mapper.schema['key_field']:
+            self.copy_rows(cursor, table_name, columns, rows)
+            return len(rows)
+
+        cursor.execute(mapper.staging_sql(columns))
+        self.copy_rows(cursor, mapper.staging_table, columns, rows)
+
+        if table_name == 'measurements':
+            cursor.execute(f"SELECT DISTINCT DATE_TRUNC('month', timestamp_utc) FROM {mapper.staging_table}")
+            self.partitions.ensure(cursor, [row[0] for row in cursor.fetchall()])
+
+        load_facts = table_name == 'measurements' and self.fact_loader is not None
+        returning = FACT_RETURNING if load_facts else ""
+        cursor.execute(mapper.merge_sql(columns, returning))
+        written = cursor.rowcount
+
+        if load_facts:
+            self.fact_loader(cursor, cursor.fetchall())
+
+        if table_name == 'measurements':
+            self._advance_watermarks(cursor, mapper.staging_table)
+
+        return written
+
+    def load_checkpoints(self) -> Dict[str, Checkpoint]:
+        """Streams left unfinished by earlier runs, keyed by stream name"""
+        with self.transaction() as cursor:
+            cursor.execute("SELECT stream, endpoint, params, last_page FROM etl_checkpoints")
+            return {row[0]: Checkpoint(row[0], row[1], row[2] or {}, row[3]) for row in cursor.fetchall()}
+
+    @staticmethod
+    def _save_checkpoint(cursor, checkpoint: Checkpoint) -> None:
+        cursor.execute("""
+            INSERT INTO etl_checkpoints (stream, endpoint, params, last_page)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (stream) DO UPDATE SET
+                endpoint = EXCLUDED.endpoint,
+                params = EXCLUDED.params,
+                last_page = EXCLUDED.last_page,
+                updated_at = CURRENT_TIMESTAMP
+        """, (checkpoint.stream, checkpoint.endpoint, json.dumps(checkpoint.params, default=str), checkpoint.page))
+
+    def clear_checkpoint(self, stream: str) -> None:
+        """Forget a stream once all its pages are loaded"""
+        with self.transaction() as cursor:
+            cursor.execute("DELETE FROM etl_checkpoints WHERE stream = %s", (stream,))
+
+    def load_watermarks(self) -> None:
+        """Load the last loaded measurement timestamp per location and parameter"""
+        with self.transaction() as cursor:
+            cursor.execute("SELECT location_id, parameter, last_timestamp_utc FROM etl_watermarks")
+            self._watermarks = {(row[0], row[1]): row[2] for row in cursor.fetchall()}
+
+    @staticmethod
+    def _date_from(oldest: datetime, newest: datetime, lookback_hours: int, max_lookback_hours: int) -> str:
+        """The oldest watermark moved back by the lookback, but at most max_lookback_hours before the newest"""
+        max_lookback_hours = max(max_lookback_hours, lookback_hours)
+        date_from = max(oldest - timedelta(hours=lookback_hours), newest - timedelta(hours=max_lookback_hours))
+        return date_from.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    @staticmethod
+    def _initial_date_from(initial_lookback_hours: int) -> Optional[str]:
+        """Lower bound for series without any watermark yet; None (the whole history) when set to 0"""
+        if not initial_lookback_hours:
+            return None
+        date_from = datetime.utcnow() - timedelta(hours=initial_lookback_hours)
+        return date_from.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def measurements_date_from(self, lookback_hours: int, max_lookback_hours: int,
+                               initial_lookback_hours: int) -> Optional[str]:
+        """Lower bound for the next measurements pull
+
+        Starts from the series furthest behind, so stations reporting late
+        are still requested; a series silent for longer than the maximum
+        lookback stops holding the pull back. The natural key absorbs the
+        overlap. The first run only goes initial_lookback_hours back.
+        """
+        if not self._watermarks:
+            return self._initial_date_from(initial_lookback_hours)
+
+        return self._date_from(min(self._watermarks.values()), max(self._watermarks.values()),
+                               lookback_hours, max_lookback_hours)
+
+    def measurement_shards(self, shard_by: str, lookback_hours: int, max_lookback_hours: int,
+                           initial_lookback_hours: int) -> Dict[str, Dict[str, Any]]:
+        """Request params per extraction shard, one shard per stored country or location
+
+        Each shard starts from the oldest watermark of its series, as in
+        measurements_date_from; a shard without any, such as a newly added
+        country, starts initial_lookback_hours back.
+        """
+        shard_columns = {'country': ('l.country', 'country'), 'location': ('l.location_id', 'location_id')}
+        if shard_by not in shard_columns:
+            raise Exception(f"Unknown shard type: {shard_by}")
+        column, param = shard_columns[shard_by]
+
+        with self.transaction() as cursor:
+            cursor.execute(f"""
+                SELECT {column}, MIN(w.last_timestamp_utc), MAX(w.last_timestamp_utc)
+                FROM locations l
+                LEFT JOIN etl_watermarks w ON w.location_id = l.location_id
+                WHERE {column} IS NOT NULL
+                GROUP BY {column}
+                ORDER BY {column}
+            """)
+            rows = cursor.fetchall()
+
+        initial_date_from = self._initial_date_from(initial_lookback_hours)
+        shards = {}
+        for shard_value, oldest, newest in rows:
+            params = {param: shard_value}
+            if newest:
+                params['date_from'] = self._date_from(oldest, newest, lookback_hours, max_lookback_hours)
+            elif initial_date_from:
+                params['date_from'] = initial_date_from
+            shards[f"{shard_by}={shard_value}"] = params
+
+        return shards
+
+    @staticmethod
+    def _watermark_upsert_sql(source: str) -> str:
+        return f"""
+            INSERT INTO etl_watermarks (location_id, parameter, last_timestamp_utc)
+            {source}
+            ON CONFLICT (location_id, parameter) DO UPDATE SET
+                last_timestamp_utc = GREATEST(etl_watermarks.last_timestamp_utc, EXCLUDED.last_timestamp_utc),
+                updated_at = CURRENT_TIMESTAMP
+            RETURNING location_id, parameter, last_timestamp_utc
+        """
+
+    def _advance_watermarks(self, cursor, staging_table: str) -> None:
+        """Move watermarks forward in the same transaction as the loaded batch"""
+        cursor.execute(self._watermark_upsert_sql(f"""
+            SELECT location_id, parameter, MAX(timestamp_utc)
+            FROM {staging_table}
+            GROUP BY location_id, parameter
+        """))
+        for location_id, parameter, last_timestamp_utc in cursor.fetchall():
+            self._watermarks[(location_id, parameter)] = last_timestamp_utc
+
+    def _advance_watermarks_for_rows(self, cursor, columns: Sequence[str], rows: List[tuple]) -> None:
+        """Move watermarks forward for rows loaded one by one"""
+        location_index = columns.index('location_id')
+        parameter_index = columns.index('parameter')
+        timestamp_index = columns.index('timestamp_utc')
+
+        latest = {}
+        for row in rows:
+            key = (row[location_index], row[parameter_index])
+            if row[timestamp_index] is not None and (key not in latest or row[timestamp_index] > latest[key]):
+                latest[key] = row[timestamp_index]
+        if not latest:
+            return
+
+        watermarks = execute_values(cursor, self._watermark_upsert_sql("VALUES %s"),
+                                    [key + (timestamp,) for key, timestamp in latest.items()], fetch=True)
+        for location_id, parameter, last_timestamp_utc in watermarks:
+            self._watermarks[(location_id, parameter)] = last_timestamp_utc
+
+    def _load_rows_individually(self, mapper: RecordMapper, columns: Sequence[str], rows: List[tuple],
+                                sources: List[Dict], checkpoint: Checkpoint = None) -> Tuple[int, int]:
+        """Insert rows one by one under savepoints so bad rows are quarantined, not fatal
+
+        Measurements get the same partitions, watermarks and inline facts as
+        in a batch load, for the rows that could be inserted. Returns the
+        rows accepted without error and, of those, the rows written.
+        """
+        is_measurements = mapper.table_name == 'measurements'
+        load_facts = is_measurements and self.fact_loader is not None
+        query = mapper.row_upsert_sql(columns, FACT_RETURNING if load_facts else '')
+        loaded = 0
+        written = 0
+        loaded_rows = []
+        new_measurements = []
+        rejected = []
+
+        with self.transaction() as cursor:
+            if is_measurements:
+                self.partitions.ensure(cursor, (row[columns.index('timestamp_utc')] for row in rows))
+
+            for row, source in zip(rows, sources):
+                cursor.execute("SAVEPOINT row_insert")
+                try:
+                    self.execute_prepared(cursor, query, row)
+                    written += max(cursor.rowcount, 0)
+                    if load_facts:
+                        new_measurements.extend(cursor.fetchall())
+                    cursor.execute("RELEASE SAVEPOINT row_insert")
+                    loaded += 1
+                    loaded_rows.append(row)
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO SAVEPOINT row_insert")
+                    rejected.append((source, str(e)))
+
+            if load_facts:
+                self.fact_loader(cursor, new_measurements)
+            if is_measurements:
+                self._advance_watermarks_for_rows(cursor, columns, loaded_rows)
+
+            if checkpoint:
+                self._save_checkpoint(cursor, checkpoint)
+
+        if rejected:
+            self._quarantine(mapper.table_name, rejected, 'load_error')
+
+        return loaded, written
+
+    def record_run(self, started_at: datetime, finished_at: datetime, status: str, error: Optional[str],
+                   run_metrics: Dict, query_plans: Dict) -> None:
+        """Store the summary of one ETL run in etl_run_summary"""
+        with self.transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO etl_run_summary (started_at, finished_at, status, error, metrics, query_plans)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, (started_at, finished_at, status, error, json.dumps(run_metrics),
+                  json.dumps(query_plans) if query_plans else None))
+
+    def _quarantine(self, table_name: str, rejected: List[Tuple[Dict, str]], reason_code: str) -> None:
+        """Store rejected records with their error and reason code in rejected_records"""
+        print(f"Quarantining {len(rejected)} rejected {table_name} records: {reason_code}")
+        metrics.increment('rows_rejected', len(rejected), table=table_name, reason=reason_code)
+        rows = [(table_name, json.dumps(data, default=str), error, reason_code) for data, error in rejected]
+
+        with self.transaction() as cursor:
+            execute_values(
+                cursor,
+                "INSERT INTO rejected_records (table_name, payload, error, reason_code) VALUES %s",
+                rows
+            )
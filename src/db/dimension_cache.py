@@ -0,0 +1,115 @@
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Tuple
+from .scd import scd_insert_missing_sql
+
+# dimension -> (current version lookup by raw natural key, insert of missing members from the raw tables)
+DIMENSION_LOOKUPS = {
+    'dim_locations': (
+        """
+        SELECT original_location_id, location_key, valid_from
+        FROM dim_locations
+        WHERE is_current AND original_location_id = ANY(%s)
+        """,
+        scd_insert_missing_sql('dim_locations', "s.location_id = ANY(%s)")
+    ),
+    'dim_parameters': (
+        """
+        SELECT DISTINCT ON (parameter_name) parameter_name, parameter_key, valid_from
+        FROM dim_parameters
+        WHERE is_current AND parameter_name = ANY(%s)
+        ORDER BY parameter_name, parameter_key
+        """,
+        scd_insert_missing_sql('dim_parameters', "s.name = ANY(%s)")
+    )
+}
+
+DIMENSION_SNAPSHOTS = {
+    'dim_locations': """
+        SELECT original_location_id, location_key, valid_from
+        FROM dim_locations
+        WHERE is_current
+    """,
+    'dim_parameters': """
+        SELECT DISTINCT ON (parameter_name) parameter_name, parameter_key, valid_from
+        FROM dim_parameters
+        WHERE is_current
+        ORDER BY parameter_name, parameter_key
+    """
+}
+
+
+class DimensionKeyCache:
+    """Bounded natural key -> current version cache for the warehouse dimensions
+
+    Entries are (surrogate key, valid_from) of the member's current
+    version. Each dimension keeps an LRU of at most `max_size` entries.
+    Misses are resolved with one bulk lookup, and members that are still
+    missing are inserted from the raw tables in one statement.
+    """
+
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        self._keys: Dict[str, OrderedDict] = {name: OrderedDict() for name in DIMENSION_LOOKUPS}
+        self._time_range: Optional[Tuple[datetime, datetime]] = None
+        self.hits = 0
+        self.misses = 0
+
+    def refresh(self, cursor) -> None:
+        """Reload the cache from the dimension tables"""
+        for name, query in DIMENSION_SNAPSHOTS.items():
+            cursor.execute(query)
+            keys = OrderedDict()
+            for natural_key, surrogate_key, valid_from in cursor.fetchmany(self.max_size):
+                keys[natural_key] = (surrogate_key, valid_from)
+            self._keys[name] = keys
+
+        cursor.execute("SELECT MIN(hour_start), MAX(hour_start) FROM dim_time")
+        self._time_range = cursor.fetchone()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            **{f"{name}_size": len(keys) for name, keys in self._keys.items()}
+        }
+
+    def resolve(self, cursor, dimension: str, natural_keys: Iterable[Any]) -> Dict[Any, Tuple[int, datetime]]:
+        """Map natural keys to (surrogate key, valid_from) of their current version, creating missing members"""
+        keys = self._keys[dimension]
+        resolved = {}
+        missing = []
+
+        for natural_key in set(natural_keys):
+            if natural_key in keys:
+                keys.move_to_end(natural_key)
+                resolved[natural_key] = keys[natural_key]
+                self.hits += 1
+            else:
+                missing.append(natural_key)
+                self.misses += 1
+
+        if missing:
+            lookup_query, insert_query = DIMENSION_LOOKUPS[dimension]
+            cursor.execute(insert_query, (missing,))
+            cursor.execute(lookup_query, (missing,))
+            for natural_key, surrogate_key, valid_from in cursor.fetchall():
+                resolved[natural_key] = (surrogate_key, valid_from)
+                self._remember(keys, natural_key, resolved[natural_key])
+
+        return resolved
+
+    def time_key(self, timestamp: datetime) -> Optional[int]:
+        """yyyymmddhh key of the hour, or None when it is outside the generated calendar"""
+        hour_start = timestamp.replace(minute=0, second=0, microsecond=0)
+        if not self._time_range or self._time_range[0] is None:
+            return None
+        if not self._time_range[0] <= hour_start <= self._time_range[1]:
+            return None
+
+        return int(hour_start.strftime('%Y%m%d%H'))
+
+    def _remember(self, keys: OrderedDict, natural_key: Any, version: Tuple[int, datetime]) -> None:
+        keys[natural_key] = version
+        if len(keys) > self.max_size:
+            keys.popitem(last=False)
@@ -0,0 +1,113 @@
+from typing import Any, Dict, List, Sequence
+
+# Secondary indexes beyond primary keys and natural keys. Deferrable ones are
+# dropped for the duration of a backfill and rebuilt once it has finished.
+MANAGED_INDEXES: List[Dict[str, Any]] = [
+    {'name': 'idx_measurements_timestamp_brin', 'table': 'measurements',
+     'definition': 'USING BRIN (timestamp_utc)', 'deferrable': True},
+    {'name': 'idx_measurements_parameter', 'table': 'measurements',
+     'definition': '(parameter)', 'deferrable': True},
+    {'name': 'idx_locations_country', 'table': 'locations',
+     'definition': '(country)', 'deferrable': False},
+    {'name': 'idx_dim_parameters_name', 'table': 'dim_parameters',
+     'definition': '(parameter_name)', 'deferrable': False},
+    {'name': 'idx_fact_air_quality_measured_at_brin', 'table': 'fact_air_quality',
+     'definition': 'USING BRIN (measured_at)', 'deferrable': True},
+    {'name': 'idx_fact_air_quality_parameter_key', 'table': 'fact_air_quality',
+     'definition': '(parameter_key)', 'deferrable': True},
+    {'name': 'idx_fact_air_quality_time_key', 'table': 'fact_air_quality',
+     'definition': '(time_key)', 'deferrable': True},
+]
+
+# Foreign keys checked row by row on insert; dropped with the deferrable indexes
+MANAGED_FOREIGN_KEYS: List[Dict[str, str]] = [
+    {'name': 'measurements_location_id_fkey', 'table': 'measurements',
+     'definition': 'FOREIGN KEY (location_id) REFERENCES locations(location_id)'},
+    {'name': 'fact_air_quality_location_key_fkey', 'table': 'fact_air_quality',
+     'definition': 'FOREIGN KEY (location_key) REFERENCES dim_locations(location_key)'},
+    {'name': 'fact_air_quality_parameter_key_fkey', 'table': 'fact_air_quality',
+     'definition': 'FOREIGN KEY (parameter_key) REFERENCES dim_parameters(parameter_key)'},
+    {'name': 'fact_air_quality_time_key_fkey', 'table': 'fact_air_quality',
+     'definition': 'FOREIGN KEY (time_key) REFERENCES dim_time(time_key)'},
+]
+
+
+class IndexManager:
+    """Creates, defers and rebuilds the managed indexes and foreign keys of a set of tables"""
+
+    def __init__(self, tables: Sequence[str]):
+        self.tables = set(tables)
+        self.indexes = [index for index in MANAGED_INDEXES if index['table'] in self.tables]
+        self.foreign_keys = [fk for fk in MANAGED_FOREIGN_KEYS if fk['table'] in self.tables]
+        self.deferred = False
+
+    def ensure(self, cursor) -> None:
+        """Create any missing managed index or foreign key, unless deferred for a backfill"""
+        if self.deferred:
+            return
+
+        for index in self.indexes:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {index['name']} ON {index['table']} {index['definition']}")
+
+        for fk in self.foreign_keys:
+            cursor.execute("""
+                SELECT 1 FROM pg_constraint
+                WHERE conrelid = to_regclass(%s) AND conname = %s
+            """, (fk['table'], fk['name']))
+            if cursor.fetchone() is None:
+                cursor.execute(f"ALTER TABLE {fk['table']} ADD CONSTRAINT {fk['name']} {fk['definition']}")
+
+    def defer(self, cursor) -> None:
+        """Drop deferrable indexes and foreign keys until `restore` is called"""
+        self.deferred = True
+        for index in self.indexes:
+            if index['deferrable']:
+                cursor.execute(f"DROP INDEX IF EXISTS {index['name']}")
+        for fk in self.foreign_keys:
+            cursor.execute(f"ALTER TABLE IF EXISTS {fk['table']} DROP CONSTRAINT IF EXISTS {fk['name']}")
+
+    def restore(self, cursor) -> None:
+        """Rebuild everything dropped by `defer`"""
+        self.deferred = False
+        self.ensure(cursor)
+
+    @staticmethod
+    def report(cursor, min_table_rows: int = 10000) -> Dict[str, List[Dict[str, Any]]]:
+        """Unused and missing indexes according to the statistics collector
+
+        `unused` lists non-unique indexes never scanned since the stats were
+        reset, `missing_managed` managed indexes that do not exist, and
+        `seq_scan_heavy` tables of at least `min_table_rows` rows read more
+        often by sequential scans than by index scans.
+        """
+        cursor.execute("""
+            SELECT s.relname, s.indexrelname, s.idx_scan, pg_relation_size(s.indexrelid)
+            FROM pg_stat_user_indexes s
+            JOIN pg_index i ON i.indexrelid = s.indexrelid
+            WHERE s.idx_scan = 0 AND NOT i.indisunique AND NOT i.indisprimary
+            ORDER BY pg_relation_size(s.indexrelid) DESC
+        """)
+        unused = [
+            {'table': table, 'index': index, 'scans': scans, 'size_bytes': size}
+            for table, index, scans, size in cursor.fetchall()
+        ]
+
+        cursor.execute("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()")
+        existing = {row[0] for row in cursor.fetchall()}
+        missing_managed = [
+            {'table': index['table'], 'index': index['name']}
+            for index in MANAGED_INDEXES if index['name'] not in existing
+        ]
+
+        cursor.execute("""
+            SELECT relname, seq_scan, COALESCE(idx_scan, 0), n_live_tup
+            FROM pg_stat_user_tables
+            WHERE n_live_tup >= %s AND seq_scan > COALESCE(idx_scan, 0)
+            ORDER BY seq_tup_read DESC
+        """, (min_table_rows,))
+        seq_scan_heavy = [
+            {'table': table, 'seq_scans': seq_scans, 'index_scans': idx_scans, 'rows': rows}
+            for table, seq_scans, idx_scans, rows in cursor.fetchall()
+        ]
+
+        return {'unused': unused, 'missing_managed': missing_managed, 'seq_scan_heavy': seq_scan_heavy}
@@ -0,0 +1,55 @@
+from typing import Any, Iterable
+
+
+class LocationIndex:
+    """Membership bitmap of the location ids stored in the locations table
+
+    One bit per id keeps a few million ids in a few hundred KB; ids the
+    bitmap cannot hold (negative or non-integer) fall back to a set.
+    """
+
+    def __init__(self):
+        self._bits = bytearray()
+        self._others = set()
+        self._count = 0
+        self.loaded = False
+
+    def __len__(self) -> int:
+        return self._count + len(self._others)
+
+    def __contains__(self, location_id: Any) -> bool:
+        if isinstance(location_id, int) and location_id >= 0:
+            byte, bit = divmod(location_id, 8)
+            return byte < len(self._bits) and bool(self._bits[byte] >> bit & 1)
+        return location_id in self._others
+
+    def add(self, location_ids: Iterable[Any]) -> None:
+        bits = self._bits
+        for location_id in location_ids:
+            if not isinstance(location_id, int) or location_id < 0:
+                if location_id is not None:
+                    self._others.add(location_id)
+                continue
+
+            byte, bit = divmod(location_id, 8)
+            if byte >= len(bits):
+                # Grow at least geometrically so ascending ids do not copy the bitmap each time
+                bits.extend(bytes(max(byte + 1 - len(bits), len(bits))))
+            if not bits[byte] >> bit & 1:
+                bits[byte] |= 1 << bit
+                self._count += 1
+
+    def load(self, cursor, chunk_size: int = 50000) -> None:
+        """Replace the index with the ids currently in the locations table"""
+        self._bits = bytearray()
+        self._others = set()
+        self._count = 0
+
+        cursor.execute("SELECT location_id FROM locations ORDER BY location_id DESC")
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            self.add(row[0] for row in rows)
+
+        self.loaded = True
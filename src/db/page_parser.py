@@ -0,0 +1,68 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List
+from .record_mapper import MappedPage, RecordMapper
+from src.config import TABLE_SCHEMAS
+
+# Mappers of a worker process, built on first use
+_worker_mappers: Dict[str, RecordMapper] = {}
+
+
+def _parse_in_worker(schema_key: str, records: List[Dict]):
+    mapper = _worker_mappers.get(schema_key)
+    if mapper is None:
+        mapper = _worker_mappers[schema_key] = RecordMapper(TABLE_SCHEMAS[schema_key])
+    return mapper.parse_rows(records)
+
+
+class PageParser:
+    """Maps and validates pages of API records, in worker processes when `processes` > 0
+
+    Workers only return row tuples and error positions; the records stay in
+    this process and are paired back up with `RecordMapper.assemble`.
+    """
+
+    def __init__(self, processes: int = 0):
+        self.processes = processes
+        self._mappers = {schema_key: RecordMapper(schema) for schema_key, schema in TABLE_SCHEMAS.items()}
+        self._executor = None
+        if processes > 0:
+            # spawn rather than fork: the parent runs scheduler, pool and fetch threads
+            self._executor = ProcessPoolExecutor(max_workers=processes,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+
+    def parse(self, schema_key: str, records: List[Dict]) -> MappedPage:
+        return self._mappers[schema_key].map_page(records)
+
+    def iter_parsed(self, schema_key: str, pages: Iterable[List[Dict]]) -> Iterator[MappedPage]:
+        """Parse pages in order, keeping up to `processes` pages in the workers at once"""
+        if self._executor is None:
+            for records in pages:
+                yield self.parse(schema_key, records)
+            return
+
+        pending: deque = deque()
+        try:
+            for records in pages:
+                pending.append((records, self._executor.submit(_parse_in_worker, schema_key, records)))
+                if len(pending) >= self.processes:
+                    yield self._collect(*pending.popleft())
+            while pending:
+                yield self._collect(*pending.popleft())
+        finally:
+            for _, future in pending:
+                future.cancel()
+            close = getattr(pages, 'close', None)
+            if close:
+                close()
+
+    @staticmethod
+    def _collect(records: List[Dict], future: Future) -> MappedPage:
+        rows, errors = future.result()
+        return RecordMapper.assemble(records, rows, errors)
+
+    def close(self) -> None:
+        if self._executor:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
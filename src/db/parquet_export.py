@@ -0,0 +1,346 @@
+import os
+import re
+import shutil
+import uuid
+from datetime import date
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # optional, only needed when the Parquet export is enabled
+    pa = None
+
+from src.metrics import metrics
+
+EXPORT_STEP = 'parquet_export'
+FACT_TABLE = 'fact_air_quality'
+
+# Exported columns and their Parquet types; DECIMAL columns leave Postgres as doubles
+FACT_COLUMNS: List[Tuple[str, str]] = [
+    ('measurement_key', 'int64'),
+    ('location_key', 'int32'),
+    ('parameter_key', 'int32'),
+    ('time_key', 'int32'),
+    ('measured_at', 'timestamp'),
+    ('measurement_value', 'float64'),
+    ('unit', 'string'),
+]
+
+DIMENSION_COLUMNS: Dict[str, List[Tuple[str, str]]] = {
+    'dim_locations': [
+        ('location_key', 'int32'),
+        ('original_location_id', 'int32'),
+        ('location_name', 'string'),
+        ('city', 'string'),
+        ('country', 'string'),
+        ('latitude', 'float64'),
+        ('longitude', 'float64'),
+        ('is_mobile', 'bool'),
+        ('is_inferred', 'bool'),
+        ('valid_from', 'timestamp'),
+        ('valid_to', 'timestamp'),
+        ('is_current', 'bool'),
+    ],
+    'dim_parameters': [
+        ('parameter_key', 'int32'),
+        ('original_parameter_id', 'int32'),
+        ('parameter_name', 'string'),
+        ('description', 'string'),
+        ('preferred_unit', 'string'),
+        ('valid_from', 'timestamp'),
+        ('valid_to', 'timestamp'),
+        ('is_current', 'bool'),
+    ],
+    'dim_time': [
+        ('time_key', 'int32'),
+        ('hour_start', 'timestamp'),
+        ('date', 'date32'),
+        ('year', 'int32'),
+        ('month', 'int32'),
+        ('day', 'int32'),
+        ('hour', 'int32'),
+        ('is_weekend', 'bool'),
+    ],
+}
+
+# Dimension joined to the facts on each key by ParquetReader.aggregate
+FACT_DIMENSION_KEYS = {'dim_locations': 'location_key', 'dim_parameters': 'parameter_key'}
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise Exception("Parquet export requires pyarrow, install it with `pip install -r requirements-export.txt`")
+
+
+def _arrow_schema(columns: List[Tuple[str, str]]) -> 'pa.Schema':
+    types = {
+        'int32': pa.int32(), 'int64': pa.int64(), 'float64': pa.float64(), 'string': pa.string(),
+        'bool': pa.bool_(), 'date32': pa.date32(), 'timestamp': pa.timestamp('us')
+    }
+    return pa.schema([(name, types[type_name]) for name, type_name in columns])
+
+
+def _select_list(alias: str, columns: List[Tuple[str, str]]) -> str:
+    return ', '.join(
+        f"{alias}.{name}::DOUBLE PRECISION" if type_name == 'float64' else f"{alias}.{name}"
+        for name, type_name in columns
+    )
+
+
+def _partition_value(value: Any) -> str:
+    return re.sub(r'[^A-Za-z0-9_-]', '_', str(value)) if value else 'unknown'
+
+
+class ParquetExporter:
+    """Writes new facts and dimension snapshots of the star schema to Parquet files
+
+    Facts land in <directory>/fact_air_quality/date=YYYY-MM-DD/country=XX/,
+    one file per partition and export; each dimension is rewritten whole as
+    <directory>/<dimension>/snapshot.parquet. Rows are streamed from
+    server-side cursors `chunk_size` at a time, so memory does not grow
+    with the export.
+    """
+
+    def __init__(self, directory: str, chunk_size: int = 50000):
+        _require_pyarrow()
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.fact_schema = _arrow_schema(FACT_COLUMNS)
+
+    def export(self, cursor, full_rebuild: bool = False) -> int:
+        """Export fresh dimension snapshots, then the facts added since the last export
+
+        The export watermark is advanced on `cursor`, inside the caller's
+        transaction, as the last statement after the fact files are
+        written. A full rebuild writes every fact to a staging directory
+        that only replaces the previous export once it is complete.
+        Returns the number of facts exported.
+        """
+        fact_directory = os.path.join(self.directory, FACT_TABLE)
+        if full_rebuild:
+            cursor.execute("DELETE FROM etl_transform_state WHERE step_name = %s", (EXPORT_STEP,))
+
+        # Snapshots are rewritten whole, so exporting them first is safe if the facts fail
+        for dimension, columns in DIMENSION_COLUMNS.items():
+            self._export_snapshot(cursor, dimension, columns)
+
+        cursor.execute("""
+            SELECT last_measurement_id FROM etl_transform_state
+            WHERE step_name = %s
+            FOR UPDATE
+        """, (EXPORT_STEP,))
+        row = cursor.fetchone()
+        last_key = row[0] if row else 0
+
+        cursor.execute("SELECT COALESCE(MAX(measurement_key), 0) FROM fact_air_quality")
+        max_key = cursor.fetchone()[0]
+
+        exported = 0
+        if full_rebuild:
+            # Dot-prefixed, so readers of the export directory never see it
+            staging = os.path.join(self.directory, f".{FACT_TABLE}.rebuild")
+            shutil.rmtree(staging, ignore_errors=True)
+            try:
+                if max_key > last_key:
+                    exported = self._export_facts(cursor, staging, last_key, max_key)
+            except Exception:
+                shutil.rmtree(staging, ignore_errors=True)
+                raise
+            self._swap(staging, fact_directory)
+        elif max_key > last_key:
+            exported = self._export_facts(cursor, fact_directory, last_key, max_key)
+
+        if max_key > last_key:
+            cursor.execute("""
+                INSERT INTO etl_transform_state (step_name, last_measurement_id)
+                VALUES (%s, %s)
+                ON CONFLICT (step_name) DO UPDATE SET
+                    last_measurement_id = EXCLUDED.last_measurement_id,
+                    updated_at = CURRENT_TIMESTAMP
+            """, (EXPORT_STEP, max_key))
+
+        print(f"Exported {exported} facts to {self.directory}")
+        return exported
+
+    def _swap(self, staging: str, fact_directory: str) -> None:
+        """Replace the exported facts with a finished rebuild, keeping the old files until it is in place"""
+        os.makedirs(staging, exist_ok=True)
+        previous = os.path.join(self.directory, f".{FACT_TABLE}.previous")
+        shutil.rmtree(previous, ignore_errors=True)
+        if os.path.exists(fact_directory):
+            os.replace(fact_directory, previous)
+        os.replace(staging, fact_directory)
+        shutil.rmtree(previous, ignore_errors=True)
+
+    def _stream(self, cursor, query: str, params: Dict = None) -> Iterator[List[tuple]]:
+        """Rows of a query in chunks, read through a server-side cursor on the caller's connection"""
+        with cursor.connection.cursor(name=f"{EXPORT_STEP}_{uuid.uuid4().hex[:8]}") as stream:
+            stream.itersize = self.chunk_size
+            stream.execute(query, params)
+            while True:
+                rows = stream.fetchmany(self.chunk_size)
+                if not rows:
+                    break
+                yield rows
+
+    @staticmethod
+    def _to_table(rows: List[tuple], schema: 'pa.Schema') -> 'pa.Table':
+        columns = list(zip(*rows))
+        return pa.Table.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+            schema=schema
+        )
+
+    def _export_snapshot(self, cursor, dimension: str, columns: List[Tuple[str, str]]) -> None:
+        schema = _arrow_schema(columns)
+        directory = os.path.join(self.directory, dimension)
+        os.makedirs(directory, exist_ok=True)
+
+        path = os.path.join(directory, 'snapshot.parquet')
+        # Dot-prefixed files are ignored by dataset readers until renamed
+        tmp_path = os.path.join(directory, '.snapshot.parquet.tmp')
+        try:
+            with pq.ParquetWriter(tmp_path, schema) as writer:
+                query = f"SELECT {_select_list('d', columns)} FROM {dimension} d ORDER BY 1"
+                for rows in self._stream(cursor, query):
+                    writer.write_table(self._to_table(rows, schema))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)
+
+    def _export_facts(self, cursor, fact_directory: str, last_key: int, max_key: int) -> int:
+        """Write facts with measurement_key in (last_key, max_key] to date and country partitions under fact_directory
+
+        Facts arrive ordered by day, so a partition's file is finished as
+        soon as a chunk starts on a later day and few files are open at once.
+        """
+        query = f"""
+            SELECT {_select_list('f', FACT_COLUMNS)}, f.measured_at::DATE, l.country
+            FROM fact_air_quality f
+            LEFT JOIN dim_locations l ON l.location_key = f.location_key
+            WHERE f.measurement_key > %(last_key)s AND f.measurement_key <= %(max_key)s
+            ORDER BY f.measured_at
+        """
+        export_id = uuid.uuid4().hex[:8]
+        writers: Dict[Tuple[date, str], tuple] = {}
+        written: List[str] = []
+        exported = 0
+
+        def finish(partition):
+            writer, tmp_path, path = writers.pop(partition)
+            writer.close()
+            os.replace(tmp_path, path)
+            written.append(path)
+
+        try:
+            for rows in self._stream(cursor, query, {'last_key': last_key, 'max_key': max_key}):
+                first_day = rows[0][-2]
+                for partition in [p for p in writers if p[0] < first_day]:
+                    finish(partition)
+
+                groups: Dict[Tuple[date, str], List[tuple]] = {}
+                for row in rows:
+                    groups.setdefault((row[-2], _partition_value(row[-1])), []).append(row[:-2])
+
+                for partition, group in groups.items():
+                    if partition not in writers:
+                        day, country = partition
+                        directory = os.path.join(fact_directory, f"date={day.isoformat()}", f"country={country}")
+                        os.makedirs(directory, exist_ok=True)
+                        name = f"part-{last_key + 1}-{max_key}-{export_id}.parquet"
+                        tmp_path = os.path.join(directory, f".{name}.tmp")
+                        writers[partition] = (pq.ParquetWriter(tmp_path, self.fact_schema), tmp_path,
+                                              os.path.join(directory, name))
+                    writers[partition][0].write_table(self._to_table(group, self.fact_schema))
+
+                exported += len(rows)
+                metrics.increment('parquet_rows_exported', len(rows), table=FACT_TABLE)
+
+            for partition in list(writers):
+                finish(partition)
+        except Exception:
+            # Leave no partial export behind; the watermark has not moved either
+            for writer, tmp_path, _ in writers.values():
+                writer.close()
+                os.remove(tmp_path)
+            for path in written:
+                os.remove(path)
+            raise
+
+        return exported
+
+
+class ParquetReader:
+    """Reads the exported star schema for offline analysis, without touching the database"""
+
+    def __init__(self, directory: str):
+        _require_pyarrow()
+        self.directory = directory
+        self.partitioning = ds.partitioning(pa.schema([('date', pa.string()), ('country', pa.string())]),
+                                            flavor='hive')
+
+    def dimension(self, dimension: str) -> 'pa.Table':
+        """The latest snapshot of a dimension, every version included"""
+        path = os.path.join(self.directory, dimension, 'snapshot.parquet')
+        if not os.path.exists(path):
+            raise Exception(f"No exported snapshot of {dimension} in {self.directory}")
+        return pq.read_table(path)
+
+    def facts(self, date_from: date = None, date_to: date = None, countries: Sequence[str] = None,
+              columns: List[str] = None) -> 'pa.Table':
+        """Exported facts measured between the given dates (inclusive) in the given countries
+
+        Dates and countries are matched against the partition paths, so
+        only the matching files are read. `date` and `country` can be
+        selected as columns.
+        """
+        directory = os.path.join(self.directory, FACT_TABLE)
+        if not os.path.isdir(directory):
+            raise Exception(f"No exported facts in {self.directory}")
+
+        dataset = ds.dataset(directory, format='parquet', partitioning=self.partitioning)
+        condition = None
+        for expression in (
+            ds.field('date') >= date_from.isoformat() if date_from else None,
+            ds.field('date') <= date_to.isoformat() if date_to else None,
+            ds.field('country').isin([_partition_value(c) for c in countries]) if countries else None,
+        ):
+            if expression is not None:
+                condition = expression if condition is None else condition & expression
+
+        return dataset.to_table(columns=columns, filter=condition)
+
+    def aggregate(self, group_by: Sequence[str] = ('country', 'parameter_name'), date_from: date = None,
+                  date_to: date = None, countries: Sequence[str] = None) -> List[Dict[str, Any]]:
+        """Count, mean, min and max of the measurement values per group
+
+        `group_by` may name fact columns, the `date` and `country`
+        partitions, or columns of dim_locations and dim_parameters, which
+        are joined on their surrogate keys as needed.
+        """
+        group_by = list(group_by)
+        fact_names = [name for name, _ in FACT_COLUMNS] + ['date', 'country']
+        needed = [name for name in group_by if name in fact_names]
+        table_columns = {'location_key', 'parameter_key', 'measurement_value', *needed}
+        table = self.facts(date_from, date_to, countries, columns=sorted(table_columns))
+
+        for dimension, key in FACT_DIMENSION_KEYS.items():
+            joined = [name for name in group_by if name not in table.column_names
+                      and name in dict(DIMENSION_COLUMNS[dimension])]
+            if joined:
+                table = table.join(self.dimension(dimension).select([key, *joined]), key)
+
+        unknown = [name for name in group_by if name not in table.column_names]
+        if unknown:
+            raise Exception(f"Cannot group exported facts by: {', '.join(unknown)}")
+
+        return table.group_by(group_by).aggregate([
+            ('measurement_value', 'count'),
+            ('measurement_value', 'mean'),
+            ('measurement_value', 'min'),
+            ('measurement_value', 'max'),
+        ]).to_pylist()
@@ -0,0 +1,66 @@
+import re
+from datetime import date
+from typing import Iterable, List
+
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+class PartitionManager:
+    """Creates and retires the monthly range partitions of one table
+
+    Partitions are named <table>_pYYYYMM and cover [first of month, first
+    of next month) of the partition key.
+    """
+
+    def __init__(self, table_name: str):
+        self.table_name = table_name
+        self._name_pattern = re.compile(rf"{table_name}_p(\d{{4}})(\d{{2}})")
+
+    def partition_name(self, month: date) -> str:
+        return f"{self.table_name}_p{month:%Y%m}"
+
+    def ensure(self, cursor, timestamps: Iterable) -> None:
+        """Create the partitions covering the given timestamps if they are missing"""
+        months = {date(value.year, value.month, 1) for value in timestamps if value is not None}
+
+        for month in sorted(months):
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.partition_name(month)}
+                PARTITION OF {self.table_name}
+                FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{_add_months(month, 1):%Y-%m-%d}')
+            """)
+
+    def create_upcoming(self, cursor, months_ahead: int) -> None:
+        """Create partitions from the current month up to `months_ahead` months ahead"""
+        current = date.today().replace(day=1)
+        self.ensure(cursor, [_add_months(current, offset) for offset in range(months_ahead + 1)])
+
+    def apply_retention(self, cursor, retention_months: int, drop: bool = False) -> List[str]:
+        """Detach (or drop) partitions that ended more than `retention_months` months ago"""
+        if retention_months <= 0:
+            return []
+
+        cutoff = _add_months(date.today().replace(day=1), -retention_months)
+        cursor.execute("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(%s)
+        """, (self.table_name,))
+
+        expired = []
+        for (partition,) in cursor.fetchall():
+            match = self._name_pattern.fullmatch(partition)
+            if match and date(int(match.group(1)), int(match.group(2)), 1) < cutoff:
+                expired.append(partition)
+
+        for partition in sorted(expired):
+            if drop:
+                cursor.execute(f"DROP TABLE {partition}")
+            else:
+                cursor.execute(f"ALTER TABLE {self.table_name} DETACH PARTITION {partition}")
+
+        return expired
@@ -0,0 +1,101 @@
+import threading
+import psycopg2
+from contextlib import contextmanager
+from typing import Dict, Iterator
+from psycopg2.extensions import connection
+from psycopg2.pool import ThreadedConnectionPool
+
+
+class PooledConnection(connection):
+    """Connection that remembers which statements it has prepared server-side"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = set()
+
+
+class ConnectionPool:
+    """Process-wide pool of db connections shared by every ETL stage
+
+    Checkout blocks while all connections are in use instead of failing,
+    and every connection is health-checked before it is handed out.
+    """
+
+    def __init__(self, db_params: Dict[str, str], min_size: int = 1, max_size: int = 5,
+                 checkout_attempts: int = 3):
+        self.max_size = max_size
+        self.checkout_attempts = checkout_attempts
+        self._slots = threading.BoundedSemaphore(max_size)
+        try:
+            self._pool = ThreadedConnectionPool(
+                min_size, max_size, connection_factory=PooledConnection, **db_params
+            )
+        except Exception as e:
+            raise Exception(f"Failed to create connection pool: {str(e)}")
+
+    @contextmanager
+    def connection(self) -> Iterator[connection]:
+        """Borrow a healthy connection for the duration of a block"""
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def getconn(self) -> connection:
+        self._slots.acquire()
+        try:
+            for _ in range(self.checkout_attempts):
+                conn = self._pool.getconn()
+                if self._is_healthy(conn):
+                    return conn
+                self._pool.putconn(conn, close=True)
+        except Exception:
+            self._slots.release()
+            raise
+
+        self._slots.release()
+        raise Exception(f"No healthy db connection after {self.checkout_attempts} attempts")
+
+    def putconn(self, conn: connection) -> None:
+        try:
+            self._pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def advisory_lock(self, name: str) -> Iterator[bool]:
+        """Try to take a session-level advisory lock; yields whether it was acquired
+
+        The lock is held on a dedicated pooled connection for the duration of
+        the block, so only one process across all replicas runs it at a time.
+        """
+        with self.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (name,))
+                acquired = cursor.fetchone()[0]
+            conn.commit()
+
+            try:
+                yield acquired
+            finally:
+                if acquired and not conn.closed:
+                    with conn.cursor() as cursor:
+                        cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", (name,))
+                    conn.commit()
+
+    def close(self) -> None:
+        """Close every pooled connection"""
+        self._pool.closeall()
+
+    @staticmethod
+    def _is_healthy(conn: connection) -> bool:
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
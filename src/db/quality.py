@@ -0,0 +1,181 @@
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from .record_mapper import MappedPage
+from src.config import QUALITY_RULES
+from src.metrics import metrics
+
+# Unit -> (base unit, factor converting to it); units sharing a base convert by scaling
+UNIT_SCALES = {
+    'µg/m³': ('µg/m³', 1.0),
+    'mg/m³': ('µg/m³', 1000.0),
+    'ppb': ('ppb', 1.0),
+    'ppm': ('ppb', 1000.0),
+}
+
+# Molar masses (g/mol) of gases reported both as mixing ratios and as mass concentrations
+MOLAR_MASSES = {'co': 28.01, 'no': 30.01, 'no2': 46.01, 'o3': 48.00, 'so2': 64.07, 'nh3': 17.03}
+MOLAR_VOLUME = 24.45  # litres per mole at 25 °C and 1 atm
+
+Columns = Dict[str, Sequence[Any]]
+
+
+def unit_factor(parameter: str, unit: str, preferred_unit: str) -> Optional[float]:
+    """Factor converting `parameter` values from `unit` to `preferred_unit`, None when they do not convert"""
+    if unit == preferred_unit:
+        return 1.0
+    if unit not in UNIT_SCALES or preferred_unit not in UNIT_SCALES:
+        return None
+
+    base, factor = UNIT_SCALES[unit]
+    preferred_base, preferred_factor = UNIT_SCALES[preferred_unit]
+    if base != preferred_base:
+        molar_mass = MOLAR_MASSES.get(parameter)
+        if molar_mass is None:
+            return None
+        factor *= molar_mass / MOLAR_VOLUME if base == 'ppb' else MOLAR_VOLUME / molar_mass
+    return factor / preferred_factor
+
+
+def _check_min(rule: Dict, columns: Columns, context: Dict) -> List[int]:
+    minimum = rule['min']
+    return [position for position, value in enumerate(columns[rule['column']])
+            if value is not None and value < minimum]
+
+
+def _check_range(rule: Dict, columns: Columns, context: Dict) -> List[int]:
+    minimum, maximum = rule['min'], rule['max']
+    return [position for position, value in enumerate(columns[rule['column']])
+            if value is not None and not minimum <= value <= maximum]
+
+
+def _check_not_future(rule: Dict, columns: Columns, context: Dict) -> List[int]:
+    latest = context['now'] + timedelta(minutes=rule.get('tolerance_minutes', 0))
+    return [position for position, value in enumerate(columns[rule['column']])
+            if value is not None and value > latest]
+
+
+def _check_preferred_unit(rule: Dict, columns: Columns, context: Dict) -> List[int]:
+    factors = context['unit_factors']
+    preferred_units = context['preferred_units']
+    failed = []
+    # Factors are looked up once per distinct (parameter, unit) pair of the page
+    for position, key in enumerate(zip(columns[rule['parameter_column']], columns[rule['column']])):
+        if key not in factors:
+            parameter, unit = key
+            preferred_unit = preferred_units.get(parameter)
+            if unit is None or preferred_unit is None:
+                factors[key] = 1.0
+            else:
+                factors[key] = unit_factor(parameter, unit, preferred_unit)
+        if factors[key] is None:
+            failed.append(position)
+    return failed
+
+
+def _out_of_scope(rule: Dict, columns: Columns) -> set:
+    """Positions a rule limited with `parameters` or `exclude_parameters` does not apply to"""
+    if 'parameters' not in rule and 'exclude_parameters' not in rule:
+        return set()
+    included = set(rule.get('parameters', ()))
+    excluded = set(rule.get('exclude_parameters', ()))
+    return {position for position, parameter in enumerate(columns[rule['parameter_column']])
+            if (included and parameter not in included) or parameter in excluded}
+
+
+# Each check receives whole columns of a page and returns the failing positions
+CHECKS: Dict[str, Callable[[Dict, Columns, Dict], List[int]]] = {
+    'min': _check_min,
+    'range': _check_range,
+    'not_future': _check_not_future,
+    'preferred_unit': _check_preferred_unit,
+}
+
+
+class QualityValidator:
+    """Applies the QUALITY_RULES of a table to mapped pages and normalizes units in the same pass
+
+    Rules are evaluated column by column over the whole page rather than
+    record by record. A rule with `parameters` or `exclude_parameters`
+    only applies to rows whose `parameter_column` it covers. Rows failing a rule are returned grouped by the
+    name of the first rule they failed, to be quarantined under it.
+    """
+
+    def __init__(self, rules: Dict[str, List[Dict]] = None):
+        self.rules = QUALITY_RULES if rules is None else rules
+        for table_rules in self.rules.values():
+            for rule in table_rules:
+                if rule['check'] not in CHECKS:
+                    raise Exception(f"Unknown quality check '{rule['check']}' in rule '{rule['name']}'")
+                if ('parameters' in rule or 'exclude_parameters' in rule) and 'parameter_column' not in rule:
+                    raise Exception(f"Rule '{rule['name']}' limits parameters without a parameter_column")
+        # parameter name -> preferred unit, from the parameters table
+        self.preferred_units: Dict[str, str] = {}
+
+    def load_preferred_units(self, cursor) -> None:
+        cursor.execute("SELECT name, preferred_unit FROM parameters WHERE preferred_unit IS NOT NULL")
+        self.preferred_units = dict(cursor.fetchall())
+
+    def validate(self, schema_key: str, columns: Sequence[str],
+                 page: MappedPage) -> Tuple[MappedPage, Dict[str, List[Tuple[Dict, str]]]]:
+        """Split a page into the rows passing every rule and the failures by rule name"""
+        rules = self.rules.get(schema_key)
+        if not rules or not page.rows:
+            return page, {}
+
+        column_values = dict(zip(columns, zip(*page.rows)))
+        context = {'now': datetime.utcnow(), 'preferred_units': self.preferred_units, 'unit_factors': {}}
+
+        failures: Dict[int, Tuple[str, str]] = {}
+        for rule in rules:
+            failed = CHECKS[rule['check']](rule, column_values, context)
+            skipped = _out_of_scope(rule, column_values)
+            if skipped:
+                failed = [position for position in failed if position not in skipped]
+            metrics.increment('quality_checked', len(page.rows) - len(skipped), table=schema_key, rule=rule['name'])
+            if not failed:
+                continue
+            metrics.increment('quality_failed', len(failed), table=schema_key, rule=rule['name'])
+            values = column_values[rule['column']]
+            for position in failed:
+                failures.setdefault(position, (rule['name'], f"{rule['column']} = {values[position]!r}"))
+
+        rows, sources = page.rows, page.sources
+        rejected: Dict[str, List[Tuple[Dict, str]]] = {}
+        if failures:
+            for position, (name, error) in failures.items():
+                rejected.setdefault(name, []).append((sources[position], error))
+            rows = [row for position, row in enumerate(rows) if position not in failures]
+            sources = [source for position, source in enumerate(sources) if position not in failures]
+
+        for rule in rules:
+            if rule['check'] == 'preferred_unit':
+                rows = self._normalize_units(rule, columns, rows, context)
+
+        return MappedPage(rows, sources, page.rejected), rejected
+
+    def _normalize_units(self, rule: Dict, columns: Sequence[str], rows: List[tuple], context: Dict) -> List[tuple]:
+        """Convert values to their parameter's preferred unit with the factors found by the check"""
+        unit_index = columns.index(rule['column'])
+        value_index = columns.index(rule['value_column'])
+        parameter_index = columns.index(rule['parameter_column'])
+        factors = context['unit_factors']
+
+        normalized = []
+        converted = 0
+        for row in rows:
+            parameter, unit, value = row[parameter_index], row[unit_index], row[value_index]
+            preferred_unit = self.preferred_units.get(parameter)
+            if unit is None or preferred_unit is None or unit == preferred_unit:
+                normalized.append(row)
+                continue
+
+            row = list(row)
+            if value is not None:
+                row[value_index] = value * factors[(parameter, unit)]
+            row[unit_index] = preferred_unit
+            normalized.append(tuple(row))
+            converted += 1
+
+        if converted:
+            metrics.increment('quality_units_converted', converted)
+        return normalized
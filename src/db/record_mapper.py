@@ -0,0 +1,216 @@
+import math
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+_MISSING = object()
+
+# Spellings of the same unit reported by different providers
+UNIT_ALIASES = {
+    'ug/m3': 'µg/m³',
+    'µg/m3': 'µg/m³',
+    'μg/m³': 'µg/m³',
+    'μg/m3': 'µg/m³',
+    'mg/m3': 'mg/m³',
+    'ppm': 'ppm',
+    'ppb': 'ppb',
+    'c': '°C',
+    'deg c': '°C',
+    'particles/cm3': 'particles/cm³',
+}
+
+
+class MappedPage(NamedTuple):
+    rows: List[tuple]
+    sources: List[Dict]
+    rejected: List[Tuple[Dict, str]]
+
+
+def _compile_getter(path: str, default: Any) -> Callable[[Dict], Any]:
+    """Build a getter for a dotted path; missing or non-dict steps give `default`"""
+    keys = path.split('.')
+
+    if len(keys) == 1:
+        key = keys[0]
+        return lambda record: record.get(key, default)
+
+    def get(record: Dict) -> Any:
+        value = record
+        for key in keys:
+            if not isinstance(value, dict):
+                return default
+            value = value.get(key, default)
+        return value
+
+    return get
+
+
+def _to_number(value: Any) -> Optional[float]:
+    if value is None:
+        return None
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"not a finite number: {value!r}")
+    return number
+
+
+def _parse_timestamp(value: Any) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def _to_utc_timestamp(value: Any) -> Optional[datetime]:
+    """Naive UTC datetime, as stored in the db"""
+    if value is None:
+        return None
+    parsed = _parse_timestamp(value)
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _to_local_timestamp(value: Any) -> Optional[datetime]:
+    """Wall-clock time at the location, with its offset dropped"""
+    if value is None:
+        return None
+    return _parse_timestamp(value).replace(tzinfo=None)
+
+
+def _to_unit(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    unit = str(value).strip()
+    return UNIT_ALIASES.get(unit.lower(), unit)
+
+
+COERCERS: Dict[str, Callable[[Any], Any]] = {
+    'number': _to_number,
+    'utc_timestamp': _to_utc_timestamp,
+    'local_timestamp': _to_local_timestamp,
+    'unit': _to_unit,
+}
+
+
+def conflict_clause(schema: Dict[str, Any]) -> str:
+    """ON CONFLICT clause for a keyed schema; tables without update fields ignore duplicates
+
+    Rows whose update fields are unchanged are left alone, so re-sending
+    identical records does not create dead tuples.
+    """
+    if not schema['update_fields']:
+        return f"ON CONFLICT ({schema['key_field']}) DO NOTHING"
+
+    table, fields = schema['table_name'], schema['update_fields']
+    update_str = ', '.join(f"{field} = EXCLUDED.{field}" for field in fields)
+    current_str = ', '.join(f"{table}.{field}" for field in fields)
+    excluded_str = ', '.join(f"EXCLUDED.{field}" for field in fields)
+    return (f"ON CONFLICT ({schema['key_field']}) DO UPDATE SET {update_str} "
+            f"WHERE ({current_str}) IS DISTINCT FROM ({excluded_str})")
+
+
+class RecordMapper:
+    """Converts pages of API records into db rows for one TABLE_SCHEMAS entry
+
+    Field getters are compiled once from `source_fields`, a page is
+    converted column by column, and the SQL for each column set is built
+    once and reused for every batch.
+    """
+
+    def __init__(self, schema: Dict[str, Any]):
+        self.schema = schema
+        self.table_name = schema['table_name']
+        self.staging_table = f"staging_{self.table_name}"
+
+        source_fields = schema['source_fields']
+        required = set(schema['required_fields'])
+        defaults = schema['field_defaults']
+
+        self.columns = tuple(col for col in schema['columns'] if col in source_fields)
+        self._getters = [
+            _compile_getter(source_fields[col], _MISSING if col in required else defaults.get(col))
+            for col in self.columns
+        ]
+        self._required = [index for index, col in enumerate(self.columns) if col in required]
+        field_types = schema.get('field_types', {})
+        self._coercers = [(index, COERCERS[field_types[col]])
+                          for index, col in enumerate(self.columns) if col in field_types]
+        self._sql_cache: Dict[Tuple, str] = {}
+
+    def parse_rows(self, records: List[Dict]) -> Tuple[List[tuple], Dict[int, str]]:
+        """Map and validate a page; returns the accepted rows in order and errors by record position
+
+        Only plain tuples, datetimes and strings cross back, so this is
+        cheap to run in a worker process.
+        """
+        column_values = [list(map(getter, records)) for getter in self._getters]
+
+        errors: Dict[int, str] = {}
+        for index in self._required:
+            values = column_values[index]
+            if _MISSING in values:
+                for position, value in enumerate(values):
+                    if value is _MISSING:
+                        errors.setdefault(position, f"Missing required field in data: '{self.columns[index]}'")
+
+        for index, coerce in self._coercers:
+            values = column_values[index]
+            for position, value in enumerate(values):
+                if value is _MISSING:
+                    continue
+                try:
+                    values[position] = coerce(value)
+                except (TypeError, ValueError, AttributeError):
+                    errors.setdefault(position, f"Invalid value for '{self.columns[index]}': {value!r}")
+
+        rows = list(zip(*column_values))
+        if errors:
+            rows = [row for position, row in enumerate(rows) if position not in errors]
+        return rows, errors
+
+    @staticmethod
+    def assemble(records: List[Dict], rows: List[tuple], errors: Dict[int, str]) -> MappedPage:
+        """Pair the output of parse_rows with the records it came from"""
+        if not errors:
+            return MappedPage(rows, records, [])
+
+        return MappedPage(
+            rows,
+            [record for position, record in enumerate(records) if position not in errors],
+            [(records[position], error) for position, error in errors.items()]
+        )
+
+    def map_page(self, records: List[Dict]) -> MappedPage:
+        """Convert a page of records, rejecting those missing a required field or failing coercion"""
+        rows, errors = self.parse_rows(records)
+        return self.assemble(records, rows, errors)
+
+    def staging_sql(self, columns: Sequence[str]) -> str:
+        return self._cached('staging', columns, lambda columns_str: (
+            f"CREATE TEMP TABLE {self.staging_table} ON COMMIT DROP AS "
+            f"SELECT {columns_str} FROM {self.table_name} WITH NO DATA"
+        ))
+
+    def merge_sql(self, columns: Sequence[str], returning: str = '') -> str:
+        """Statement moving the staging table into the target with one upsert"""
+        return self._cached(('merge', returning), columns, lambda columns_str: f"""
+            INSERT INTO {self.table_name} ({columns_str})
+            SELECT DISTINCT ON ({self.schema['key_field']}) {columns_str}
+            FROM {self.staging_table}
+            {conflict_clause(self.schema)}
+            {returning}
+        """)
+
+    def row_upsert_sql(self, columns: Sequence[str], returning: str = '') -> str:
+        """Single-row upsert used when a batch has to be replayed row by row"""
+        return self._cached(('row', returning), columns, lambda columns_str: f"""
+            INSERT INTO {self.table_name} ({columns_str})
+            VALUES ({', '.join(['%s'] * len(columns))})
+            {conflict_clause(self.schema) if self.schema['key_field'] else ''}
+            {returning}
+        """)
+
+    def _cached(self, kind: Any, columns: Sequence[str], build: Callable[[str], str]) -> str:
+        cache_key = (kind, tuple(columns))
+        if cache_key not in self._sql_cache:
+            self._sql_cache[cache_key] = build(', '.join(columns))
+        return self._sql_cache[cache_key]
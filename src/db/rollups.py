@@ -0,0 +1,116 @@
+from typing import Dict, List
+
+# Each rollup aggregates the one before it; the hourly one reads the facts
+ROLLUPS: List[Dict[str, str]] = [
+    {'table': 'agg_air_quality_hourly', 'grain': 'hour', 'interval': '1 hour', 'source': None},
+    {'table': 'agg_air_quality_daily', 'grain': 'day', 'interval': '1 day', 'source': 'agg_air_quality_hourly'},
+    {'table': 'agg_air_quality_monthly', 'grain': 'month', 'interval': '1 month', 'source': 'agg_air_quality_daily'},
+]
+
+
+def rollup_table_sql(rollup: Dict[str, str]) -> str:
+    return f"""
+        CREATE TABLE IF NOT EXISTS {rollup['table']} (
+            location_key INTEGER,
+            parameter_key INTEGER,
+            bucket_start TIMESTAMP,
+            measurement_count INTEGER NOT NULL,
+            value_sum NUMERIC(22,6),
+            value_min NUMERIC(14,6),
+            value_max NUMERIC(14,6),
+            value_avg NUMERIC(14,6) GENERATED ALWAYS AS (value_sum / NULLIF(measurement_count, 0)) STORED,
+            PRIMARY KEY (location_key, parameter_key, bucket_start)
+        );
+    """
+
+
+def rollup_migration_sql(rollup: Dict[str, str]) -> str:
+    """Widen the value columns of a rollup created with two decimals
+
+    value_avg is generated from value_sum, so it is dropped and added back
+    around the type change.
+    """
+    table = rollup['table']
+    return f"""
+        DO $$
+        BEGIN
+            IF (SELECT numeric_scale FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = '{table}'
+                    AND column_name = 'value_min') < 6 THEN
+                ALTER TABLE {table} DROP COLUMN value_avg;
+                ALTER TABLE {table}
+                    ALTER COLUMN value_sum TYPE NUMERIC(22,6),
+                    ALTER COLUMN value_min TYPE NUMERIC(14,6),
+                    ALTER COLUMN value_max TYPE NUMERIC(14,6),
+                    ADD COLUMN value_avg NUMERIC(14,6)
+                        GENERATED ALWAYS AS (value_sum / NULLIF(measurement_count, 0)) STORED;
+            END IF;
+        END $$;
+    """
+
+
+def rollup_refresh_sql(rollup: Dict[str, str]) -> str:
+    """Recompute the buckets holding facts with measurement_key in (last_key, max_key]
+
+    Whole buckets are recomputed, so reloading a fact never double counts.
+    """
+    grain, interval = rollup['grain'], rollup['interval']
+
+    if rollup['source'] is None:
+        source_join = f"""
+            JOIN fact_air_quality s
+                ON s.location_key = b.location_key
+                AND s.parameter_key = b.parameter_key
+                AND s.measured_at >= b.bucket_start
+                AND s.measured_at < b.bucket_start + INTERVAL '{interval}'
+        """
+        aggregates = """
+            COUNT(s.measurement_value),
+            SUM(s.measurement_value),
+            MIN(s.measurement_value),
+            MAX(s.measurement_value)
+        """
+    else:
+        source_join = f"""
+            JOIN {rollup['source']} s
+                ON s.location_key = b.location_key
+                AND s.parameter_key = b.parameter_key
+                AND s.bucket_start >= b.bucket_start
+                AND s.bucket_start < b.bucket_start + INTERVAL '{interval}'
+        """
+        aggregates = """
+            SUM(s.measurement_count),
+            SUM(s.value_sum),
+            MIN(s.value_min),
+            MAX(s.value_max)
+        """
+
+    return f"""
+        WITH touched_buckets AS (
+            SELECT DISTINCT location_key, parameter_key, DATE_TRUNC('{grain}', measured_at) AS bucket_start
+            FROM fact_air_quality
+            WHERE measurement_key > %(last_key)s AND measurement_key <= %(max_key)s
+        )
+        INSERT INTO {rollup['table']} (
+            location_key,
+            parameter_key,
+            bucket_start,
+            measurement_count,
+            value_sum,
+            value_min,
+            value_max
+        )
+        SELECT
+            b.location_key,
+            b.parameter_key,
+            b.bucket_start,
+            {aggregates}
+        FROM touched_buckets b
+        {source_join}
+        GROUP BY b.location_key, b.parameter_key, b.bucket_start
+        ON CONFLICT (location_key, parameter_key, bucket_start) DO UPDATE SET
+            measurement_count = EXCLUDED.measurement_count,
+            value_sum = EXCLUDED.value_sum,
+            value_min = EXCLUDED.value_min,
+            value_max = EXCLUDED.value_max;
+    """
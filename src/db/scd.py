@@ -0,0 +1,154 @@
+from typing import Dict, List, Tuple
+
+# Type 2 dimensions: dimension column -> raw column, versioned on any change
+SCD_DIMENSIONS: Dict[str, Dict] = {
+    'dim_locations': {
+        'surrogate_key': 'location_key',
+        'natural_key': 'original_location_id',
+        'source': 'locations',
+        'source_key': 'location_id',
+        # Placeholders for locations not fetched yet are corrected in place, not versioned
+        'inferred_flag': 'is_inferred',
+        'columns': {
+            'location_name': 'name',
+            'city': 'city',
+            'country': 'country',
+            'latitude': 'latitude',
+            'longitude': 'longitude',
+            'is_mobile': 'is_mobile'
+        }
+    },
+    'dim_parameters': {
+        'surrogate_key': 'parameter_key',
+        'natural_key': 'original_parameter_id',
+        'source': 'parameters',
+        'source_key': 'parameter_id',
+        'columns': {
+            'parameter_name': 'name',
+            'description': 'description',
+            'preferred_unit': 'preferred_unit'
+        }
+    }
+}
+
+
+def row_hash_sql(alias: str, columns: List[str]) -> str:
+    """Hash of a row's tracked values; dimension and raw columns hash alike because ROW text carries no types"""
+    return f"md5(ROW({', '.join(f'{alias}.{col}' for col in columns)})::text)"
+
+
+def scd_migration_sql(dimension: str) -> List[str]:
+    """Add version columns to a dimension created before it was type 2, keeping its rows as first versions"""
+    dim = SCD_DIMENSIONS[dimension]
+    return [
+        f"""
+        ALTER TABLE {dimension}
+            ADD COLUMN IF NOT EXISTS row_hash TEXT,
+            ADD COLUMN IF NOT EXISTS valid_from TIMESTAMP NOT NULL DEFAULT '-infinity',
+            ADD COLUMN IF NOT EXISTS valid_to TIMESTAMP NOT NULL DEFAULT 'infinity',
+            ADD COLUMN IF NOT EXISTS is_current BOOLEAN NOT NULL DEFAULT TRUE;
+        """,
+        f"ALTER TABLE {dimension} DROP CONSTRAINT IF EXISTS {dimension}_{dim['natural_key']}_key;",
+        f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS {dimension}_current_key
+            ON {dimension} ({dim['natural_key']}) WHERE is_current;
+        """,
+        f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS {dimension}_version_key
+            ON {dimension} ({dim['natural_key']}, valid_from);
+        """,
+        f"""
+        UPDATE {dimension} d
+        SET row_hash = {row_hash_sql('d', list(dim['columns']))}
+        WHERE row_hash IS NULL;
+        """
+    ] + ([
+        f"ALTER TABLE {dimension} ADD COLUMN IF NOT EXISTS {dim['inferred_flag']} BOOLEAN NOT NULL DEFAULT FALSE;"
+    ] if 'inferred_flag' in dim else [])
+
+
+def _version_columns(dim: Dict) -> str:
+    flag = [dim['inferred_flag']] if 'inferred_flag' in dim else []
+    return ', '.join([dim['natural_key'], *dim['columns'], *flag, 'row_hash', 'valid_from', 'valid_to', 'is_current'])
+
+
+def _source_values(dim: Dict) -> str:
+    """Raw values in _version_columns order, up to the row hash"""
+    values = [f's.{col}' for col in dim['columns'].values()]
+    if 'inferred_flag' in dim:
+        values.append(f"COALESCE(s.{dim['inferred_flag']}, FALSE)")
+    return ', '.join(values)
+
+
+def scd_refresh_sql(dimension: str) -> List[Tuple[str, str]]:
+    """Named statements bringing a dimension up to date with its raw table, to run in order
+
+    Current versions of inferred members are overwritten in place (type 1)
+    so earlier facts see the real member. Other current versions whose
+    hash changed are closed, then every raw member without a current
+    version gets one. All three compare whole sets. New members start at
+    -infinity so every earlier fact finds them; changed members get a
+    version starting at %(changed_at)s.
+    """
+    dim = SCD_DIMENSIONS[dimension]
+    source_hash = row_hash_sql('s', list(dim['columns'].values()))
+    statements = []
+
+    flag = dim.get('inferred_flag')
+    if flag:
+        assignments = ', '.join(f"{col} = s.{source_col}" for col, source_col in dim['columns'].items())
+        statements.append((f"{dimension}_inferred", f"""
+            UPDATE {dimension} d
+            SET {assignments}, {flag} = COALESCE(s.{flag}, FALSE), row_hash = {source_hash}
+            FROM {dim['source']} s
+            WHERE d.{dim['natural_key']} = s.{dim['source_key']}
+                AND d.is_current
+                AND d.{flag}
+                AND (d.row_hash IS DISTINCT FROM {source_hash} OR NOT COALESCE(s.{flag}, FALSE))
+        """))
+
+    statements.append((f"{dimension}_close", f"""
+        UPDATE {dimension} d
+        SET valid_to = %(changed_at)s, is_current = FALSE
+        FROM {dim['source']} s
+        WHERE d.{dim['natural_key']} = s.{dim['source_key']}
+            AND d.is_current
+            {f'AND NOT d.{flag}' if flag else ''}
+            AND d.row_hash IS DISTINCT FROM {source_hash}
+    """))
+
+    statements.append((dimension, f"""
+        INSERT INTO {dimension} ({_version_columns(dim)})
+        SELECT
+            s.{dim['source_key']},
+            {_source_values(dim)},
+            {source_hash},
+            CASE WHEN EXISTS (SELECT 1 FROM {dimension} d WHERE d.{dim['natural_key']} = s.{dim['source_key']})
+                THEN %(changed_at)s ELSE '-infinity'::TIMESTAMP END,
+            'infinity'::TIMESTAMP,
+            TRUE
+        FROM {dim['source']} s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {dimension} d
+            WHERE d.{dim['natural_key']} = s.{dim['source_key']} AND d.is_current
+        )
+    """))
+    return statements
+
+
+def scd_insert_missing_sql(dimension: str, source_filter: str) -> str:
+    """First versions for raw members matching `source_filter` that are not in the dimension yet"""
+    dim = SCD_DIMENSIONS[dimension]
+    return f"""
+        INSERT INTO {dimension} ({_version_columns(dim)})
+        SELECT
+            s.{dim['source_key']},
+            {_source_values(dim)},
+            {row_hash_sql('s', list(dim['columns'].values()))},
+            '-infinity'::TIMESTAMP,
+            'infinity'::TIMESTAMP,
+            TRUE
+        FROM {dim['source']} s
+        WHERE {source_filter}
+        ON CONFLICT ({dim['natural_key']}) WHERE is_current DO NOTHING
+    """
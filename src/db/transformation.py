@@ -1,36 +1,129 @@
+import psycopg2
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List
+from psycopg2.extras import execute_values
 from .connectionDB import ConnectionDB
+from .dag import Step, StepResult, run_dag
+from .dimension_cache import DimensionKeyCache
+from .parquet_export import ParquetExporter
+from .partitions import PartitionManager
+from .pool import ConnectionPool
+from .indexes import IndexManager
+from .rollups import ROLLUPS, rollup_migration_sql, rollup_refresh_sql, rollup_table_sql
+from .scd import SCD_DIMENSIONS, scd_migration_sql, scd_refresh_sql
+from src.metrics import metrics
+
+# Measurements `m` with no location, parameter or hour row to attach a fact to yet
+UNRESOLVED_MEASUREMENT_SQL = """
+    NOT EXISTS (
+        SELECT 1 FROM dim_locations l
+        WHERE l.original_location_id = m.location_id
+            AND m.timestamp_utc >= l.valid_from AND m.timestamp_utc < l.valid_to
+    )
+    OR NOT EXISTS (
+        SELECT 1 FROM dim_parameters p
+        WHERE p.parameter_name = m.parameter
+            AND m.timestamp_utc >= p.valid_from AND m.timestamp_utc < p.valid_to
+    )
+    OR NOT EXISTS (SELECT 1 FROM dim_time t WHERE t.hour_start = DATE_TRUNC('hour', m.timestamp_utc))
+"""
 
 
 class DataWarehouseTransformer(ConnectionDB):
+    def __init__(self, db_params, calendar_start: str = '2015-01-01', calendar_days_ahead: int = 365,
+                 key_cache_size: int = 100000, pool: ConnectionPool = None, explain: bool = False,
+                 max_workers: int = 3, export_dir: str = None, export_chunk_size: int = 50000):
+        super().__init__(db_params, pool)
+        self.explain = explain
+        self.max_workers = max_workers
+        self.query_plans: Dict[str, Any] = {}
+        self.step_results: Dict[str, StepResult] = {}
+        self._schema_ready = False
+        self.calendar_start = calendar_start
+        self.calendar_days_ahead = calendar_days_ahead
+        self.key_cache = DimensionKeyCache(max_size=key_cache_size)
+        self._key_cache_loaded = False
+        self.partitions = PartitionManager('fact_air_quality')
+        self.indexes = IndexManager(('dim_parameters', 'fact_air_quality'))
+        self.exporter = ParquetExporter(export_dir, chunk_size=export_chunk_size) if export_dir else None
+
+    def _execute_step(self, cursor, step: str, query: str, params: Dict = None) -> int:
+        """Execute one transformation statement, timing it and returning the rows it wrote
+
+        With `explain` set the statement runs under EXPLAIN (ANALYZE, BUFFERS),
+        which executes it once and keeps the plan in `query_plans`.
+        """
+        with metrics.timer('transform_statement', step=step):
+            if self.explain:
+                cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}", params)
+                plan = cursor.fetchone()[0]
+                self.query_plans[step] = plan
+                root = plan[0]['Plan']
+                children = root.get('Plans') or [root]
+                rows = root.get('Tuples Inserted', children[0].get('Actual Rows', 0))
+            else:
+                cursor.execute(query, params)
+                rows = max(cursor.rowcount, 0)
+
+        metrics.increment('transform_rows', rows, step=step)
+        return rows
+
     def _create_dimension_tables(self):
         """Create dimension tables for the data warehouse"""
         dimension_queries = [
             """
             CREATE TABLE IF NOT EXISTS dim_locations (
                 location_key SERIAL PRIMARY KEY,
-                original_location_id INTEGER UNIQUE,
+                original_location_id INTEGER,
                 location_name VARCHAR(100),
                 city VARCHAR(255),
                 country VARCHAR(50),
                 latitude DECIMAL(9,6),
                 longitude DECIMAL(9,6),
                 is_mobile BOOLEAN,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                is_inferred BOOLEAN NOT NULL DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                row_hash TEXT,
+                valid_from TIMESTAMP NOT NULL DEFAULT '-infinity',
+                valid_to TIMESTAMP NOT NULL DEFAULT 'infinity',
+                is_current BOOLEAN NOT NULL DEFAULT TRUE
             );
             """,
             """
             CREATE TABLE IF NOT EXISTS dim_parameters (
                 parameter_key SERIAL PRIMARY KEY,
-                original_parameter_id INTEGER UNIQUE,
+                original_parameter_id INTEGER,
                 parameter_name VARCHAR(50),
                 description TEXT,
                 preferred_unit VARCHAR(20),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                row_hash TEXT,
+                valid_from TIMESTAMP NOT NULL DEFAULT '-infinity',
+                valid_to TIMESTAMP NOT NULL DEFAULT 'infinity',
+                is_current BOOLEAN NOT NULL DEFAULT TRUE
             );
             """,
             """
+            DO $$
+            BEGIN
+                -- dim_time used to have serial keys; facts referencing them are rebuilt from raw data
+                IF to_regclass('dim_time') IS NOT NULL AND NOT EXISTS (
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_name = 'dim_time' AND column_name = 'hour_start'
+                ) THEN
+                    DROP TABLE IF EXISTS fact_air_quality;
+                    DROP TABLE dim_time;
+                    IF to_regclass('etl_transform_state') IS NOT NULL THEN
+                        DELETE FROM etl_transform_state WHERE step_name = 'fact_air_quality';
+                    END IF;
+                END IF;
+            END $$;
+            """,
+            """
             CREATE TABLE IF NOT EXISTS dim_time (
-                time_key SERIAL PRIMARY KEY,
+                time_key INTEGER PRIMARY KEY,
+                hour_start TIMESTAMP NOT NULL UNIQUE,
                 date DATE,
                 year INTEGER,
                 month INTEGER,
@@ -41,102 +134,141 @@ class DataWarehouseTransformer(ConnectionDB):
             """
         ]
 
+        for dimension in SCD_DIMENSIONS:
+            dimension_queries.extend(scd_migration_sql(dimension))
+
         for query in dimension_queries:
             self.execute_query(query)
 
-    def _populate_dimension_tables(self):
-        """Populate dimension tables from raw data"""
-        dimension_population_queries = [
+    def _populate_dimension(self, cursor, dimension: str) -> int:
+        """Version changed raw locations or parameters and add new ones
+
+        Change detection compares row hashes in one set-wise statement, so an
+        unchanged hour only costs one join of the raw table with the current
+        versions.
+        """
+        params = {'changed_at': datetime.utcnow()}
+        return sum(self._execute_step(cursor, step, query, params) for step, query in scd_refresh_sql(dimension))
+
+    def _populate_time_dimension(self, cursor) -> int:
+        """Pre-generate one dim_time row per hour of the configured calendar
+
+        time_key is the hour encoded as yyyymmddhh. Only hours outside the
+        range already stored are inserted, so the hourly call is cheap.
+        """
+        time_population_query = """
+        INSERT INTO dim_time (
+            time_key,
+            hour_start,
+            date,
+            year,
+            month,
+            day,
+            hour,
+            is_weekend
+        )
+        SELECT
+            TO_CHAR(h, 'YYYYMMDDHH24')::INTEGER as time_key,
+            h as hour_start,
+            DATE(h) as date,
+            EXTRACT(YEAR FROM h) as year,
+            EXTRACT(MONTH FROM h) as month,
+            EXTRACT(DAY FROM h) as day,
+            EXTRACT(HOUR FROM h) as hour,
+            EXTRACT(ISODOW FROM h) IN (6, 7) as is_weekend
+        FROM generate_series(
+            %(calendar_start)s::TIMESTAMP,
+            CURRENT_DATE + %(days_ahead)s * INTERVAL '1 day',
+            INTERVAL '1 hour'
+        ) AS h
+        WHERE h < (SELECT COALESCE(MIN(hour_start), 'infinity') FROM dim_time)
+            OR h > (SELECT COALESCE(MAX(hour_start), '-infinity') FROM dim_time)
+        ON CONFLICT (time_key) DO NOTHING;
+        """
+
+        return self._execute_step(cursor, 'dim_time', time_population_query, {
+            'calendar_start': self.calendar_start,
+            'days_ahead': self.calendar_days_ahead
+        })
+
+    def _create_fact_table(self):
+        """Create fact table for air quality measurements"""
+        fact_table_queries = [
             """
-            INSERT INTO dim_locations (
-                original_location_id,
-                location_name,
-                city,
-                country,
-                latitude,
-                longitude,
-                is_mobile
-            )
-            SELECT DISTINCT
-                location_id,
-                name,
-                city,
-                country,
-                latitude,
-                longitude,
-                is_mobile
-            FROM locations
-            WHERE NOT EXISTS (
-                SELECT 1 FROM dim_locations dl
-                WHERE dl.original_location_id = locations.location_id
+            CREATE TABLE IF NOT EXISTS etl_transform_state (
+                step_name VARCHAR(50) PRIMARY KEY,
+                last_measurement_id BIGINT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             );
             """,
             """
-            INSERT INTO dim_parameters (
-                original_parameter_id,
-                parameter_name,
-                description,
-                preferred_unit
-            )
-            SELECT DISTINCT
-                parameter_id,
-                name,
-                description,
-                preferred_unit
-            FROM parameters
-            WHERE NOT EXISTS (
-                SELECT 1 FROM dim_parameters dp
-                WHERE dp.original_parameter_id = parameters.parameter_id
+            -- Measurements skipped by the fact load until their dimension rows arrive
+            CREATE TABLE IF NOT EXISTS etl_unresolved_measurements (
+                measurement_id BIGINT,
+                timestamp_utc TIMESTAMP,
+                parked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (measurement_id, timestamp_utc)
             );
             """,
             """
-            INSERT INTO dim_time (
-                date,
-                year,
-                month,
-                day,
-                hour,
-                is_weekend
-            )
-            SELECT DISTINCT
-                DATE(timestamp_utc) as date,
-                EXTRACT(YEAR FROM timestamp_utc) as year,
-                EXTRACT(MONTH FROM timestamp_utc) as month,
-                EXTRACT(DAY FROM timestamp_utc) as day,
-                EXTRACT(HOUR FROM timestamp_utc) as hour,
-                EXTRACT(ISODOW FROM timestamp_utc) IN (6, 7) as is_weekend
-            FROM measurements
-            WHERE NOT EXISTS (
-                SELECT 1 FROM dim_time dt
-                WHERE dt.date = DATE(measurements.timestamp_utc)
-            );
+            -- Rollup progress is tracked by fact measurement_key, a BIGSERIAL
+            ALTER TABLE etl_transform_state ALTER COLUMN last_measurement_id TYPE BIGINT;
+            """,
+            """
+            DO $$
+            BEGIN
+                -- An unpartitioned fact table is rebuilt from raw data rather than migrated
+                IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('fact_air_quality')) = 'r' THEN
+                    DROP TABLE fact_air_quality;
+                    DELETE FROM etl_transform_state WHERE step_name = 'fact_air_quality';
+                END IF;
+            END $$;
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS fact_air_quality (
+                measurement_key BIGSERIAL,
+                location_key INTEGER,
+                parameter_key INTEGER,
+                time_key INTEGER,
+                measured_at TIMESTAMP,
+                measurement_value NUMERIC(14,6),
+                unit VARCHAR(20),
+                PRIMARY KEY (measurement_key, measured_at),
+                CONSTRAINT fact_air_quality_natural_key UNIQUE (location_key, parameter_key, measured_at),
+                FOREIGN KEY (location_key) REFERENCES dim_locations(location_key),
+                FOREIGN KEY (parameter_key) REFERENCES dim_parameters(parameter_key),
+                FOREIGN KEY (time_key) REFERENCES dim_time(time_key)
+            ) PARTITION BY RANGE (measured_at);
+            """,
+            """
+            DO $$
+            BEGIN
+                -- Values converted to a preferred unit can be far below 0.01
+                IF (SELECT numeric_scale FROM information_schema.columns
+                    WHERE table_schema = current_schema() AND table_name = 'fact_air_quality'
+                        AND column_name = 'measurement_value') < 6 THEN
+                    ALTER TABLE fact_air_quality ALTER COLUMN measurement_value TYPE NUMERIC(14,6);
+                END IF;
+            END $$;
             """
         ]
 
-        for query in dimension_population_queries:
+        for query in fact_table_queries:
             self.execute_query(query)
 
-    def _create_fact_table(self):
-        """Create fact table for air quality measurements"""
-        fact_table_query = """
-        CREATE TABLE IF NOT EXISTS fact_air_quality (
-            measurement_key BIGSERIAL PRIMARY KEY,
-            location_key INTEGER,
-            parameter_key INTEGER,
-            time_key INTEGER,
-            measurement_value DECIMAL(10,2),
-            unit VARCHAR(20),
-            FOREIGN KEY (location_key) REFERENCES dim_locations(location_key),
-            FOREIGN KEY (parameter_key) REFERENCES dim_parameters(parameter_key),
-            FOREIGN KEY (time_key) REFERENCES dim_time(time_key)
-        );
-        """
+        with self.transaction() as cursor:
+            self.indexes.ensure(cursor)
 
-        self.execute_query(fact_table_query)
+    @staticmethod
+    def _reset_fact_table(cursor):
+        """Drop all facts and the load watermark so the next load rebuilds from scratch"""
+        cursor.execute("TRUNCATE fact_air_quality, etl_unresolved_measurements")
+        cursor.execute("DELETE FROM etl_transform_state WHERE step_name = 'fact_air_quality'")
 
-    def _populate_fact_table(self):
-        """Populate fact table with measurements_with_keys"""
-        fact_population_query = """
+    @staticmethod
+    def _fact_population_sql(source_filter: str) -> str:
+        """Insert facts for the measurements matching `source_filter` that resolve to dimension rows"""
+        return f"""
         WITH measurements_with_keys AS (
             SELECT 
                 m.value as measurement_value,
@@ -147,37 +279,354 @@ class DataWarehouseTransformer(ConnectionDB):
                 t.time_key
             FROM measurements m
             JOIN dim_locations l ON m.location_id = l.original_location_id
+                AND m.timestamp_utc >= l.valid_from AND m.timestamp_utc < l.valid_to
             JOIN dim_parameters p ON m.parameter = p.parameter_name
-            JOIN dim_time t ON DATE(m.timestamp_utc) = t.date
-                AND EXTRACT(HOUR FROM m.timestamp_utc) = t.hour
+                AND m.timestamp_utc >= p.valid_from AND m.timestamp_utc < p.valid_to
+            JOIN dim_time t ON t.hour_start = DATE_TRUNC('hour', m.timestamp_utc)
+            WHERE {source_filter}
         )
         INSERT INTO fact_air_quality (
             location_key,
             parameter_key,
             time_key,
+            measured_at,
             measurement_value,
             unit
         )
-        SELECT DISTINCT
+        SELECT
             location_key,
             parameter_key,
             time_key,
+            timestamp_utc,
             measurement_value,
             unit
-        FROM measurements_with_keys;
+        FROM measurements_with_keys
+        ON CONFLICT (location_key, parameter_key, measured_at) DO NOTHING;
         """
 
-        self.execute_query(fact_population_query)
+    def _retry_unresolved_facts(self, cursor) -> int:
+        """Load facts for parked measurements whose dimension rows have arrived since
 
-    def run_transformation(self):
-        """Execute full data warehouse transformation"""
-        try:
-            self.connect()
+        Entries that now resolve, or whose measurement is gone, leave
+        etl_unresolved_measurements.
+        """
+        cursor.execute("""
+            SELECT ARRAY_AGG(DISTINCT DATE_TRUNC('month', timestamp_utc))
+            FROM etl_unresolved_measurements
+        """)
+        months = cursor.fetchone()[0]
+        if not months:
+            return 0
+
+        self.partitions.ensure(cursor, months)
+        facts = self._execute_step(cursor, 'fact_air_quality_retry', self._fact_population_sql("""
+            (m.measurement_id, m.timestamp_utc) IN (
+                SELECT measurement_id, timestamp_utc FROM etl_unresolved_measurements
+            )
+        """))
+        cursor.execute(f"""
+            DELETE FROM etl_unresolved_measurements u
+            WHERE NOT EXISTS (
+                SELECT 1 FROM measurements m
+                WHERE m.measurement_id = u.measurement_id
+                    AND m.timestamp_utc = u.timestamp_utc
+                    AND ({UNRESOLVED_MEASUREMENT_SQL})
+            )
+        """)
+        if facts:
+            print(f"Loaded {facts} facts for measurements whose dimension rows arrived late")
+        return facts
+
+    def _populate_fact_table(self, cursor, full_rebuild: bool = False) -> int:
+        """Populate fact table with measurements loaded since the last transformation
+
+        Measurements whose location, parameter or hour is not in the
+        dimensions yet are parked in etl_unresolved_measurements and retried
+        on every run, so the watermark can move past them without losing them.
+        """
+        if full_rebuild:
+            self._reset_fact_table(cursor)
+
+        facts = self._retry_unresolved_facts(cursor)
+
+        cursor.execute("""
+            SELECT last_measurement_id FROM etl_transform_state
+            WHERE step_name = 'fact_air_quality'
+            FOR UPDATE
+        """)
+        row = cursor.fetchone()
+        last_measurement_id = row[0] if row else 0
+
+        cursor.execute("SELECT COALESCE(MAX(measurement_id), 0) FROM measurements")
+        max_measurement_id = cursor.fetchone()[0]
+
+        if max_measurement_id <= last_measurement_id:
+            return facts
+
+        # The time bounds let the planner prune measurements partitions outside the new rows
+        cursor.execute("""
+            SELECT
+                MIN(timestamp_utc),
+                MAX(timestamp_utc),
+                ARRAY_AGG(DISTINCT DATE_TRUNC('month', timestamp_utc))
+            FROM measurements
+            WHERE measurement_id > %s AND measurement_id <= %s
+        """, (last_measurement_id, max_measurement_id))
+        min_timestamp, max_timestamp, months = cursor.fetchone()
+
+        if months:
+            new_range = """
+                m.measurement_id > %(last_measurement_id)s
+                AND m.measurement_id <= %(max_measurement_id)s
+                AND m.timestamp_utc BETWEEN %(min_timestamp)s AND %(max_timestamp)s
+            """
+            params = {
+                'last_measurement_id': last_measurement_id,
+                'max_measurement_id': max_measurement_id,
+                'min_timestamp': min_timestamp,
+                'max_timestamp': max_timestamp
+            }
+            self.partitions.ensure(cursor, months)
+            loaded = self._execute_step(cursor, 'fact_air_quality', self._fact_population_sql(new_range), params)
+            facts += loaded
+            print(f"Loaded {loaded} new facts from measurements "
+                  f"{last_measurement_id + 1}..{max_measurement_id}")
+
+            cursor.execute(f"""
+                INSERT INTO etl_unresolved_measurements (measurement_id, timestamp_utc)
+                SELECT m.measurement_id, m.timestamp_utc
+                FROM measurements m
+                WHERE {new_range} AND ({UNRESOLVED_MEASUREMENT_SQL})
+                ON CONFLICT DO NOTHING
+            """, params)
+            if cursor.rowcount:
+                metrics.increment('facts_unresolved', cursor.rowcount)
+                print(f"Parked {cursor.rowcount} measurements without dimension rows for a later run")
+
+        self._advance_fact_watermark(cursor, max_measurement_id)
+        return facts
+
+    @staticmethod
+    def _advance_fact_watermark(cursor, measurement_id: int) -> None:
+        """Move the fact watermark forward; inline loads of other shards may already have moved it further"""
+        cursor.execute("""
+            INSERT INTO etl_transform_state (step_name, last_measurement_id)
+            VALUES ('fact_air_quality', %s)
+            ON CONFLICT (step_name) DO UPDATE SET
+                last_measurement_id = GREATEST(etl_transform_state.last_measurement_id,
+                                               EXCLUDED.last_measurement_id),
+                updated_at = CURRENT_TIMESTAMP
+        """, (measurement_id,))
+
+    def catch_up_facts(self) -> int:
+        """Load facts for measurements past the fact watermark, before inline loading moves it on
+
+        Measurements stored while facts were not loaded inline would
+        otherwise be skipped by the first inline batch.
+        """
+        with self.connection(), self.transaction() as cursor:
+            return self._populate_fact_table(cursor)
+
+    def _create_rollup_tables(self):
+        """Create the hourly, daily and monthly aggregate tables"""
+        for rollup in ROLLUPS:
+            self.execute_query(rollup_table_sql(rollup))
+            self.execute_query(rollup_migration_sql(rollup))
+
+    def _refresh_rollups(self, cursor, full_rebuild: bool = False) -> int:
+        """Recompute the rollup buckets touched by facts added since the last refresh"""
+        refreshed = {}
+        if full_rebuild:
+            cursor.execute(f"TRUNCATE {', '.join(rollup['table'] for rollup in ROLLUPS)}")
+            cursor.execute("DELETE FROM etl_transform_state WHERE step_name = 'rollups'")
+
+        cursor.execute("""
+            SELECT last_measurement_id FROM etl_transform_state
+            WHERE step_name = 'rollups'
+            FOR UPDATE
+        """)
+        row = cursor.fetchone()
+        last_key = row[0] if row else 0
+
+        cursor.execute("SELECT COALESCE(MAX(measurement_key), 0) FROM fact_air_quality")
+        max_key = cursor.fetchone()[0]
+
+        if max_key <= last_key:
+            return 0
+
+        # Coarser rollups read the finer ones, so they run in ROLLUPS order
+        for rollup in ROLLUPS:
+            refreshed[rollup['table']] = self._execute_step(
+                cursor, rollup['table'], rollup_refresh_sql(rollup),
+                {'last_key': last_key, 'max_key': max_key}
+            )
+
+        cursor.execute("""
+            INSERT INTO etl_transform_state (step_name, last_measurement_id)
+            VALUES ('rollups', %s)
+            ON CONFLICT (step_name) DO UPDATE SET
+                last_measurement_id = EXCLUDED.last_measurement_id,
+                updated_at = CURRENT_TIMESTAMP
+        """, (max_key,))
+
+        print(f"Refreshed rollup buckets: {refreshed}")
+        return sum(refreshed.values())
+
+    def refresh_rollups(self, full_rebuild: bool = False) -> int:
+        """Bring the rollup tables up to date with fact_air_quality
+
+        Returns the number of buckets rewritten.
+        """
+        with self.connection():
+            self._create_rollup_tables()
+            with self.transaction() as cursor:
+                return self._refresh_rollups(cursor, full_rebuild)
+
+    def initialize_schema(self):
+        """Create the warehouse tables and calendar; the DDL runs once per process"""
+        if self._schema_ready:
+            return
+
+        with self.connection():
             self._create_dimension_tables()
-            self._populate_dimension_tables()
+            with self.transaction() as cursor:
+                self._populate_time_dimension(cursor)
             self._create_fact_table()
-            self._populate_fact_table()
-        except Exception as e:
-            print(f"Transformation error: {str(e)}")
+            self._create_rollup_tables()
+        self._schema_ready = True
+
+    @contextmanager
+    def _step_cursor(self) -> Iterator[Any]:
+        """Cursor on a connection of its own, committed when a transformation step succeeds"""
+        if self.pool:
+            with self.pool.connection() as conn:
+                try:
+                    with conn.cursor() as cursor:
+                        yield cursor
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+            return
+
+        conn = psycopg2.connect(**self.db_params)
+        try:
+            with conn:
+                with conn.cursor() as cursor:
+                    yield cursor
         finally:
-            self.close()
\ No newline at end of file
+            conn.close()
+
+    def refresh_key_cache(self, cursor) -> None:
+        """Reload the dimension key cache from the dimension tables"""
+        self.key_cache.refresh(cursor)
+        self._key_cache_loaded = True
+
+    def invalidate_key_cache(self) -> None:
+        """Reload the key cache on its next use, e.g. at the start of a run"""
+        self._key_cache_loaded = False
+
+    def load_facts(self, cursor, measurements: List[tuple]) -> int:
+        """Write facts for freshly loaded measurements inside the caller's transaction
+
+        `measurements` holds (measurement_id, location_id, parameter,
+        timestamp_utc, value, unit) rows. Surrogate keys of the current
+        dimension versions come from the key cache. Rows that cannot be
+        resolved, or predate the current version, are parked in
+        etl_unresolved_measurements and the fact watermark moves past the
+        batch, so _populate_fact_table only has the parked rows left to join.
+        """
+        if not measurements:
+            return 0
+
+        if not self._key_cache_loaded:
+            self.refresh_key_cache(cursor)
+
+        try:
+            location_keys = self.key_cache.resolve(cursor, 'dim_locations', (row[1] for row in measurements))
+            parameter_keys = self.key_cache.resolve(cursor, 'dim_parameters', (row[2] for row in measurements))
+        except Exception:
+            # Members added in this transaction are rolled back with it
+            self._key_cache_loaded = False
+            raise
+
+        facts = []
+        unresolved = []
+        for measurement_id, location_id, parameter, timestamp_utc, value, unit in measurements:
+            location = location_keys.get(location_id)
+            parameter_version = parameter_keys.get(parameter)
+            time_key = self.key_cache.time_key(timestamp_utc)
+            # Facts older than a current version belong to an earlier one, found by _populate_fact_table
+            if (location is None or parameter_version is None or time_key is None
+                    or timestamp_utc < location[1] or timestamp_utc < parameter_version[1]):
+                unresolved.append((measurement_id, timestamp_utc))
+                continue
+            facts.append((location[0], parameter_version[0], time_key, timestamp_utc, value, unit))
+
+        self.partitions.ensure(cursor, {fact[3] for fact in facts})
+        execute_values(cursor, """
+            INSERT INTO fact_air_quality (
+                location_key,
+                parameter_key,
+                time_key,
+                measured_at,
+                measurement_value,
+                unit
+            )
+            VALUES %s
+            ON CONFLICT (location_key, parameter_key, measured_at) DO NOTHING
+        """, facts)
+
+        if unresolved:
+            execute_values(cursor, """
+                INSERT INTO etl_unresolved_measurements (measurement_id, timestamp_utc)
+                VALUES %s
+                ON CONFLICT DO NOTHING
+            """, unresolved)
+            metrics.increment('facts_unresolved', len(unresolved))
+
+        self._advance_fact_watermark(cursor, max(row[0] for row in measurements))
+        return len(facts)
+
+    def maintain_partitions(self, months_ahead: int, retention_months: int, drop_expired: bool = False):
+        """Create upcoming fact partitions and retire expired ones"""
+        with self.connection(), self.transaction() as cursor:
+            self.partitions.create_upcoming(cursor, months_ahead)
+            expired = self.partitions.apply_retention(cursor, retention_months, drop_expired)
+
+        if expired:
+            print(f"{'Dropped' if drop_expired else 'Detached'} fact partitions: {', '.join(expired)}")
+
+    def run_transformation(self, full_rebuild: bool = False) -> Dict[str, StepResult]:
+        """Execute data warehouse transformation
+
+        Only measurements added since the last successful run are turned into
+        facts, unless `full_rebuild` is set, which reloads every fact.
+        Independent steps run concurrently on their own connections; a
+        failed step only stops the steps that depend on it. With an export
+        directory, new facts and dimension snapshots are also written to
+        Parquet files. A failing schema setup is raised, since no step
+        could run without it.
+        """
+        self.initialize_schema()
+
+        steps = [
+            Step('dim_locations', lambda cursor: self._populate_dimension(cursor, 'dim_locations')),
+            Step('dim_parameters', lambda cursor: self._populate_dimension(cursor, 'dim_parameters')),
+            Step('dim_time', self._populate_time_dimension),
+            Step('fact_air_quality', lambda cursor: self._populate_fact_table(cursor, full_rebuild),
+                 depends_on=('dim_locations', 'dim_parameters', 'dim_time')),
+            Step('rollups', lambda cursor: self._refresh_rollups(cursor, full_rebuild),
+                 depends_on=('fact_air_quality',)),
+        ]
+        if self.exporter:
+            steps.append(Step('parquet_export', lambda cursor: self.exporter.export(cursor, full_rebuild),
+                              depends_on=('fact_air_quality',)))
+        self.step_results = run_dag(steps, self._step_cursor, max_workers=self.max_workers)
+
+        for name, result in self.step_results.items():
+            metrics.observe('transform_step', result.seconds, step=name, status=result.status)
+            if result.status != 'success':
+                print(f"Transformation step {name} {result.status}: {result.error}")
+
+        return self.step_results
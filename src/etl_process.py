@@ -1,8 +1,21 @@
 import logging
+import threading
+from datetime import date, datetime
+from typing import Dict, Iterable, Iterator, Optional, Tuple
 from .db import Database
-from .api import OpenAQClient
-from .db import DataWarehouseTransformer
-from .config import get_db_params, get_api_config
+from .api import OpenAQClient, ResponseCache, ResponseArchive
+from .db import DataWarehouseTransformer, ConnectionPool, PageParser, Checkpoint
+from .db.record_mapper import MappedPage
+from .pipeline import run_pipelined, run_sharded
+from .metrics import metrics
+from .config import (get_db_params, get_api_config, get_load_config, get_warehouse_config,
+                     get_partition_config, get_pool_config, get_metrics_config)
+
+
+METADATA_ENDPOINTS = ('parameters', 'locations')
+ALL_ENDPOINTS = METADATA_ENDPOINTS + ('measurements',)
+# Oldest first, so pages already loaded do not shift while new measurements arrive
+MEASUREMENT_ORDER = {'order_by': 'datetime', 'sort': 'asc'}
 
 
 class AirQualityETL:
@@ -12,51 +25,241 @@ class AirQualityETL:
 
         self.db_params = get_db_params()
         self.api_config = get_api_config()
+        self.load_config = get_load_config()
+        self.warehouse_config = get_warehouse_config()
+        self.partition_config = get_partition_config()
+        self.pool_config = get_pool_config()
+        self.metrics_config = get_metrics_config()
 
-        self.raw_db = Database(self.db_params)
+        self.pool = ConnectionPool(
+            self.db_params,
+            min_size=self.pool_config['MIN_SIZE'],
+            max_size=self.pool_config['MAX_SIZE']
+        )
+        self.raw_db = Database(
+            self.db_params,
+            batch_size=self.load_config['BATCH_SIZE'],
+            pool=self.pool,
+            unknown_locations=self.load_config['UNKNOWN_LOCATIONS'],
+            quality_checks=self.load_config['QUALITY_CHECKS']
+        )
+        self.parser = PageParser(
+            processes=self.load_config['PARSE_WORKERS'] if self.load_config['PARSE_IN_PROCESSES'] else 0
+        )
         self.api = OpenAQClient(
             base_url=self.api_config['BASE_URL'],
             api_key=self.api_config['API_KEY'],
             limit=self.api_config['DEFAULT_LIMIT'],
-            delay=self.api_config['REQUEST_DELAY']
+            delay=self.api_config['REQUEST_DELAY'],
+            concurrency=self.api_config['CONCURRENCY'],
+            max_pages=self.api_config['MAX_PAGES'],
+            cache=ResponseCache(self.api_config['CACHE_DIR'], ttl=self.api_config['CACHE_TTL_SECONDS']),
+            cached_endpoints=self.api_config['CACHED_ENDPOINTS'],
+            archive=ResponseArchive(self.api_config['ARCHIVE_DIR']) if self.api_config['ARCHIVE_DIR'] else None,
+            pool_size=self.api_config['CONCURRENCY'] * self.load_config['EXTRACT_WORKERS']
         )
         self.warehouse_transformer = DataWarehouseTransformer
-        self.transformer = self.warehouse_transformer(self.db_params)
+        self.transformer = self.warehouse_transformer(
+            self.db_params,
+            calendar_start=self.warehouse_config['CALENDAR_START'],
+            calendar_days_ahead=self.warehouse_config['CALENDAR_DAYS_AHEAD'],
+            key_cache_size=self.warehouse_config['KEY_CACHE_SIZE'],
+            pool=self.pool,
+            explain=self.metrics_config['EXPLAIN'],
+            max_workers=self.warehouse_config['TRANSFORM_WORKERS'],
+            export_dir=self.warehouse_config['EXPORT_DIR'],
+            export_chunk_size=self.warehouse_config['EXPORT_CHUNK_SIZE']
+        )
+        if self.warehouse_config['INLINE_FACTS']:
+            self.raw_db.fact_loader = self.transformer.load_facts
+
+        # jobs share raw_db's connection, so they never overlap inside this process
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._checkpoints: Dict[str, Checkpoint] = {}
+        self._queued_pages: Dict[str, int] = {}
+
+    def request_stop(self) -> None:
+        """Finish the batch being loaded, then skip the rest of the current run"""
+        self._stop.set()
+
+    def run_exclusive(self, job_name: str, endpoints: Iterable[str] = ALL_ENDPOINTS, transform: bool = True) -> None:
+        """Run unless another process holds this job's advisory lock"""
+        with self._run_lock:
+            if self._stop.is_set():
+                return
+            with self.pool.advisory_lock(job_name) as acquired:
+                if not acquired:
+                    self.logger.info(f"Skipping {job_name}: already running elsewhere")
+                    metrics.increment('job_skipped', job=job_name)
+                    return
+                self.run(endpoints=endpoints, transform=transform)
+
+    def replay(self, archive_dir: str, full_rebuild: bool = False,
+               date_from: date = None, date_to: date = None) -> None:
+        """Run the ETL from archived API pages instead of the network"""
+        self.run(full_rebuild=full_rebuild, replay=(ResponseArchive(archive_dir), date_from, date_to))
+
+    def run(self, full_rebuild: bool = False, endpoints: Iterable[str] = ALL_ENDPOINTS,
+            replay: tuple = None, transform: bool = True) -> None:
+        """Main ETL process
+
+        With `transform` unset only the raw tables are loaded. The
+        scheduler transforms from the measurements job alone: a transform
+        running beside another replica's inline fact load could move the
+        rollup and export watermarks past facts that are not committed yet.
+        """
+        started_at = datetime.utcnow()
+        metrics_before = metrics.snapshot()
+        status, error = 'success', None
+
+        backfill = full_rebuild or replay is not None
 
-    def run(self) -> None:
-        """Main ETL process"""
         try:
+            self.transformer.invalidate_key_cache()
+            self.transformer.query_plans = {}
+            self.transformer.step_results = {}
+
+            if backfill:
+                self._defer_indexes()
+
             self.logger.info("Starting raw data extraction and loading...")
-            self._extract_and_load_raw_data()
+            with metrics.timer('stage', stage='extract_load'):
+                failures = self._extract_and_load_raw_data(endpoints, replay)
+
+            if failures:
+                # What did load is still transformed; the run is recorded as incomplete
+                status = 'partial'
+                error = f"{len(failures)} shards failed: " + '; '.join(
+                    f"{name}: {str(e)}" for name, e in failures.items())
+
+            if self._stop.is_set():
+                status = 'stopped'
+                self.logger.info("Shutdown requested, skipping transformation")
+                return
+
+            if not transform:
+                self.logger.info("Raw data loaded; the warehouse is transformed by the measurements job")
+                return
 
             self.logger.info("Starting data warehouse transformation...")
-            self.transformer.run_transformation()
+            with metrics.timer('stage', stage='transform'):
+                results = self.transformer.run_transformation(full_rebuild=full_rebuild)
+                self.transformer.maintain_partitions(
+                    self.partition_config['MONTHS_AHEAD'],
+                    self.partition_config['RETENTION_MONTHS'],
+                    self.partition_config['DROP_EXPIRED']
+                )
 
-            self.logger.info("ETL process completed successfully")
+            unsuccessful = {name: result for name, result in results.items() if result.status != 'success'}
+            if unsuccessful:
+                # A run none of whose steps succeeded transformed nothing
+                status = 'failed' if len(unsuccessful) == len(results) else 'partial'
+                step_errors = f"{len(unsuccessful)} transformation steps did not succeed: " + '; '.join(
+                    f"{name} {result.status}: {result.error}" for name, result in unsuccessful.items())
+                error = f"{error}; {step_errors}" if error else step_errors
+
+            self.logger.info(f"Dimension key cache: {self.transformer.key_cache.stats()}")
+            if status == 'failed':
+                self.logger.error(f"ETL process failed: {error}")
+            elif status == 'partial':
+                self.logger.warning(f"ETL process completed with failures: {error}")
+            else:
+                self.logger.info("ETL process completed successfully")
 
         except Exception as e:
+            status, error = 'failed', str(e)
             self.logger.error(f"Error during ETL process: {str(e)}")
 
-    def _extract_and_load_raw_data(self) -> None:
-        """Extract data from API and load into raw tables"""
+        finally:
+            if backfill:
+                self._restore_indexes()
+            self._record_run(started_at, status, error, metrics_before)
+
+    def _defer_indexes(self) -> None:
+        """Drop secondary indexes and foreign keys so a backfill only maintains the keys it needs"""
+        self.logger.info("Deferring secondary indexes and foreign keys for the backfill...")
+        with self.raw_db.connection(), self.raw_db.transaction() as cursor:
+            self.raw_db.indexes.defer(cursor)
+            self.transformer.indexes.defer(cursor)
+
+    def _restore_indexes(self) -> None:
+        """Rebuild what _defer_indexes dropped"""
+        self.logger.info("Rebuilding deferred indexes and foreign keys...")
+        try:
+            with metrics.timer('stage', stage='index_rebuild'):
+                with self.raw_db.connection(), self.raw_db.transaction() as cursor:
+                    self.raw_db.indexes.restore(cursor)
+                    self.transformer.indexes.restore(cursor)
+        except Exception as e:
+            self.logger.error(f"Failed to rebuild indexes: {str(e)}")
+
+    def index_report(self) -> Dict:
+        """Report unused and missing indexes"""
+        with self.raw_db.connection():
+            return self.raw_db.index_report()
+
+    def _record_run(self, started_at: datetime, status: str, error: str, metrics_before: Dict) -> None:
+        """Write this run's metrics to etl_run_summary"""
+        run_metrics = metrics.delta(metrics_before, metrics.snapshot())
+        run_metrics['key_cache'] = self.transformer.key_cache.stats()
+        run_metrics['transform_steps'] = {name: result._asdict()
+                                          for name, result in self.transformer.step_results.items()}
+        try:
+            with self.raw_db.connection():
+                self.raw_db.record_run(started_at, datetime.utcnow(), status, error,
+                                       run_metrics, self.transformer.query_plans)
+        except Exception as e:
+            self.logger.error(f"Failed to record run summary: {str(e)}")
+
+    def close(self) -> None:
+        """Release every pooled db connection and the parser's worker processes"""
+        self.parser.close()
+        self.pool.close()
+
+    def _extract_and_load_raw_data(self, endpoints: Iterable[str] = ALL_ENDPOINTS,
+                                   replay: tuple = None) -> Dict[str, Exception]:
+        """Extract data from API (or an archive when replaying) and load into raw tables
+
+        Returns the shards, or archived files, that still failed after their retries.
+        """
+        failures: Dict[str, Exception] = {}
         try:
             self.raw_db.connect()
             self.raw_db.initialize_tables()
+            self.raw_db.maintain_partitions(
+                self.partition_config['MONTHS_AHEAD'],
+                self.partition_config['RETENTION_MONTHS'],
+                self.partition_config['DROP_EXPIRED']
+            )
+            if self.raw_db.fact_loader:
+                self.transformer.initialize_schema()
+                if 'measurements' in endpoints:
+                    self.transformer.catch_up_facts()
+
+            self.raw_db.load_watermarks()
+            self.raw_db.load_location_index()
+            self.raw_db.load_preferred_units()
+            self._checkpoints = self.raw_db.load_checkpoints()
+            self._queued_pages = {}
 
-            self.logger.info("Fetching parameters...")
-            parameters_data = self.api.generic_get('parameters')
-            if parameters_data:
-                self.raw_db.generic_insert('parameters', parameters_data)
+            if replay:
+                for endpoint in endpoints:
+                    if self._stop.is_set():
+                        break
+                    failures.update(self._replay_endpoint(endpoint, *replay))
+                return failures
 
-            self.logger.info("Fetching locations...")
-            locations_data = self.api.generic_get('locations')
-            if locations_data:
-                self.raw_db.generic_insert('locations', locations_data)
+            for endpoint in METADATA_ENDPOINTS:
+                if endpoint in endpoints and not self._stop.is_set():
+                    self.logger.info(f"Fetching {endpoint}...")
+                    self._stream_endpoint(endpoint)
 
-            self.logger.info("Fetching measurements...")
-            measurements_data = self.api.generic_get('measurements')
-            if measurements_data:
-                self.raw_db.generic_insert('measurements', measurements_data)
+            if 'measurements' in endpoints and not self._stop.is_set():
+                failures.update(self._extract_measurements())
+                self._lookup_unknown_locations()
+
+            return failures
 
         except Exception as e:
             self.logger.error(f"Error in extract and load process: {str(e)}")
@@ -64,3 +267,133 @@ class AirQualityETL:
         finally:
             self.raw_db.close()
 
+    def _extract_measurements(self) -> Dict[str, Exception]:
+        """Fetch measurements, sharded by country or location when configured
+
+        Returns the shards that failed after EXTRACT_SHARD_ATTEMPTS attempts.
+        """
+        lookback_hours = self.load_config['WATERMARK_LOOKBACK_HOURS']
+        max_lookback_hours = self.load_config['WATERMARK_MAX_LOOKBACK_HOURS']
+        initial_lookback_hours = self.load_config['INITIAL_LOOKBACK_HOURS']
+        shard_by = self.load_config['SHARD_BY']
+        shards = (self.raw_db.measurement_shards(shard_by, lookback_hours, max_lookback_hours, initial_lookback_hours)
+                  if shard_by != 'none' else {})
+
+        if not shards:
+            date_from = self.raw_db.measurements_date_from(lookback_hours, max_lookback_hours, initial_lookback_hours)
+            self.logger.info(f"Fetching measurements since {date_from or 'the beginning'}...")
+            params = {**MEASUREMENT_ORDER, 'date_from': date_from} if date_from else dict(MEASUREMENT_ORDER)
+            self._stream_endpoint('measurements', params)
+            return {}
+
+        streams = {f"measurements:{name}": {**MEASUREMENT_ORDER, **params} for name, params in shards.items()}
+        # Shards interrupted in an earlier run are finished even if they are no longer planned
+        for stream, checkpoint in self._checkpoints.items():
+            if checkpoint.endpoint == 'measurements' and stream.startswith('measurements:'):
+                streams.setdefault(stream, checkpoint.params)
+
+        self.logger.info(f"Fetching measurements in {len(streams)} shards by {shard_by}...")
+        pages, failures = run_sharded(
+            {stream: (lambda stream=stream, params=params: self._open_stream(stream, 'measurements', params))
+             for stream, params in streams.items()},
+            lambda item: self._load_stream_page('measurements', item),
+            workers=self.load_config['EXTRACT_WORKERS'],
+            queue_size=self.load_config['QUEUE_SIZE'],
+            max_attempts=self.load_config['SHARD_ATTEMPTS'],
+            stop_requested=self._stop.is_set
+        )
+        self.logger.info(f"Loaded {pages} pages of measurements")
+
+        for name, error in failures.items():
+            metrics.increment('shard_failed', endpoint='measurements')
+            self.logger.error(f"Measurements shard {name} failed: {str(error)}")
+        return failures
+
+    def _lookup_unknown_locations(self) -> None:
+        """Fetch locations/{id} for location ids first seen in measurements, then load their parked measurements"""
+        location_ids = self.raw_db.take_unknown_location_ids(self.load_config['LOCATION_LOOKUP_LIMIT'])
+        if location_ids:
+            self.logger.info(f"Looking up {len(location_ids)} unknown locations...")
+        for location_id in location_ids:
+            if self._stop.is_set():
+                break
+            try:
+                records = self.api.get_location(location_id)
+                self.raw_db.insert_mapped('locations', self.parser.parse('locations', records))
+            except Exception as e:
+                self.logger.warning(f"Lookup of location {location_id} failed: {str(e)}")
+
+        released = self.raw_db.load_pending_measurements()
+        if released:
+            self.logger.info(f"Loaded {released} parked measurements of locations found since")
+
+    def _replay_endpoint(self, endpoint: str, archive: ResponseArchive,
+                         date_from: date = None, date_to: date = None) -> Dict[str, Exception]:
+        """Load an endpoint's archived pages, reading and decoding files on the worker pool
+
+        Metadata pages are upserted, so they are replayed one file at a time
+        in fetch order and a newer copy of a record always wins. Returns the
+        archived files that could not be replayed.
+        """
+        paths = archive.files(endpoint, date_from, date_to)
+        self.logger.info(f"Replaying {len(paths)} archived pages of {endpoint}...")
+
+        pages, failures = run_sharded(
+            {path: (lambda path=path: self.parser.iter_parsed(endpoint, [archive.read(path)])) for path in paths},
+            lambda page: self.raw_db.insert_mapped(endpoint, page),
+            workers=1 if endpoint in METADATA_ENDPOINTS else self.load_config['EXTRACT_WORKERS'],
+            queue_size=self.load_config['QUEUE_SIZE'],
+            max_attempts=1,
+            stop_requested=self._stop.is_set
+        )
+        self.logger.info(f"Replayed {pages} pages of {endpoint}")
+
+        for path, error in failures.items():
+            metrics.increment('shard_failed', endpoint=endpoint)
+            self.logger.error(f"Failed to replay {path}: {str(error)}")
+        return failures
+
+    def _open_stream(self, stream: str, endpoint: str,
+                     params: Dict = None) -> Iterator[Tuple[Checkpoint, Optional[MappedPage]]]:
+        """Parsed pages of a stream, each tagged with the checkpoint to commit with it
+
+        The stream resumes after the last page loaded by an earlier run, or
+        queued by an earlier attempt in this run, with that run's params.
+        A final (checkpoint, None) item marks the stream as complete.
+        """
+        resumed = self._checkpoints.get(stream)
+        if resumed:
+            params = resumed.params
+        params = params or {}
+        last_page = max(resumed.page if resumed else 0, self._queued_pages.get(stream, 0))
+        if last_page:
+            self.logger.info(f"Resuming {stream} after page {last_page}")
+
+        pages = self.parser.iter_parsed(endpoint, self.api.iter_pages(endpoint, params, start_page=last_page + 1))
+        try:
+            for number, page in enumerate(pages, last_page + 1):
+                self._queued_pages[stream] = number
+                yield Checkpoint(stream, endpoint, params, number), page
+        finally:
+            pages.close()
+
+        yield Checkpoint(stream, endpoint, params, self._queued_pages.get(stream, last_page), done=True), None
+
+    def _load_stream_page(self, endpoint: str, item: Tuple[Checkpoint, Optional[MappedPage]]) -> bool:
+        """Load a page of a stream; returns False for the end-of-stream marker, which holds no page"""
+        checkpoint, page = item
+        if checkpoint.done:
+            self.raw_db.clear_checkpoint(checkpoint.stream)
+            return False
+        self.raw_db.insert_mapped(endpoint, page, checkpoint=checkpoint)
+        return True
+
+    def _stream_endpoint(self, endpoint: str, params: Dict = None) -> None:
+        """Insert each page of an endpoint while the following pages are fetched"""
+        pages = run_pipelined(
+            self._open_stream(endpoint, endpoint, params),
+            lambda item: self._load_stream_page(endpoint, item),
+            queue_size=self.load_config['QUEUE_SIZE'],
+            stop_requested=self._stop.is_set
+        )
+        self.logger.info(f"Loaded {pages} pages of {endpoint}")
@@ -0,0 +1,130 @@
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, Tuple
+
+PREFIX = 'openaq_etl'
+
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict[str, str]) -> MetricKey:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def _render_key(name: str, labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return name
+    rendered = ','.join(f'{label}="{value}"' for label, value in labels)
+    return f"{name}{{{rendered}}}"
+
+
+class Metrics:
+    """Process-wide counters and timers, exposed as Prometheus text or JSON snapshots"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[MetricKey, float] = {}
+        self._timers: Dict[MetricKey, list] = {}
+        self._server = None
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            count_sum = self._timers.setdefault(key, [0, 0.0])
+            count_sum[0] += 1
+            count_sum[1] += seconds
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        """Record how long a block took, whether or not it raised"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Current values keyed by rendered metric name, suitable for JSON"""
+        with self._lock:
+            return {
+                'counters': {_render_key(*key): value for key, value in self._counters.items()},
+                'timers': {_render_key(*key): {'count': count, 'seconds': round(total, 6)}
+                           for key, (count, total) in self._timers.items()}
+            }
+
+    @staticmethod
+    def delta(before: Dict[str, Dict], after: Dict[str, Dict]) -> Dict[str, Dict]:
+        """What changed between two snapshots, e.g. over one ETL run"""
+        counters = {
+            name: value - before['counters'].get(name, 0)
+            for name, value in after['counters'].items()
+            if value != before['counters'].get(name, 0)
+        }
+        timers = {}
+        for name, timer in after['timers'].items():
+            previous = before['timers'].get(name, {'count': 0, 'seconds': 0.0})
+            if timer['count'] != previous['count']:
+                timers[name] = {
+                    'count': timer['count'] - previous['count'],
+                    'seconds': round(timer['seconds'] - previous['seconds'], 6)
+                }
+        return {'counters': counters, 'timers': timers}
+
+    def render_prometheus(self) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name in sorted({key[0] for key in self._counters}):
+                lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+                for (metric, labels), value in self._counters.items():
+                    if metric == name:
+                        lines.append(f"{_render_key(f'{PREFIX}_{name}_total', labels)} {value}")
+
+            for name in sorted({key[0] for key in self._timers}):
+                lines.append(f"# TYPE {PREFIX}_{name}_seconds summary")
+                for (metric, labels), (count, total) in self._timers.items():
+                    if metric == name:
+                        lines.append(f"{_render_key(f'{PREFIX}_{name}_seconds_count', labels)} {count}")
+                        lines.append(f"{_render_key(f'{PREFIX}_{name}_seconds_sum', labels)} {total:.6f}")
+
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int, host: str = '0.0.0.0') -> None:
+        """Serve /metrics on a background thread"""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') != '/metrics':
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+
+                payload = registry.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True).start()
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+metrics = Metrics()
@@ -0,0 +1,111 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+_DONE = object()
+
+
+def _put(page_queue: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    """Put an item, giving up once the consumer has stopped"""
+    while not stop.is_set():
+        try:
+            page_queue.put(item, timeout=1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _forward_pages(pages: Iterable[List[Dict]], page_queue: queue.Queue, stop: threading.Event) -> None:
+    try:
+        for page in pages:
+            if not _put(page_queue, page, stop):
+                break
+    finally:
+        close = getattr(pages, 'close', None)
+        if close:
+            close()
+
+
+def run_sharded(shards: Dict[str, Callable[[], Iterable[List[Dict]]]], load: Callable[[List[Dict]], Any],
+                workers: int = 4, queue_size: int = 2, max_attempts: int = 3, retry_delay: float = 2,
+                stop_requested: Callable[[], bool] = None) -> Tuple[int, Dict[str, Exception]]:
+    """Fetch several shards on a worker pool and load all their pages on the calling thread
+
+    Each shard is a callable that opens a fresh page iterator, so a failed
+    shard can be retried from scratch without touching the others. Pages
+    from all shards share one bounded queue; `load` runs on the calling
+    thread, which keeps the db connection single-threaded.
+    Once `stop_requested` returns True the page being loaded is finished
+    and the rest are abandoned.
+    Returns the number of pages loaded, not counting items for which `load`
+    returns False such as end-of-stream markers, and the shards that still
+    failed after `max_attempts`.
+    """
+    page_queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    failures: Dict[str, Exception] = {}
+
+    def fetch_shard(name: str, open_pages: Callable[[], Iterable[List[Dict]]]) -> None:
+        for attempt in range(1, max_attempts + 1):
+            if stop.is_set():
+                return
+            try:
+                _forward_pages(open_pages(), page_queue, stop)
+                return
+            except Exception as e:
+                if attempt == max_attempts:
+                    failures[name] = e
+                    return
+                time.sleep(retry_delay * attempt)
+
+    def produce() -> None:
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="shard") as executor:
+                for name, open_pages in shards.items():
+                    executor.submit(fetch_shard, name, open_pages)
+        finally:
+            page_queue.put(_DONE)
+
+    producer = threading.Thread(target=produce, name="page-producer", daemon=True)
+    producer.start()
+
+    loaded = 0
+    try:
+        while True:
+            page = page_queue.get()
+            if page is _DONE:
+                break
+            if load(page) is not False:
+                loaded += 1
+            if stop_requested and stop_requested():
+                break
+    finally:
+        stop.set()
+        # Unblock producers waiting on a full queue so they can exit
+        while producer.is_alive():
+            try:
+                page_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        producer.join()
+
+    return loaded, failures
+
+
+def run_pipelined(pages: Iterable[List[Dict]], load: Callable[[List[Dict]], Any], queue_size: int = 2,
+                  stop_requested: Callable[[], bool] = None) -> int:
+    """Load pages while the next ones are still being fetched
+
+    `pages` is drained on a background thread into a bounded queue, so the
+    producer blocks once `queue_size` pages are waiting.
+    Returns the number of pages loaded, counted as in run_sharded.
+    """
+    loaded, failures = run_sharded({'pages': lambda: pages}, load, workers=1, queue_size=queue_size,
+                                   max_attempts=1, stop_requested=stop_requested)
+    if failures:
+        raise failures['pages']
+
+    return loaded
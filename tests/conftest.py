@@ -0,0 +1,18 @@
+"""Fixtures for tests that need a Postgres server, given by BENCH_DB_* (falling back to DB_*)"""
+import pytest
+
+
+@pytest.fixture
+def db_params():
+    psycopg2 = pytest.importorskip("psycopg2")
+    pytest.importorskip("dotenv")
+    from benchmarks.postgres import admin_params_from_env, throwaway_database
+
+    admin_params = admin_params_from_env()
+    try:
+        psycopg2.connect(**admin_params).close()
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"Postgres is not available: {e}")
+
+    with throwaway_database(admin_params) as params:
+        yield params
@@ -0,0 +1,95 @@
+"""Page fetching order and the shared rate limiter"""
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("psycopg2")
+pytest.importorskip("dotenv")
+pytest.importorskip("requests")
+
+from src.api import OpenAQClient, TokenBucket, rate_limiter  # noqa: E402
+
+
+def _client(page_sizes, limit=2, concurrency=3, max_pages=None, slow_first=False):
+    """Client whose pages hold page_sizes[page - 1] records; returns it and the pages requested"""
+    client = OpenAQClient('http://openaq.test', 'key', limit=limit, delay=0, concurrency=concurrency,
+                          max_pages=max_pages)
+    requested = []
+    lock = threading.Lock()
+
+    def fetch_page(endpoint, page, params=None):
+        with lock:
+            requested.append(page)
+        if slow_first:
+            # Later pages finish first
+            time.sleep(0.05 / page)
+        size = page_sizes[page - 1] if page <= len(page_sizes) else 0
+        return [{'page': page, 'row': row} for row in range(size)]
+
+    client._fetch_page = fetch_page
+    return client, requested
+
+
+def _page_numbers(pages):
+    return [page[0]['page'] for page in pages]
+
+
+def test_short_first_page_is_the_only_request():
+    client, requested = _client([1])
+
+    assert _page_numbers(client.iter_pages('measurements')) == [1]
+    assert requested == [1]
+
+
+def test_pages_are_yielded_in_page_order_when_fetched_concurrently():
+    client, requested = _client([2, 2, 2, 2, 1], slow_first=True)
+
+    assert _page_numbers(client.iter_pages('measurements')) == [1, 2, 3, 4, 5]
+    assert requested[0] == 1
+    assert sorted(requested)[:5] == [1, 2, 3, 4, 5]
+
+
+def test_pages_start_at_start_page_and_stop_at_the_page_cap():
+    client, requested = _client([2, 2, 2, 2, 2, 2], max_pages=4)
+
+    assert _page_numbers(client.iter_pages('measurements', start_page=3)) == [3, 4]
+    assert sorted(requested) == [3, 4]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limiter, 'time', fake)
+    return fake
+
+
+def test_bucket_allows_a_burst_of_capacity_then_waits_for_the_rate(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.sleeps == []
+
+    bucket.acquire()
+    assert clock.sleeps == [0.5]
+
+
+def test_pause_holds_back_every_caller(clock):
+    bucket = TokenBucket(rate=10, capacity=2)
+    bucket.pause(30)
+
+    bucket.acquire()
+    assert clock.now >= 30
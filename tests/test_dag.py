@@ -0,0 +1,59 @@
+"""Dependency-aware transformation steps"""
+from contextlib import contextmanager
+
+import pytest
+
+pytest.importorskip("psycopg2")
+pytest.importorskip("dotenv")
+pytest.importorskip("requests")
+
+from src.db.dag import Step, run_dag  # noqa: E402
+
+
+@contextmanager
+def _cursor():
+    yield None
+
+
+def _fail(cursor):
+    raise Exception("boom")
+
+
+def test_failed_step_skips_its_direct_and_indirect_dependents_only():
+    results = run_dag([
+        Step('dim', _fail),
+        Step('fact', lambda cursor: 3, depends_on=('dim',)),
+        Step('rollup', lambda cursor: 2, depends_on=('fact',)),
+        Step('calendar', lambda cursor: 5),
+    ], _cursor, max_workers=2)
+
+    assert {name: result.status for name, result in results.items()} == {
+        'dim': 'failed', 'fact': 'skipped', 'rollup': 'skipped', 'calendar': 'success'
+    }
+    assert results['dim'].error == "boom"
+    assert results['calendar'].rows == 5
+
+
+def test_step_runs_once_all_its_dependencies_succeeded():
+    order = []
+
+    def step(name, rows):
+        def run(cursor):
+            order.append(name)
+            return rows
+        return run
+
+    results = run_dag([
+        Step('export', step('export', 1), depends_on=('fact', 'dim')),
+        Step('fact', step('fact', 2), depends_on=('dim',)),
+        Step('dim', step('dim', 3)),
+    ], _cursor, max_workers=3)
+
+    assert order == ['dim', 'fact', 'export']
+    assert all(result.status == 'success' for result in results.values())
+
+
+def test_unknown_dependency_is_skipped():
+    results = run_dag([Step('fact', lambda cursor: 1, depends_on=('missing',))], _cursor)
+
+    assert results['fact'].status == 'skipped'
@@ -0,0 +1,90 @@
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("psycopg2")
+pytest.importorskip("dotenv")
+pytest.importorskip("requests")
+
+from src.db import Database, DataWarehouseTransformer  # noqa: E402
+
+MEASURED_AT = datetime(2024, 1, 1, 10)
+
+
+def _count(cursor, table: str) -> int:
+    cursor.execute(f"SELECT COUNT(*) FROM {table}")
+    return cursor.fetchone()[0]
+
+
+def test_measurements_load_facts_once_their_parameter_arrives(db_params):
+    raw_db = Database(db_params)
+    transformer = DataWarehouseTransformer(db_params, calendar_start='2023-12-01', calendar_days_ahead=60)
+
+    with raw_db.connection():
+        raw_db.initialize_tables()
+        transformer.initialize_schema()
+        with raw_db.transaction() as cursor:
+            raw_db.partitions.ensure(cursor, [MEASURED_AT])
+            cursor.execute("""
+                INSERT INTO locations (location_id, name, country) VALUES (1, 'Station', 'US');
+                INSERT INTO parameters (parameter_id, name, preferred_unit) VALUES (2, 'pm25', 'µg/m³');
+                INSERT INTO measurements (location_id, parameter, value, unit, timestamp_utc)
+                VALUES (1, 'pm25', 12.5, 'µg/m³', %(at)s), (1, 'o3', 0.03, 'ppm', %(at)s);
+            """, {'at': MEASURED_AT})
+
+        results = transformer.run_transformation()
+        assert all(result.status == 'success' for result in results.values())
+        with raw_db.transaction() as cursor:
+            assert _count(cursor, 'fact_air_quality') == 1
+            assert _count(cursor, 'etl_unresolved_measurements') == 1
+
+        # The o3 parameter arrives after its measurement; the watermark has already moved past it
+        with raw_db.transaction() as cursor:
+            cursor.execute("INSERT INTO parameters (parameter_id, name, preferred_unit) VALUES (3, 'o3', 'ppm')")
+
+        transformer.run_transformation()
+        with raw_db.transaction() as cursor:
+            assert _count(cursor, 'fact_air_quality') == 2
+            assert _count(cursor, 'etl_unresolved_measurements') == 0
+
+
+def _record(parameter: str, value: float, unit: str) -> dict:
+    return {
+        'locationId': 1, 'parameter': parameter, 'value': value, 'unit': unit,
+        'date': {'utc': '2024-01-01T10:00:00Z', 'local': '2024-01-01T05:00:00-05:00'},
+        'coordinates': {'latitude': 40.7, 'longitude': -74.0}, 'country': 'US', 'city': 'New York'
+    }
+
+
+def test_inline_facts_park_unresolved_measurements_and_move_the_watermark(db_params):
+    raw_db = Database(db_params, quality_checks=False)
+    transformer = DataWarehouseTransformer(db_params, calendar_start='2023-12-01', calendar_days_ahead=60)
+    raw_db.fact_loader = transformer.load_facts
+
+    with raw_db.connection():
+        raw_db.initialize_tables()
+        transformer.initialize_schema()
+        with raw_db.transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO locations (location_id, name, country) VALUES (1, 'Station', 'US');
+                INSERT INTO parameters (parameter_id, name, preferred_unit) VALUES (2, 'pm25', 'µg/m³');
+            """)
+        raw_db.load_location_index()
+
+        raw_db.generic_insert('measurements', [_record('pm25', 12.5, 'µg/m³'), _record('o3', 0.03, 'ppm')])
+        with raw_db.transaction() as cursor:
+            assert _count(cursor, 'fact_air_quality') == 1
+            assert _count(cursor, 'etl_unresolved_measurements') == 1
+            cursor.execute("""
+                SELECT last_measurement_id = (SELECT MAX(measurement_id) FROM measurements)
+                FROM etl_transform_state WHERE step_name = 'fact_air_quality'
+            """)
+            assert cursor.fetchone()[0]
+
+        with raw_db.transaction() as cursor:
+            cursor.execute("INSERT INTO parameters (parameter_id, name, preferred_unit) VALUES (3, 'o3', 'ppm')")
+
+        transformer.run_transformation()
+        with raw_db.transaction() as cursor:
+            assert _count(cursor, 'fact_air_quality') == 2
+            assert _count(cursor, 'etl_unresolved_measurements') == 0
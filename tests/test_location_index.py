@@ -0,0 +1,49 @@
+"""Location id membership index"""
+import pytest
+
+pytest.importorskip("psycopg2")
+pytest.importorskip("dotenv")
+pytest.importorskip("requests")
+
+from src.db.location_index import LocationIndex  # noqa: E402
+
+
+class FakeCursor:
+    def __init__(self, location_ids):
+        self.rows = [(location_id,) for location_id in location_ids]
+
+    def execute(self, query):
+        pass
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+def test_added_ids_are_members_and_counted_once():
+    index = LocationIndex()
+    index.add([3, 8, 3, 1_000_000])
+
+    assert len(index) == 3
+    assert 3 in index and 8 in index and 1_000_000 in index
+    assert 4 not in index and 999_999 not in index and 2_000_000 not in index
+
+
+def test_ids_outside_the_bitmap_fall_back_to_a_set():
+    index = LocationIndex()
+    index.add([-5, 'abc', None])
+
+    assert len(index) == 2
+    assert -5 in index and 'abc' in index
+    assert None not in index
+
+
+def test_load_replaces_the_index_with_the_table_in_chunks():
+    index = LocationIndex()
+    index.add([99])
+
+    index.load(FakeCursor([10, 7, 2]), chunk_size=2)
+
+    assert index.loaded
+    assert len(index) == 3
+    assert 7 in index and 99 not in index
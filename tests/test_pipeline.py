@@ -0,0 +1,54 @@
+"""Sharded and pipelined page loading"""
+import pytest
+
+pytest.importorskip("psycopg2")
+pytest.importorskip("dotenv")
+pytest.importorskip("requests")
+
+from src.pipeline import run_pipelined, run_sharded  # noqa: E402
+
+
+def test_pages_of_every_shard_are_loaded_and_counted():
+    loaded = []
+
+    pages, failures = run_sharded(
+        {'a': lambda: iter([['a1'], ['a2']]), 'b': lambda: iter([['b1']])},
+        loaded.append,
+        workers=2
+    )
+
+    assert (pages, failures) == (3, {})
+    assert sorted(loaded) == [['a1'], ['a2'], ['b1']]
+
+
+def test_items_loaded_as_false_are_not_counted():
+    pages = run_pipelined(iter([['page'], ['marker']]), lambda page: page != ['marker'])
+
+    assert pages == 1
+
+
+def test_failing_shard_is_retried_from_scratch_then_reported():
+    attempts = []
+
+    def open_pages():
+        attempts.append(len(attempts) + 1)
+        yield ['first']
+        raise Exception("connection reset")
+
+    loaded = []
+    pages, failures = run_sharded({'flaky': open_pages, 'ok': lambda: iter([['ok']])}, loaded.append,
+                                  workers=1, max_attempts=2, retry_delay=0)
+
+    assert attempts == [1, 2]
+    assert list(failures) == ['flaky']
+    assert loaded.count(['first']) == 2
+    assert pages == 3
+
+
+def test_pipelined_failure_is_raised():
+    def pages():
+        yield ['first']
+        raise Exception("boom")
+
+    with pytest.raises(Exception, match="boom"):
+        run_pipelined(pages(), lambda page: None)
@@ -0,0 +1,47 @@
+"""Quality rules limited to some parameters"""
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("psycopg2")
+pytest.importorskip("dotenv")
+pytest.importorskip("requests")
+
+from src.config import QUALITY_RULES  # noqa: E402
+from src.db.quality import QualityValidator  # noqa: E402
+from src.db.record_mapper import MappedPage  # noqa: E402
+
+COLUMNS = ['parameter', 'value', 'unit', 'latitude', 'longitude', 'timestamp_utc']
+
+
+def _page(*measurements):
+    rows = [(parameter, value, unit, 48.1, 11.6, datetime(2024, 1, 1))
+            for parameter, value, unit in measurements]
+    return MappedPage(rows, [dict(zip(COLUMNS, row)) for row in rows], [])
+
+
+def test_negative_temperature_passes_and_negative_concentration_is_rejected():
+    validator = QualityValidator({'measurements': QUALITY_RULES['measurements']})
+
+    passed, rejected = validator.validate('measurements', COLUMNS, _page(
+        ('temperature', -12.5, 'c'),
+        ('pm25', -3.0, 'µg/m³'),
+        ('pm25', 8.0, 'µg/m³'),
+    ))
+
+    assert [row[:2] for row in passed.rows] == [('temperature', -12.5), ('pm25', 8.0)]
+    assert [source['parameter'] for source, _ in rejected['negative_value']] == ['pm25']
+
+
+def test_rule_limited_to_listed_parameters():
+    rule = {'name': 'negative_value', 'check': 'min', 'column': 'value', 'min': 0,
+            'parameter_column': 'parameter', 'parameters': ['pm25']}
+    validator = QualityValidator({'measurements': [rule]})
+
+    passed, rejected = validator.validate('measurements', COLUMNS, _page(
+        ('pm25', -3.0, 'µg/m³'),
+        ('relativehumidity', -1.0, '%'),
+    ))
+
+    assert [row[0] for row in passed.rows] == ['relativehumidity']
+    assert list(rejected) == ['negative_value']
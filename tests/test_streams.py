@@ -0,0 +1,128 @@
+"""Checkpointed streams: resuming, shard retries and the end-of-stream marker"""
+import logging
+import threading
+
+import pytest
+
+pytest.importorskip("psycopg2")
+pytest.importorskip("dotenv")
+pytest.importorskip("requests")
+
+from src.db import Checkpoint  # noqa: E402
+from src.etl_process import AirQualityETL  # noqa: E402
+from src.pipeline import run_sharded  # noqa: E402
+
+STREAM = 'measurements:country=US'
+PARAMS = {'country': 'US', 'date_from': '2024-01-02T00:00:00Z'}
+
+
+class FakeAPI:
+    """Serves numbered pages; pages in `fail_once` raise the first time they are reached"""
+
+    def __init__(self, page_count: int, fail_once=(), fail_always=()):
+        self.pages = [[{'page': number}] for number in range(1, page_count + 1)]
+        self.fail_once = set(fail_once)
+        self.fail_always = set(fail_always)
+        self.requests = []
+
+    def iter_pages(self, endpoint, params=None, start_page=1):
+        self.requests.append((dict(params or {}), start_page))
+        for number in range(start_page, len(self.pages) + 1):
+            if number in self.fail_always or number in self.fail_once:
+                self.fail_once.discard(number)
+                raise Exception(f"page {number} failed")
+            yield self.pages[number - 1]
+
+
+class FakeParser:
+    def iter_parsed(self, schema_key, pages):
+        for page in pages:
+            yield page
+
+
+class FakeDB:
+    def __init__(self):
+        self.loaded = []
+        self.cleared = []
+
+    def insert_mapped(self, endpoint, page, checkpoint=None):
+        self.loaded.append((checkpoint.page, page[0]['page']))
+
+    def clear_checkpoint(self, stream):
+        self.cleared.append(stream)
+
+
+def _etl(api: FakeAPI, checkpoints=None) -> AirQualityETL:
+    etl = AirQualityETL.__new__(AirQualityETL)
+    etl.logger = logging.getLogger(__name__)
+    etl.api = api
+    etl.parser = FakeParser()
+    etl.raw_db = FakeDB()
+    etl._stop = threading.Event()
+    etl._checkpoints = checkpoints or {}
+    etl._queued_pages = {}
+    return etl
+
+
+def _run(etl: AirQualityETL, params=PARAMS, max_attempts: int = 3):
+    return run_sharded(
+        {STREAM: lambda: etl._open_stream(STREAM, 'measurements', params)},
+        lambda item: etl._load_stream_page('measurements', item),
+        workers=1, max_attempts=max_attempts, retry_delay=0
+    )
+
+
+def test_stream_resumes_after_the_checkpointed_page_with_its_params():
+    earlier_params = {'country': 'US', 'date_from': '2024-01-01T00:00:00Z'}
+    api = FakeAPI(page_count=4)
+    etl = _etl(api, {STREAM: Checkpoint(STREAM, 'measurements', earlier_params, 2)})
+
+    items = list(etl._open_stream(STREAM, 'measurements', PARAMS))
+
+    assert api.requests == [(earlier_params, 3)]
+    assert [(checkpoint.page, page) for checkpoint, page in items[:-1]] == [(3, [{'page': 3}]), (4, [{'page': 4}])]
+    assert items[-1] == (Checkpoint(STREAM, 'measurements', earlier_params, 4, done=True), None)
+
+
+def test_end_of_stream_marker_clears_the_checkpoint_without_counting_as_a_page():
+    etl = _etl(FakeAPI(page_count=3))
+
+    pages, failures = _run(etl)
+
+    assert (pages, failures) == (3, {})
+    assert etl.raw_db.loaded == [(1, 1), (2, 2), (3, 3)]
+    assert etl.raw_db.cleared == [STREAM]
+
+
+def test_empty_stream_only_sends_the_end_of_stream_marker():
+    etl = _etl(FakeAPI(page_count=0))
+
+    pages, failures = _run(etl)
+
+    assert (pages, failures) == (0, {})
+    assert etl.raw_db.loaded == []
+    assert etl.raw_db.cleared == [STREAM]
+
+
+def test_retried_shard_resumes_after_the_pages_it_already_queued():
+    api = FakeAPI(page_count=4, fail_once={3})
+    etl = _etl(api)
+
+    pages, failures = _run(etl)
+
+    assert (pages, failures) == (4, {})
+    assert [start_page for _, start_page in api.requests] == [1, 3]
+    assert etl.raw_db.loaded == [(1, 1), (2, 2), (3, 3), (4, 4)]
+    assert etl.raw_db.cleared == [STREAM]
+
+
+def test_failed_shard_keeps_its_checkpoint():
+    api = FakeAPI(page_count=4, fail_always={3})
+    etl = _etl(api)
+
+    pages, failures = _run(etl, max_attempts=2)
+
+    assert pages == 2
+    assert list(failures) == [STREAM]
+    assert etl.raw_db.loaded == [(1, 1), (2, 2)]
+    assert etl.raw_db.cleared == []